@@ -22,6 +22,11 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "-created_at"], name="comment_post_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user.username} on {self.post.id}: {self.content[:20]}"
 
@@ -0,0 +1,78 @@
+"""
+Coalesced engagement notifications.
+
+Likes, comments and shares are not emailed one by one. Each event is appended
+to a per-recipient buffer in Redis, and the first event of a window schedules
+a single ``send_notification_digest`` task ``NOTIFICATION_DIGEST_WINDOW``
+seconds later. That task drains the buffer and sends one email. A viral post
+therefore costs one Celery message and one email per author per window,
+however many people interact with it.
+
+The buffer keeps only the newest ``NOTIFICATION_DIGEST_MAX_EVENTS`` events;
+a per-kind count of every event in the window is kept next to it, so the
+digest can still summarize the rest.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+BUFFER_KEY = "notifications:{email}"
+COUNTS_KEY = "notifications:counts:{email}"
+SCHEDULED_KEY = "notifications:scheduled:{email}"
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def notify(kind, author_email, **event):
+    """Buffer a ``like``/``comment``/``share`` event for ``author_email`` once the transaction commits."""
+    notify_many(kind, [(author_email, event)])
+
+
+def notify_many(kind, events):
+    """Buffer several ``(author_email, event)`` pairs with one Redis round trip once the transaction commits."""
+    if events:
+        transaction.on_commit(lambda: _buffer([(email, {"kind": kind, **event}) for email, event in events]))
+
+
+def _buffer(events):
+    from .tasks import send_notification_digest
+
+    window = settings.NOTIFICATION_DIGEST_WINDOW
+    pipe = _redis().pipeline()
+    for author_email, event in events:
+        buffer_key = BUFFER_KEY.format(email=author_email)
+        counts_key = COUNTS_KEY.format(email=author_email)
+        pipe.rpush(buffer_key, json.dumps(event))
+        pipe.ltrim(buffer_key, -settings.NOTIFICATION_DIGEST_MAX_EVENTS, -1)
+        pipe.hincrby(counts_key, event["kind"], 1)
+        # Outlive the window, so a lost digest task cannot leak the buffer forever.
+        pipe.expire(buffer_key, window * 10)
+        pipe.expire(counts_key, window * 10)
+        pipe.set(SCHEDULED_KEY.format(email=author_email), 1, nx=True, ex=window * 2)
+    replies = pipe.execute()
+    # Six replies per event; the last is the SET NX that claims the digest.
+    for (author_email, _), scheduled in zip(events, replies[5::6]):
+        if scheduled:
+            send_notification_digest.apply_async((author_email,), countdown=window)
+
+
+def drain(author_email):
+    """
+    Remove and return ``(events, counts)`` buffered for ``author_email``:
+    the newest events and the number of events of each kind.
+    """
+    buffer_key = BUFFER_KEY.format(email=author_email)
+    counts_key = COUNTS_KEY.format(email=author_email)
+    pipe = _redis().pipeline()
+    # Clear the flag first: an event that lands after this schedules the next
+    # digest, and one that lands before the drain below is sent in this one.
+    pipe.delete(SCHEDULED_KEY.format(email=author_email))
+    pipe.lrange(buffer_key, 0, -1)
+    pipe.hgetall(counts_key)
+    pipe.delete(buffer_key, counts_key)
+    _, events, counts, _ = pipe.execute()
+    return [json.loads(event) for event in events], {kind.decode(): int(n) for kind, n in counts.items()}
@@ -3,7 +3,15 @@ from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 from django.contrib.auth import get_user_model
 from .models import Like, Comment, Share
+from .notifications import notify, notify_many
+from posts import trending
 from posts.models import Post
+from social_media_feed import bulk, events
+from social_media_feed.writes import create_linked, create_linked_many
+from social_media_feed.loaders import load_related
+from social_media_feed.response_cache import bump_versions, post_entities
+from social_media_feed.pagination import connection_args, paginate
+from social_media_feed.subscriptions import get_broker
 
 User = get_user_model()
 
@@ -14,33 +22,84 @@ class LikeType(DjangoObjectType):
         model = Like
         fields = ("id", "user", "post", "created_at")
 
+    def resolve_user(root, info):
+        return load_related(info, root, "user")
+
+    def resolve_post(root, info):
+        return load_related(info, root, "post")
+
 
 class CommentType(DjangoObjectType):
     class Meta:
         model = Comment
         fields = ("id", "user", "post", "content", "created_at")
 
+    def resolve_user(root, info):
+        return load_related(info, root, "user")
+
+    def resolve_post(root, info):
+        return load_related(info, root, "post")
+
 
 class ShareType(DjangoObjectType):
     class Meta:
         model = Share
         fields = ("id", "user", "post", "message", "created_at")
 
+    def resolve_user(root, info):
+        return load_related(info, root, "user")
+
+    def resolve_post(root, info):
+        return load_related(info, root, "post")
+
+
+class LikeConnection(graphene.relay.Connection):
+    class Meta:
+        node = LikeType
+
+
+class CommentConnection(graphene.relay.Connection):
+    class Meta:
+        node = CommentType
+
+
+class ShareConnection(graphene.relay.Connection):
+    class Meta:
+        node = ShareType
+
 
 # ---------------------- Queries ----------------------
 class Query(graphene.ObjectType):
-    likes = graphene.List(LikeType, post_id=graphene.Int(required=False))
-    comments = graphene.List(CommentType, post_id=graphene.Int(required=True))
-    shares = graphene.List(ShareType, post_id=graphene.Int(required=False))
+    likes = graphene.Field(LikeConnection, **connection_args(post_id=graphene.Int(required=False)))
+    comments = graphene.Field(CommentConnection, **connection_args(post_id=graphene.Int(required=True)))
+    shares = graphene.Field(ShareConnection, **connection_args(post_id=graphene.Int(required=False)))
+
+    async def resolve_likes(root, info, post_id=None, first=None, after=None):
+        likes = Like.objects.filter(post_id=post_id) if post_id else Like.objects.all()
+        return await paginate(likes, LikeConnection, first, after)
+
+    async def resolve_comments(root, info, post_id, first=None, after=None):
+        return await paginate(Comment.objects.filter(post_id=post_id), CommentConnection, first, after)
+
+    async def resolve_shares(root, info, post_id=None, first=None, after=None):
+        shares = Share.objects.filter(post_id=post_id) if post_id else Share.objects.all()
+        return await paginate(shares, ShareConnection, first, after)
 
-    def resolve_likes(root, info, post_id=None):
-        return Like.objects.filter(post_id=post_id) if post_id else Like.objects.all()
 
-    def resolve_comments(root, info, post_id):
-        return Comment.objects.filter(post_id=post_id).order_by("-created_at")
+# ---------------------- Subscriptions ----------------------
+async def _new_comments(post_id):
+    channel = events.COMMENTS_CHANNEL.format(post_id=post_id)
+    async for event in get_broker().listen([channel]):
+        comment = await Comment.objects.select_related("user", "post").filter(pk=event["comment_id"]).afirst()
+        if comment is not None:
+            yield comment
 
-    def resolve_shares(root, info, post_id=None):
-        return Share.objects.filter(post_id=post_id) if post_id else Share.objects.all()
+
+class Subscription(graphene.ObjectType):
+    new_comment = graphene.Field(CommentType, post_id=graphene.Int(required=True))
+
+    def subscribe_new_comment(root, info, post_id):
+        return _new_comments(post_id)
 
 
 # ---------------------- Mutations ----------------------
@@ -55,28 +114,89 @@ class LikePost(graphene.Mutation):
         if user.is_anonymous:
             raise GraphQLError("You must be logged in")
 
-        try:
-            post = Post.objects.get(pk=post_id)
-        except Post.DoesNotExist:
+        like, post = create_linked(
+            Like, "post", Post.objects.filter(pk=post_id).values_list("pk", "content", "author__email"),
+            {"user": user}, counter="likes_count",
+        )
+        if post is None:
             raise GraphQLError("Post not found")
-
-        like, created = Like.objects.get_or_create(user=user, post=post)
-        if not created:
+        if like is None:
             raise GraphQLError("You already liked this post")
 
-        # -------------------- Trigger Celery Task --------------------
-        if created and post.author.email:
-            from .tasks import send_like_notification
-            post_excerpt = (post.content[:50] + "...") if len(post.content) > 50 else post.content
-            send_like_notification.delay(
-                liker_username=user.username,
-                author_email=post.author.email,
+        _, post_content, author_email = post
+        bump_versions(*post_entities(post_id))
+        trending.record(post_id, "like")
+        events.engagement_changed(post_id, likes=1)
+
+        # -------------------- Buffer for the author's digest --------------------
+        if author_email:
+            post_excerpt = (post_content[:50] + "...") if len(post_content) > 50 else post_content
+            notify(
+                "like",
+                author_email,
+                username=user.username,
                 post_excerpt=post_excerpt,
             )
 
         return LikePost(like=like)
 
 
+class LikeResult(graphene.ObjectType):
+    post_id = graphene.Int(required=True)
+    success = graphene.Boolean(required=True)
+    error = graphene.String()
+
+
+class LikePosts(graphene.Mutation):
+    """Like several posts at once; one result per requested id."""
+
+    results = graphene.List(graphene.NonNull(LikeResult), required=True)
+
+    class Arguments:
+        post_ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+
+    def mutate(self, info, post_ids):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+        bulk.check_size(post_ids)
+
+        rows = create_linked_many(
+            Like, "post",
+            Post.objects.filter(pk__in=post_ids).values_list("pk", "author__email", "content"),
+            {"user": user},
+            counter="likes_count",
+        )
+        posts = {post[0]: post for _, post in rows}
+        new = [post_id for like, (post_id, _, _) in rows if like is not None]
+        errors = {}
+        for post_id in post_ids:
+            if post_id not in posts:
+                errors[post_id] = "Post not found"
+            elif post_id not in new:
+                errors[post_id] = "You already liked this post"
+
+        if new:
+            bump_versions(*dict.fromkeys(entity for post_id in new for entity in post_entities(post_id)))
+            trending.record_many(new, "like")
+            for post_id in new:
+                events.engagement_changed(post_id, likes=1)
+
+            # -------------------- Buffer for the authors' digests --------------------
+            digest_events = []
+            for post_id in new:
+                _, author_email, content = posts[post_id]
+                if author_email:
+                    post_excerpt = (content[:50] + "...") if len(content) > 50 else content
+                    digest_events.append((author_email, {"username": user.username, "post_excerpt": post_excerpt}))
+            notify_many("like", digest_events)
+
+        return LikePosts(results=[
+            LikeResult(post_id=post_id, success=error is None, error=error)
+            for post_id, error in bulk.item_errors(post_ids, errors)
+        ])
+
+
 class UnlikePost(graphene.Mutation):
     success = graphene.Boolean()
 
@@ -91,6 +211,9 @@ class UnlikePost(graphene.Mutation):
         try:
             like = Like.objects.get(user=user, post_id=post_id)
             like.delete()
+            Post.adjust_counter(post_id, "likes_count", -1)
+            bump_versions(*post_entities(post_id))
+            events.engagement_changed(post_id, likes=-1)
             return UnlikePost(success=True)
         except Like.DoesNotExist:
             raise GraphQLError("You haven’t liked this post")
@@ -108,21 +231,27 @@ class AddComment(graphene.Mutation):
         if user.is_anonymous:
             raise GraphQLError("You must be logged in")
 
-        try:
-            post = Post.objects.get(pk=post_id)
-        except Post.DoesNotExist:
+        comment, post = create_linked(
+            Comment, "post", Post.objects.filter(pk=post_id).values_list("pk", "content", "author__email"),
+            {"user": user, "content": content}, counter="comments_count",
+        )
+        if post is None:
             raise GraphQLError("Post not found")
 
-        comment = Comment.objects.create(user=user, post=post, content=content)
+        _, post_content, author_email = post
+        bump_versions(*post_entities(post_id))
+        trending.record(post_id, "comment")
+        events.comment_added(comment)
+        events.engagement_changed(post_id, comments=1)
 
-        # 🔥 Async task for comment
-        if post.author.email:
-            from .tasks import send_comment_notification
-            post_excerpt = (post.content[:50] + "...") if len(post.content) > 50 else post.content
+        # 🔥 Buffered for the author's digest
+        if author_email:
+            post_excerpt = (post_content[:50] + "...") if len(post_content) > 50 else post_content
             comment_excerpt = (content[:100] + "...") if len(content) > 100 else content
-            send_comment_notification.delay(
-                commenter_username=user.username,
-                author_email=post.author.email,
+            notify(
+                "comment",
+                author_email,
+                username=user.username,
                 post_excerpt=post_excerpt,
                 comment_content=comment_excerpt,
             )
@@ -144,6 +273,9 @@ class DeleteComment(graphene.Mutation):
         try:
             comment = Comment.objects.get(pk=comment_id, user=user)
             comment.delete()
+            Post.adjust_counter(comment.post_id, "comments_count", -1)
+            bump_versions(*post_entities(comment.post_id))
+            events.engagement_changed(comment.post_id, comments=-1)
             return DeleteComment(success=True)
         except Comment.DoesNotExist:
             raise GraphQLError("Comment not found or not authorized")
@@ -161,20 +293,25 @@ class SharePost(graphene.Mutation):
         if user.is_anonymous:
             raise GraphQLError("You must be logged in")
 
-        try:
-            post = Post.objects.get(pk=post_id)
-        except Post.DoesNotExist:
+        share, post = create_linked(
+            Share, "post", Post.objects.filter(pk=post_id).values_list("pk", "content", "author__email"),
+            {"user": user, "message": message}, counter="shares_count",
+        )
+        if post is None:
             raise GraphQLError("Post not found")
 
-        share = Share.objects.create(user=user, post=post, message=message)
-
-        # 🔥 Async task for share
-        if post.author.email:
-            from .tasks import send_share_notification
-            post_excerpt = (post.content[:50] + "...") if len(post.content) > 50 else post.content
-            send_share_notification.delay(
-                sharer_username=user.username,
-                author_email=post.author.email,
+        _, post_content, author_email = post
+        bump_versions(*post_entities(post_id))
+        trending.record(post_id, "share")
+        events.engagement_changed(post_id, shares=1)
+
+        # 🔥 Buffered for the author's digest
+        if author_email:
+            post_excerpt = (post_content[:50] + "...") if len(post_content) > 50 else post_content
+            notify(
+                "share",
+                author_email,
+                username=user.username,
                 post_excerpt=post_excerpt,
             )
 
@@ -184,6 +321,7 @@ class SharePost(graphene.Mutation):
 # ---------------------- Root Mutation ----------------------
 class Mutation(graphene.ObjectType):
     like_post = LikePost.Field()
+    like_posts = LikePosts.Field()
     unlike_post = UnlikePost.Field()
     add_comment = AddComment.Field()
     delete_comment = DeleteComment.Field()
@@ -1,7 +1,14 @@
 # interactions/tasks.py
+from collections import Counter
+
 from celery import shared_task
 from django.core.mail import send_mail
+from django.db.models import Count
 from django.utils import timezone
+from posts.models import Post
+from social_media_feed import retention
+from social_media_feed.response_cache import bump_versions, post_entities
+from . import notifications
 from .models import Comment, Share
 
 
@@ -11,14 +18,43 @@ def add(x, y):
     return x + y
 
 # ---------------------- Notifications ----------------------
+def _like_message(username, post_excerpt):
+    return "📌 New Like on Your Post", f"{username} liked your post:\n\n“{post_excerpt}...”"
+
+
+def _comment_message(username, post_excerpt, comment_content):
+    return "💬 New Comment on Your Post", (
+        f"{username} commented on your post:\n\n"
+        f"Post: “{post_excerpt}...”\n"
+        f"Comment: “{comment_content}”"
+    )
+
+
+def _share_message(username, post_excerpt):
+    return "🔗 Your Post Was Shared", f"{username} shared your post:\n\n“{post_excerpt}...”"
+
+
+MESSAGES = {
+    "like": _like_message,
+    "comment": _comment_message,
+    "share": _share_message,
+}
+
+
+def _render(event):
+    event = dict(event)
+    return MESSAGES[event.pop("kind")](**event)
+
+
 @shared_task
 def send_like_notification(liker_username, author_email, post_excerpt):
     """
     Notify post author when their post is liked.
     """
+    subject, message = _like_message(liker_username, post_excerpt)
     send_mail(
-        subject="📌 New Like on Your Post",
-        message=f"{liker_username} liked your post:\n\n“{post_excerpt}...”",
+        subject=subject,
+        message=message,
         from_email="noreply@nexus.com",
         recipient_list=[author_email],
         fail_silently=True,
@@ -31,13 +67,10 @@ def send_comment_notification(commenter_username, author_email, post_excerpt, co
     """
     Notify post author when someone comments.
     """
+    subject, message = _comment_message(commenter_username, post_excerpt, comment_content)
     send_mail(
-        subject="💬 New Comment on Your Post",
-        message=(
-            f"{commenter_username} commented on your post:\n\n"
-            f"Post: “{post_excerpt}...”\n"
-            f"Comment: “{comment_content}”"
-        ),
+        subject=subject,
+        message=message,
         from_email="noreply@nexus.com",
         recipient_list=[author_email],
         fail_silently=True,
@@ -50,9 +83,10 @@ def send_share_notification(sharer_username, author_email, post_excerpt):
     """
     Notify post author when their post is shared.
     """
+    subject, message = _share_message(sharer_username, post_excerpt)
     send_mail(
-        subject="🔗 Your Post Was Shared",
-        message=f"{sharer_username} shared your post:\n\n“{post_excerpt}...”",
+        subject=subject,
+        message=message,
         from_email="noreply@nexus.com",
         recipient_list=[author_email],
         fail_silently=True,
@@ -60,14 +94,59 @@ def send_share_notification(sharer_username, author_email, post_excerpt):
     return f"✅ Sent share notification to {author_email}"
 
 
+@shared_task
+def send_notification_digest(author_email):
+    """
+    Send every like, comment and share buffered for a post author as one email.
+    """
+    events, counts = notifications.drain(author_email)
+    if not events:
+        return f"No notifications for {author_email}"
+
+    # Buffers written before the counts were kept have none.
+    counts = counts or Counter(event["kind"] for event in events)
+    total = sum(counts.values())
+    if total == 1:
+        subject, message = _render(events[0])
+    else:
+        summary = ", ".join(
+            f"{counts[kind]} {kind}{'s' if counts[kind] > 1 else ''}" for kind in MESSAGES if counts.get(kind)
+        )
+        subject = f"🔔 {summary} on your posts"
+        message = "\n\n".join(_render(event)[1] for event in events)
+        if total > len(events):
+            message += f"\n\n…and {total - len(events)} more"
+
+    send_mail(
+        subject=subject,
+        message=message,
+        from_email="noreply@nexus.com",
+        recipient_list=[author_email],
+        fail_silently=True,
+    )
+    return f"✅ Sent {total} notifications to {author_email}"
+
+
 # ---------------------- Maintenance Tasks ----------------------
 @shared_task
 def cleanup_old_comments(days=30):
     """
-    Delete comments older than X days.
+    Delete comments older than X days, keeping post comment counts in step.
     """
+    def release_counts(ids):
+        per_post = (
+            Comment.objects.filter(pk__in=ids).order_by().values_list("post").annotate(n=Count("*"))
+        )
+        for post_id, n in per_post:
+            Post.adjust_counter(post_id, "comments_count", -n)
+            bump_versions(*post_entities(post_id))
+
     cutoff = timezone.now() - timezone.timedelta(days=days)
-    deleted, _ = Comment.objects.filter(created_at__lt=cutoff).delete()
+    deleted, finished = retention.purge(
+        "comments", Comment.objects.filter(created_at__lt=cutoff), before_delete=release_counts
+    )
+    if not finished:
+        return f"🗑 Deleted {deleted} old comments, resuming on the next run"
     return f"🗑 Deleted {deleted} old comments"
 
 
@@ -1,3 +1,172 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from posts.models import Post
+from social_media_feed.retention import CHECKPOINT_KEY
+from social_media_feed.testing import PASSWORD, GraphQLTestMixin, clear_redis
+from users.models import Follow, User
+
+from .models import Comment, Like
+from .notifications import BUFFER_KEY
+from .tasks import cleanup_old_comments, send_notification_digest
+
+
+class NotificationDigestTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.post = Post.objects.create(author=cls.author, content="viral")
+        cls.fans = [User.objects.create_user(f"fan{i}", f"fan{i}@example.com", PASSWORD) for i in range(3)]
+
+    def setUp(self):
+        clear_redis("notifications:")
+        self.apply_async = self.mute_celery()
+
+    def test_events_are_coalesced_into_one_digest(self):
+        for fan in self.fans:
+            self.run_as(fan, "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+        self.run_as(self.fans[0], 'mutation { addComment(postId: %d, content: "nice") { comment { id } } }' % self.post.id)
+
+        self.apply_async.assert_called_once_with(
+            (self.author.email,), countdown=settings.NOTIFICATION_DIGEST_WINDOW
+        )
+        send_notification_digest(self.author.email)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, "🔔 3 likes, 1 comment on your posts")
+        self.assertIn("fan2 liked your post", mail.outbox[0].body)
+
+    @override_settings(NOTIFICATION_DIGEST_MAX_EVENTS=2)
+    def test_buffer_keeps_the_newest_events_and_counts_the_rest(self):
+        for fan in self.fans:
+            self.run_as(fan, "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+        self.run_as(self.fans[0], "mutation { sharePost(postId: %d) { share { id } } }" % self.post.id)
+        self.assertEqual(get_redis_connection("default").llen(BUFFER_KEY.format(email=self.author.email)), 2)
+
+        self.assertEqual(send_notification_digest(self.author.email), "✅ Sent 4 notifications to author@example.com")
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, "🔔 3 likes, 1 share on your posts")
+        self.assertIn("fan2 liked your post", message.body)
+        self.assertNotIn("fan1", message.body)
+        self.assertTrue(message.body.endswith("…and 2 more"))
+
+    def test_next_event_after_a_digest_schedules_a_new_one(self):
+        self.run_as(self.fans[0], "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+        send_notification_digest(self.author.email)
+        self.run_as(self.fans[1], "mutation { sharePost(postId: %d) { share { id } } }" % self.post.id)
+        send_notification_digest(self.author.email)
+
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.assertEqual(
+            [message.subject for message in mail.outbox],
+            ["📌 New Like on Your Post", "🔗 Your Post Was Shared"],
+        )
+
+
+class CommentRetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        fan = User.objects.create_user("fan", "fan@example.com", PASSWORD)
+        cls.post = Post.objects.create(author=author, content="recent")
+        old, _ = (Comment.objects.create(user=fan, post=cls.post, content=content) for content in ("old", "new"))
+        Comment.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=730))
+        Post.objects.filter(pk=cls.post.pk).update(comments_count=2)
+
+    def setUp(self):
+        cache.delete(CHECKPOINT_KEY.format(name="comments"))
+
+    def test_old_comments_release_their_post_counts(self):
+        self.assertEqual(cleanup_old_comments(), "🗑 Deleted 1 old comments")
+        self.assertEqual(list(Comment.objects.values_list("content", flat=True)), ["new"])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+
+class LikePostsTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.alice = User.objects.create_user("alice", "alice@example.com", PASSWORD)
+        cls.bob = User.objects.create_user("bob", "bob@example.com", PASSWORD)
+        cls.posts = [Post.objects.create(author=author, content="x" * 60) for author in (cls.alice, cls.alice, cls.bob)]
+        Like.objects.create(user=cls.viewer, post=cls.posts[0])
+
+    def setUp(self):
+        clear_redis("notifications:")
+        self.mute_celery()
+
+    def test_like_posts_updates_counters_and_buffers_one_event_per_post(self):
+        ids = [post.id for post in self.posts]
+        # The likes, the counters and the post lookups are one statement.
+        with self.assertNumQueries(1):
+            data = self.run_as(self.viewer, "mutation { likePosts(postIds: %s) { results { postId success error } } }" % ids)
+        self.assertEqual(
+            [(r["success"], r["error"]) for r in data["likePosts"]["results"]],
+            [(False, "You already liked this post"), (True, None), (True, None)],
+        )
+        self.assertEqual(
+            list(Post.objects.filter(pk__in=ids).order_by("pk").values_list("likes_count", flat=True)), [0, 1, 1]
+        )
+        redis = get_redis_connection("default")
+        self.assertEqual(redis.llen(BUFFER_KEY.format(email="alice@example.com")), 1)
+        self.assertEqual(redis.llen(BUFFER_KEY.format(email="bob@example.com")), 1)
+        event = json.loads(redis.lindex(BUFFER_KEY.format(email="bob@example.com"), 0))
+        self.assertEqual(event, {"kind": "like", "username": "viewer", "post_excerpt": "x" * 50 + "..."})
+
+    def test_too_many_items_are_rejected(self):
+        with self.settings(GRAPHQL_MAX_BULK_SIZE=2):
+            result = self.execute_as(self.viewer, "mutation { likePosts(postIds: [1, 2, 3]) { results { postId } } }")
+        self.assertEqual(result.errors[0].message, "At most 2 items per call")
+
+
+class SingleStatementWriteTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.alice = User.objects.create_user("alice", "alice@example.com", PASSWORD)
+        cls.post = Post.objects.create(author=cls.alice, content="hello")
+
+    def setUp(self):
+        clear_redis("notifications:")
+        self.mute_celery()
+
+    def test_duplicate_like_loses_on_the_constraint(self):
+        like = "mutation { likePost(postId: %d) { like { id createdAt user { username } } } }" % self.post.id
+        with self.assertNumQueries(1):
+            result = self.execute_as(self.viewer, like)
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["likePost"]["like"]["user"]["username"], "viewer")
+        self.assertEqual(int(result.data["likePost"]["like"]["id"]), Like.objects.get().id)
+
+        result = self.execute_as(self.viewer, like)
+        self.assertEqual(result.errors[0].message, "You already liked this post")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        redis = get_redis_connection("default")
+        self.assertEqual(redis.llen(BUFFER_KEY.format(email="alice@example.com")), 1)
+
+    def test_comments_and_shares_bump_their_counters(self):
+        self.run_as(self.viewer, 'mutation { addComment(postId: %d, content: "hi") { comment { id } } }' % self.post.id)
+        self.run_as(self.viewer, "mutation { sharePost(postId: %d) { share { id message } } }" % self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comments_count, self.post.shares_count), (1, 1))
+        self.assertEqual(Comment.objects.get().content, "hi")
+
+    def test_missing_targets_are_reported(self):
+        missing = self.post.id + 100
+        for document, message in [
+            ("mutation { likePost(postId: %d) { like { id } } }" % missing, "Post not found"),
+            ('mutation { addComment(postId: %d, content: "hi") { comment { id } } }' % missing, "Post not found"),
+            ("mutation { sharePost(postId: %d) { share { id } } }" % missing, "Post not found"),
+            ("mutation { followUser(userId: %d) { follow { id } } }" % (self.alice.id + 100), "User not found"),
+        ]:
+            with self.subTest(document):
+                self.assertEqual(self.execute_as(self.viewer, document).errors[0].message, message)
+        self.assertFalse(Like.objects.exists() or Comment.objects.exists() or Follow.objects.exists())
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from posts.models import Post
+from posts.search import document
+
+
+class Command(BaseCommand):
+    help = "Fill in Post.search_vector for rows written before the search trigger existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches")
+
+    def handle(self, *args, batch_size, sleep, **kwargs):
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Post.objects.filter(pk__gt=last_id, search_vector__isnull=True)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            # Each batch commits on its own, so row locks are held briefly.
+            total += Post.objects.filter(pk__in=ids).update(search_vector=document())
+            self.stdout.write(f"Backfilled {total} posts (up to id {last_id})")
+            if sleep:
+                time.sleep(sleep)
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {total} posts backfilled"))
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min, Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+
+from interactions.models import Like
+from posts.models import Post
+from social_media_feed import synthetic
+from social_media_feed.loadtest import percentile, run_load
+from users.models import Follow, User
+
+# Every row the benchmark creates belongs to a user with this prefix.
+USERNAME_PREFIX = "bench-"
+CLIENT_PREFIX = "bench-client-"
+# The ids of the users this command created, as {"users": [first, last],
+# "clients": {username: id}}. Only these are ever reused or deleted, so an
+# account that merely shares the prefix is never touched.
+DATASET_KEY = "benchmark:dataset"
+
+POSTS = "{ posts(first: 20) { edges { node { id content likesCount author { username } } } } }"
+FEED = "{ feed(first: 20) { edges { node { id content author { username } } } pageInfo { endCursor } } }"
+COMMENTS = (
+    "query ($postId: Int!) { comments(postId: $postId, first: 20) "
+    "{ edges { node { id content user { username } } } } }"
+)
+FOLLOWERS = (
+    "query ($userId: Int!) { followers(userId: $userId, first: 20) "
+    "{ edges { viewerFollows node { id username } } } }"
+)
+LIKE = "mutation ($postId: Int!) { likePost(postId: $postId) { like { id } } }"
+UNLIKE = "mutation ($postId: Int!) { unlikePost(postId: $postId) { success } }"
+ADD_COMMENT = 'mutation ($postId: Int!) { addComment(postId: $postId, content: "benchmark") { comment { id } } }'
+SHARE = "mutation ($postId: Int!) { sharePost(postId: $postId) { share { id } } }"
+
+
+# Each operation yields an endless stream of (document, variables) for one client.
+def posts_operations(dataset, rng):
+    while True:
+        yield POSTS, None
+
+
+def feed_operations(dataset, rng):
+    while True:
+        yield FEED, None
+
+
+def comments_operations(dataset, rng):
+    while True:
+        yield COMMENTS, {"postId": rng.choice(dataset.post_ids)}
+
+
+def followers_operations(dataset, rng):
+    while True:
+        yield FOLLOWERS, {"userId": rng.choice(dataset.user_ids)}
+
+
+def like_operations(dataset, rng):
+    # Unliking right after keeps every request valid, however long the run.
+    while True:
+        post_id = rng.choice(dataset.post_ids)
+        yield LIKE, {"postId": post_id}
+        yield UNLIKE, {"postId": post_id}
+
+
+def comment_operations(dataset, rng):
+    while True:
+        yield ADD_COMMENT, {"postId": rng.choice(dataset.post_ids)}
+
+
+def share_operations(dataset, rng):
+    while True:
+        yield SHARE, {"postId": rng.choice(dataset.post_ids)}
+
+
+# name -> (operations, authenticated)
+OPERATIONS = {
+    "posts": (posts_operations, False),
+    "feed": (feed_operations, True),
+    "comments": (comments_operations, False),
+    "followers": (followers_operations, True),
+    "likePost+unlikePost": (like_operations, True),
+    "addComment": (comment_operations, True),
+    "sharePost": (share_operations, True),
+}
+
+
+class Dataset:
+    def __init__(self, user_ids, post_ids, clients):
+        self.user_ids = user_ids
+        self.post_ids = post_ids
+        # One user (and JWT) per concurrent client, so their writes never collide.
+        self.tokens = [get_token(client) for client in clients]
+
+
+def seed_dataset(seed, users, posts_per_user, follows_per_user, likes_per_post, comments_per_post, stdout):
+    """Replace the benchmark rows with a synthetic graph generated from ``seed``."""
+    dataset = cache.get(DATASET_KEY)
+    if dataset is not None:
+        recorded = Q(pk__range=dataset["users"]) | Q(pk__in=dataset["clients"].values())
+        deleted, _ = User.objects.filter(recorded, username__startswith=USERNAME_PREFIX).delete()
+        cache.delete(DATASET_KEY)
+        stdout.write(f"Deleted {deleted} rows of the previous dataset")
+    if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+        raise CommandError(
+            f"Users named {USERNAME_PREFIX}* exist that this command has no record of creating; "
+            "rename or delete them before seeding"
+        )
+    totals = synthetic.generate(
+        seed=seed,
+        prefix=USERNAME_PREFIX,
+        users=users,
+        follows_per_user=follows_per_user,
+        posts_per_user=posts_per_user,
+        likes_per_post=likes_per_post,
+        comments_per_post=comments_per_post,
+        workers=os.cpu_count() or 1,
+    )
+    ids = User.objects.filter(username__startswith=USERNAME_PREFIX).aggregate(first=Min("pk"), last=Max("pk"))
+    cache.set(DATASET_KEY, {"users": [ids["first"], ids["last"]], "clients": {}}, None)
+    stdout.write("Seeded " + ", ".join(f"{count} {table}" for table, count in totals.items()))
+
+
+def prepare_clients(rng, count, user_ids):
+    """The first ``count`` client users, created as needed and without likes left from earlier runs."""
+    dataset = cache.get(DATASET_KEY)
+    existing = {user.username: user for user in User.objects.filter(pk__in=dataset["clients"].values())}
+    missing = [f"{CLIENT_PREFIX}{i}" for i in range(count) if f"{CLIENT_PREFIX}{i}" not in existing]
+    created = User.objects.bulk_create([User(username=name, password="!") for name in missing])
+    if created:
+        dataset["clients"].update((user.username, user.pk) for user in created)
+        cache.set(DATASET_KEY, dataset, None)
+    Follow.objects.bulk_create(
+        [Follow(follower=client, following_id=following)
+         for client in created for following in rng.sample(user_ids, min(50, len(user_ids)))],
+        ignore_conflicts=True,
+    )
+    existing.update((user.username, user) for user in created)
+    clients = [existing[f"{CLIENT_PREFIX}{i}"] for i in range(count)]
+
+    liked = Counter(Like.objects.filter(user__in=clients).values_list("post_id", flat=True))
+    Like.objects.filter(user__in=clients).delete()
+    for post_id, likes in liked.items():
+        Post.adjust_counter(post_id, "likes_count", -likes)
+    return clients
+
+
+def count_queries(url, document, variables, token):
+    """SQL queries one request runs, measured in this process and rolled back."""
+    parts = urlsplit(url)
+    client = Client(HTTP_HOST=parts.hostname)
+    headers = {"HTTP_AUTHORIZATION": f"JWT {token}"} if token else {}
+    with transaction.atomic():
+        # Resolve the token first; its user is cached like it is on the server.
+        client.post(parts.path, {"query": "{ me { id } }"}, content_type="application/json", **headers)
+        with CaptureQueriesContext(connection) as queries:
+            client.post(
+                parts.path, {"query": document, "variables": variables}, content_type="application/json", **headers
+            )
+        transaction.set_rollback(True)
+    return len(queries)
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a benchmark dataset, load-test /graphql/ operation by operation and report "
+        "throughput, latency percentiles and SQL queries per request, e.g. "
+        "manage.py benchmark_api http://localhost:8000/graphql/ --save baseline.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="The /graphql/ endpoint of a running server")
+        parser.add_argument("--operation", action="append", choices=list(OPERATIONS), dest="operations")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--duration", type=float, default=20, help="Seconds measured per operation")
+        parser.add_argument("--warmup", type=float, default=3, help="Seconds of unmeasured load first")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the dataset and the clients")
+        parser.add_argument("--no-seed", action="store_false", dest="reseed", help="Reuse the existing dataset")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--posts-per-user", type=int, default=10)
+        parser.add_argument("--follows-per-user", type=int, default=50)
+        parser.add_argument("--likes-per-post", type=int, default=5)
+        parser.add_argument("--comments-per-post", type=int, default=2)
+        parser.add_argument("--save", help="Write the results as a JSON baseline")
+        parser.add_argument("--baseline", help="Compare against a saved baseline; fail on regressions")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.2,
+            help="Relative drop in throughput or rise in p99 reported as a regression",
+        )
+
+    def handle(self, *args, url, operations, concurrency, duration, warmup, seed, reseed, **options):
+        rng = random.Random(seed)
+        if reseed:
+            sizes = {
+                key: options[key]
+                for key in ("users", "posts_per_user", "follows_per_user", "likes_per_post", "comments_per_post")
+            }
+            seed_dataset(seed, stdout=self.stdout, **sizes)
+
+        dataset = cache.get(DATASET_KEY)
+        if dataset is None:
+            raise CommandError("No benchmark dataset; run without --no-seed first")
+        benchmark_users = User.objects.filter(pk__range=dataset["users"])
+        user_ids = list(benchmark_users.values_list("pk", flat=True))
+        post_ids = list(Post.objects.filter(author__in=benchmark_users).values_list("pk", flat=True))
+        if not post_ids:
+            raise CommandError("The benchmark dataset has no posts; reseed it with more users or posts")
+        dataset = Dataset(user_ids, post_ids, prepare_clients(rng, concurrency, user_ids))
+
+        results = {}
+        for name in operations or OPERATIONS:
+            generate, authenticated = OPERATIONS[name]
+
+            def client_requests(client):
+                headers = {"Content-Type": "application/json"}
+                if authenticated:
+                    headers["Authorization"] = f"JWT {dataset.tokens[client]}"
+                for document, variables in generate(dataset, random.Random(f"{seed}:{name}:{client}")):
+                    yield json.dumps({"query": document, "variables": variables}), headers
+
+            # Warmup and measurement share each client's stream, so a like
+            # left pending by the warmup is unliked next.
+            streams = [client_requests(client) for client in range(concurrency)]
+            document, variables = next(generate(dataset, random.Random(seed)))
+            queries = count_queries(url, document, variables, dataset.tokens[0] if authenticated else None)
+            if warmup:
+                asyncio.run(run_load(url, streams.__getitem__, concurrency, warmup))
+            latencies, errors = asyncio.run(run_load(url, streams.__getitem__, concurrency, duration))
+            results[name] = {
+                "throughput": len(latencies) / duration,
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "errors": errors,
+                "queries": queries,
+            }
+        # Leave no likes behind from the final like/unlike pairs.
+        prepare_clients(rng, concurrency, user_ids)
+
+        self.stdout.write(
+            f"{'operation':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'queries':>9}"
+        )
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<22}{r['throughput']:>9.1f}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}"
+                f"{r['errors']:>8}{r['queries']:>9}"
+            )
+
+        if options["save"]:
+            baseline = {
+                "commit": current_commit(),
+                "config": {"concurrency": concurrency, "duration": duration, "seed": seed},
+                "results": results,
+            }
+            with open(options["save"], "w") as f:
+                json.dump(baseline, f, indent=2)
+            self.stdout.write(f"Saved baseline to {options['save']}")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"Compared with {path} (commit {baseline.get('commit') or 'unknown'}):")
+        regressions = []
+        for name, r in results.items():
+            before = baseline["results"].get(name)
+            if before is None:
+                continue
+            problems = []
+            if r["queries"] > before["queries"]:
+                problems.append(f"queries {before['queries']} -> {r['queries']}")
+            if before["throughput"] and r["throughput"] < before["throughput"] * (1 - tolerance):
+                problems.append(f"throughput {before['throughput']:.1f} -> {r['throughput']:.1f} req/s")
+            if before["p99"] and r["p99"] > before["p99"] * (1 + tolerance):
+                problems.append(f"p99 {before['p99']:.1f} -> {r['p99']:.1f} ms")
+            self.stdout.write(f"  {name}: {'; '.join(problems) or 'ok'}")
+            if problems:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"Regressions in {', '.join(regressions)}")
@@ -0,0 +1,63 @@
+import asyncio
+import itertools
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from social_media_feed.loadtest import percentile, run_load
+
+# Two independent root fields, neither of them served from the response cache.
+DEFAULT_QUERY = (
+    "{ posts(first: 20) { edges { node { id content author { username } } } } "
+    "users(first: 20) { edges { node { id username } } } }"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure throughput and latency of running GraphQL deployments, e.g. "
+        "wsgi=http://localhost:8001/graphql/ asgi=http://localhost:8002/graphql/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("targets", nargs="+", help="label=url of each /graphql/ endpoint to compare")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds measured per target")
+        parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured load first")
+        parser.add_argument("--query", default=DEFAULT_QUERY)
+        parser.add_argument("--token", help="JWT sent as the Authorization header")
+
+    def handle(self, *args, targets, concurrency, duration, warmup, query, token, **kwargs):
+        parsed = []
+        for target in targets:
+            label, sep, url = target.partition("=")
+            if not sep:
+                raise CommandError(f"Expected label=url, got {target!r}")
+            parsed.append((label, url))
+
+        body = json.dumps({"query": query})
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"JWT {token}"
+
+        def requests_for(client):
+            return itertools.repeat((body, headers))
+
+        results = []
+        for label, url in parsed:
+            if warmup:
+                asyncio.run(run_load(url, requests_for, concurrency, warmup))
+            latencies, errors = asyncio.run(run_load(url, requests_for, concurrency, duration))
+            results.append((label, len(latencies) / duration, percentile(latencies, 50), percentile(latencies, 99), errors))
+
+        self.stdout.write(f"{'target':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for label, throughput, p50, p99, errors in results:
+            self.stdout.write(f"{label:<12}{throughput:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{errors:>8}")
+
+        baseline = results[0]
+        for label, throughput, _, p99, _ in results[1:]:
+            if baseline[1] and baseline[3]:
+                self.stdout.write(
+                    f"{label} vs {baseline[0]}: {throughput / baseline[1]:.2f}x throughput, "
+                    f"{p99 / baseline[3]:.2f}x p99 latency"
+                )
@@ -0,0 +1,78 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from social_media_feed import synthetic
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic social graph (users, power-law follows, posts, likes, comments, shares) "
+        "with COPY from worker processes. The defaults write about 10M rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Same seed and sizes, same rows")
+        parser.add_argument("--prefix", default="synthetic-", help="Usernames are <prefix><n>")
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--follows-per-user", type=float, default=40, help="Mean; heavy-tailed")
+        parser.add_argument("--posts-per-user", type=float, default=10, help="Mean; heavy-tailed")
+        parser.add_argument("--likes-per-post", type=float, default=4, help="Mean; heavy-tailed")
+        parser.add_argument("--comments-per-post", type=float, default=1, help="Mean; heavy-tailed")
+        parser.add_argument("--shares-per-post", type=float, default=0.2, help="Mean; heavy-tailed")
+        parser.add_argument(
+            "--follow-exponent", type=float, default=1.0,
+            help="Zipf exponent of follower popularity; higher concentrates followers on fewer users",
+        )
+        parser.add_argument("--password", help="Password of every generated user; without it they cannot log in")
+        parser.add_argument(
+            "--until", type=datetime.fromisoformat,
+            help="Newest timestamp (ISO date, UTC); defaults to today, so pass it to reproduce a run exactly",
+        )
+        parser.add_argument("--days", type=int, default=365, help="Timestamps span this many days")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Users per unit of work")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, users, until, workers, chunk_size, **options):
+        if users < 2:
+            raise CommandError("Need at least two users")
+        if until is not None and until.tzinfo is None:
+            until = until.replace(tzinfo=timezone.utc)
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Users named {prefix}* already exist; pick another --prefix")
+
+        started = time.perf_counter()
+
+        def progress(totals):
+            rows = sum(totals.values())
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"\r{rows:>12,} rows  {rows / elapsed:>10,.0f} rows/s", ending="")
+            self.stdout.flush()
+
+        totals = synthetic.generate(
+            seed=options["seed"],
+            prefix=prefix,
+            users=users,
+            follows_per_user=options["follows_per_user"],
+            posts_per_user=options["posts_per_user"],
+            likes_per_post=options["likes_per_post"],
+            comments_per_post=options["comments_per_post"],
+            shares_per_post=options["shares_per_post"],
+            follow_exponent=options["follow_exponent"],
+            password=options["password"],
+            until=until,
+            days=options["days"],
+            chunk_size=chunk_size,
+            workers=workers,
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        self.stdout.write("")
+        for table, count in totals.items():
+            self.stdout.write(f"{table:<10}{count:>12,}")
+        self.stdout.write(f"{rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s, {workers} workers)")
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:52
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_mediafile'),
+    ]
+
+    operations = [
+        # Nullable with no default, so adding it does not rewrite the table.
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE TRIGGER posts_post_search_vector_update
+                BEFORE INSERT OR UPDATE OF content ON posts_post
+                FOR EACH ROW EXECUTE FUNCTION
+                tsvector_update_trigger(search_vector, 'pg_catalog.english', content);
+            """,
+            reverse_sql="DROP TRIGGER IF EXISTS posts_post_search_vector_update ON posts_post;",
+        ),
+    ]
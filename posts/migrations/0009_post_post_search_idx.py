@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:53
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and does not
+    # block writes to posts while the index builds.
+    atomic = False
+
+    dependencies = [
+        ('posts', '0008_post_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='post_search_idx'),
+        ),
+    ]
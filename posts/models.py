@@ -1,12 +1,53 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.conf import settings
+from social_media_feed.images import ImageStatus
 
 class Post(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="posts", on_delete=models.CASCADE)
     content = models.TextField()
     image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    # Resized copies of ``image``, written by posts.tasks.process_post_image
+    image_variants = models.JSONField(default=list, blank=True)
+    image_status = models.CharField(max_length=16, choices=ImageStatus.choices, default=ImageStatus.NONE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized engagement counters, reconciled by posts.tasks.reconcile_post_counters
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    shares_count = models.PositiveIntegerField(default=0)
+
+    # Full-text search document for ``content``. A database trigger keeps it in
+    # step on every INSERT/UPDATE; rows older than the trigger are filled in
+    # by ``manage.py backfill_search_vectors``.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="post_created_idx"),
+            models.Index(fields=["author", "-created_at"], name="post_author_created_idx"),
+            GinIndex(fields=["search_vector"], name="post_search_idx"),
+        ]
+
     def __str__(self):
         return f"{self.author.username} - {self.content[:30]}"
+
+    @classmethod
+    def adjust_counter(cls, post_id, field, delta):
+        """Atomically add ``delta`` to one of a post's engagement counters."""
+        cls.objects.filter(pk=post_id).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+class MediaFile(models.Model):
+    """A stored upload and how many rows reference it (see social_media_feed/storage.py)."""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
@@ -1,9 +1,26 @@
 import graphene
+from asgiref.sync import sync_to_async
 from graphene_file_upload.scalars import Upload
 from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from social_media_feed import bulk, events, images
+from social_media_feed.loaders import load_related
+from social_media_feed.response_cache import bump_versions, post_entities
+from social_media_feed.subscriptions import get_broker
+from social_media_feed.pagination import (
+    build_connection,
+    connection_args,
+    decode_cursor,
+    decode_score_cursor,
+    encode_score_cursor,
+    page_size,
+    paginate,
+)
+from . import search, timeline, trending
 from .models import Post
+from users.models import Follow
 
 User = get_user_model()
 
@@ -11,30 +28,112 @@ User = get_user_model()
 class PostType(DjangoObjectType):
     class Meta:
         model = Post
-        fields = ("id", "author", "content", "image", "created_at")
+        fields = (
+            "id", "author", "content", "image", "image_status", "created_at",
+            "likes_count", "comments_count", "shares_count",
+        )
+
+    image_srcset = images.srcset_field()
+
+    def resolve_author(root, info):
+        return load_related(info, root, "author")
+
+    def resolve_image_srcset(root, info, format):
+        return images.srcset(root, "image", format)
+
+
+class PostConnection(graphene.relay.Connection):
+    class Meta:
+        node = PostType
 
 
 class Query(graphene.ObjectType):
-    posts = graphene.List(PostType)
+    posts = graphene.Field(PostConnection, **connection_args())
     post = graphene.Field(PostType, id=graphene.Int(required=True))
-    feed = graphene.List(PostType)
+    feed = graphene.Field(PostConnection, **connection_args())
+    trending_posts = graphene.Field(PostConnection, **connection_args())
+    search_posts = graphene.Field(PostConnection, **connection_args(query=graphene.String(required=True)))
 
-    def resolve_posts(root, info):
-        return Post.objects.all().order_by("-created_at")
+    async def resolve_posts(root, info, first=None, after=None):
+        return await paginate(Post.objects.all(), PostConnection, first, after)
 
-    def resolve_post(root, info, id):
+    async def resolve_post(root, info, id):
         try:
-            return Post.objects.get(pk=id)
+            return await Post.objects.aget(pk=id)
         except Post.DoesNotExist:
             raise GraphQLError("Post not found")
 
-    def resolve_feed(root, info):
+    async def resolve_feed(root, info, first=None, after=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+
+        first = page_size(first)
+        position = decode_cursor(after) if after else None
+        posts = await sync_to_async(timeline.home_timeline)(user.id, limit=first + 1, after=position)
+        return build_connection(PostConnection, posts, first, after)
+
+    async def resolve_trending_posts(root, info, first=None, after=None):
+        first = page_size(first)
+        position = decode_score_cursor(after) if after else None
+        rows = await sync_to_async(trending.top)(limit=first + 1, after=position)
+        return build_connection(
+            PostConnection,
+            rows,
+            first,
+            after,
+            key=lambda row: (row[0], row[1].pk),
+            node=lambda row: row[1],
+            encode=encode_score_cursor,
+        )
+
+    async def resolve_search_posts(root, info, query, first=None, after=None):
+        if not query.strip():
+            raise GraphQLError("query must not be empty")
+        first = page_size(first)
+        position = decode_score_cursor(after) if after else None
+        posts = await search.search(query, limit=first + 1, after=position)
+        return build_connection(
+            PostConnection,
+            posts,
+            first,
+            after,
+            key=lambda post: (post.rank, post.pk),
+            encode=encode_score_cursor,
+        )
+
+
+class PostEngagementChange(graphene.ObjectType):
+    """How much a post's counters just changed; clients add it to the totals they hold."""
+
+    post_id = graphene.Int(required=True)
+    likes = graphene.Int(required=True)
+    comments = graphene.Int(required=True)
+    shares = graphene.Int(required=True)
+
+
+async def _feed_posts(user_id):
+    authors = Follow.objects.filter(follower_id=user_id).values_list("following_id", flat=True)
+    channels = [events.POSTS_CHANNEL.format(author_id=author_id) async for author_id in authors]
+    async for event in get_broker().listen(channels):
+        post = await Post.objects.select_related("author").filter(pk=event["post_id"]).afirst()
+        if post is not None:
+            yield post
+
+
+class Subscription(graphene.ObjectType):
+    new_feed_post = graphene.Field(PostType)
+    post_engagement_changed = graphene.Field(PostEngagementChange, post_id=graphene.Int(required=True))
+
+    def subscribe_new_feed_post(root, info):
+        # Authors followed after subscribing are picked up on resubscribe.
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("You must be logged in")
+        return _feed_posts(user.id)
 
-        followed_ids = user.following.values_list("following_id", flat=True)
-        return Post.objects.filter(author_id__in=followed_ids).order_by("-created_at")
+    def subscribe_post_engagement_changed(root, info, post_id):
+        return get_broker().listen([events.ENGAGEMENT_CHANNEL.format(post_id=post_id)])
 
 
 class CreatePost(graphene.Mutation):
@@ -49,10 +148,59 @@ class CreatePost(graphene.Mutation):
         if user.is_anonymous:
             raise GraphQLError("You must be logged in")
 
-        post = Post.objects.create(author=user, content=content, image=image)
+        post = Post(author=user, content=content)
+        images.save(post, "image", image)
+
+        from .tasks import fan_out_post, process_post_image
+        transaction.on_commit(lambda: fan_out_post.delay(post.id))
+        if post.image:
+            transaction.on_commit(lambda: process_post_image.delay(post.id, post.image.name))
+        bump_versions(*post_entities(post.id))
+        events.post_created(post)
         return CreatePost(post=post)
 
 
+class PostInput(graphene.InputObjectType):
+    content = graphene.String(required=True)
+
+
+class CreatePostResult(graphene.ObjectType):
+    post = graphene.Field(PostType)
+    error = graphene.String()
+
+
+class CreatePosts(graphene.Mutation):
+    """Create several posts at once, e.g. when importing from another service."""
+
+    results = graphene.List(graphene.NonNull(CreatePostResult), required=True)
+
+    class Arguments:
+        posts = graphene.List(graphene.NonNull(PostInput), required=True)
+
+    def mutate(self, info, posts):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+        bulk.check_size(posts)
+
+        valid = [Post(author=user, content=item.content) for item in posts if item.content.strip()]
+        created = iter(Post.objects.bulk_create(valid))
+        results = [
+            CreatePostResult(post=next(created)) if item.content.strip()
+            else CreatePostResult(error="Content must not be empty")
+            for item in posts
+        ]
+
+        if valid:
+            from .tasks import fan_out_posts
+            post_ids = [post.pk for post in valid]
+            transaction.on_commit(lambda: fan_out_posts.delay(post_ids))
+            bump_versions("posts")
+            for post in valid:
+                events.post_created(post)
+        return CreatePosts(results=results)
+
+
 class UpdatePost(graphene.Mutation):
     post = graphene.Field(PostType)
 
@@ -73,9 +221,12 @@ class UpdatePost(graphene.Mutation):
 
         if content:
             post.content = content
+        images.save(post, "image", image)
+
         if image:
-            post.image = image
-        post.save()
+            from .tasks import process_post_image
+            transaction.on_commit(lambda: process_post_image.delay(post.id, post.image.name))
+        bump_versions(*post_entities(post.id))
         return UpdatePost(post=post)
 
 
@@ -93,6 +244,12 @@ class DeletePost(graphene.Mutation):
         try:
             post = Post.objects.get(pk=id, author=user)
             post.delete()
+            images.release(post, "image")
+            trending.remove(id)
+
+            from .tasks import remove_post_from_timelines
+            transaction.on_commit(lambda: remove_post_from_timelines.delay(id, user.id))
+            bump_versions(*post_entities(id))
             return DeletePost(success=True)
         except Post.DoesNotExist:
             raise GraphQLError("Post not found or not authorized")
@@ -100,6 +257,7 @@ class DeletePost(graphene.Mutation):
 
 class Mutation(graphene.ObjectType):
     create_post = CreatePost.Field()
+    create_posts = CreatePosts.Field()
     update_post = UpdatePost.Field()
     delete_post = DeletePost.Field()
 
@@ -0,0 +1,38 @@
+"""
+Full-text search over post content.
+
+``Post.search_vector`` holds the English ``tsvector`` of ``content``; a
+trigger (migration 0008) keeps it current and ``post_search_idx`` (GIN) makes
+the ``@@`` match an index lookup. Results are ranked with ``ts_rank`` and
+paged by ``(rank, id)`` keyset cursors.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from .models import Post
+
+# Must match the configuration the trigger uses.
+SEARCH_CONFIG = "english"
+
+
+def document():
+    """Expression computing a post's search vector, for backfills."""
+    return SearchVector("content", config=SEARCH_CONFIG)
+
+
+async def search(text, limit, after=None):
+    """
+    Up to ``limit`` posts matching ``text`` (web search syntax: quoted
+    phrases, ``or``, ``-word``), best match first, after the ``after``
+    (rank, id) position. Each post carries its ``rank``.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+    # ts_rank() is a float4, which does not survive the round trip through a
+    # cursor exactly; as a float8 the cursor's rank compares equal again.
+    rank = Cast(SearchRank(F("search_vector"), query), FloatField())
+    posts = Post.objects.filter(search_vector=query).annotate(rank=rank)
+    if after is not None:
+        rank, pk = after
+        posts = posts.filter(Q(rank__lt=rank) | Q(rank=rank, pk__lt=pk))
+    return [post async for post in posts.order_by("-rank", "-pk")[:limit]]
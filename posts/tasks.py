@@ -1,43 +1,306 @@
+from collections import defaultdict
+from smtplib import SMTPException
+
 from celery import shared_task
-from django.core.mail import send_mail
-from .models import Post
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from interactions.models import Comment, Like, Share
+from social_media_feed import images, retention
+from social_media_feed.response_cache import bump_versions, post_entities
+from users.models import Follow, User
+from . import timeline, trending
+from .models import MediaFile, Post
 
+FANOUT_CHUNK_SIZE = 1000
+NOTIFY_CHUNK_SIZE = 500
 
-@shared_task
-def notify_followers_new_post(post_id):
-    """Notify followers when a user creates a new post."""
+
+def _chunks(queryset, size):
+    """Yield lists of ``size`` values from ``queryset`` without loading them all."""
+    chunk = []
+    for value in queryset.iterator(chunk_size=size):
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _follower_id_chunks(author_id):
+    """Yield lists of follower ids for ``author_id`` without loading them all."""
+    follower_ids = Follow.objects.filter(following_id=author_id).values_list("follower_id", flat=True)
+    return _chunks(follower_ids, FANOUT_CHUNK_SIZE)
+
+
+def _fan_out_on_write_count(author_id):
+    """The author's follower count, or None once their posts are merged in at read time."""
+    if timeline.is_fanout_on_read(author_id):
+        return None
+    follower_count = Follow.objects.filter(following_id=author_id).count()
+    if follower_count > settings.TIMELINE_FANOUT_FOLLOWER_LIMIT:
+        timeline.mark_fanout_on_read(author_id)
+        return None
+    return follower_count
+
+
+# ---------------------- Notifications ----------------------
+@shared_task(bind=True)
+def notify_followers_new_post(self, post_id):
+    """Notify followers when a user creates a new post, one subtask per chunk of followers."""
     try:
-        post = Post.objects.get(id=post_id)
+        post = Post.objects.only("id", "author_id").get(id=post_id)
     except Post.DoesNotExist:
         return "Post not found"
 
-    author = post.author
-    followers = author.followers.all()
+    emails = (
+        Follow.objects.filter(following_id=post.author_id)
+        .exclude(follower__email="")
+        .order_by()
+        .values_list("follower__email", flat=True)
+    )
+    queued = 0
+    for chunk in _chunks(emails, NOTIFY_CHUNK_SIZE):
+        send_new_post_emails.delay(post_id, chunk)
+        queued += len(chunk)
+        if self.request.id:
+            self.update_state(state="PROGRESS", meta={"queued": queued})
+
+    return f"Queued notifications for {queued} followers."
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def send_new_post_emails(self, post_id, emails):
+    """Email one chunk of followers about a new post over a single SMTP connection."""
+    try:
+        post = Post.objects.select_related("author").only("content", "author__username").get(id=post_id)
+    except Post.DoesNotExist:
+        return "Post not found"
 
     # In production, you’d send push notifications instead
-    for f in followers:
-        send_mail(
-            subject=f"{author.username} created a new post!",
-            message=post.content[:100],
+    messages = [
+        EmailMessage(
+            subject=f"{post.author.username} created a new post!",
+            body=post.content[:100],
             from_email="no-reply@nexus.com",
-            recipient_list=[f.follower.email],
-            fail_silently=True,
+            to=[email],
+        )
+        for email in emails
+    ]
+    sent = 0
+    try:
+        with get_connection() as connection:
+            for message in messages:
+                connection.send_messages([message])
+                sent += 1
+    except (SMTPException, OSError) as exc:
+        # Retry only the recipients that have not been sent to yet.
+        raise self.retry(args=(post_id, emails[sent:]), exc=exc)
+
+    return f"Notified {sent} followers."
+
+
+# ---------------------- Home timelines ----------------------
+@shared_task
+def fan_out_post(post_id):
+    """Push a new post onto the cached timelines of the author's followers."""
+    try:
+        post = Post.objects.only("id", "author_id", "created_at").get(id=post_id)
+    except Post.DoesNotExist:
+        return "Post not found"
+
+    follower_count = _fan_out_on_write_count(post.author_id)
+    if follower_count is None:
+        return "Author is fanned out on read."
+
+    for chunk in _follower_id_chunks(post.author_id):
+        timeline.push(chunk, post.id, post.created_at)
+    return f"Fanned out to {follower_count} timelines."
+
+
+@shared_task
+def fan_out_posts(post_ids):
+    """Push several new posts (from createPosts) onto followers' timelines, one follower scan per author."""
+    by_author = defaultdict(list)
+    for post in Post.objects.filter(id__in=post_ids).only("id", "author_id", "created_at"):
+        by_author[post.author_id].append(post)
+
+    for author_id, posts in by_author.items():
+        if _fan_out_on_write_count(author_id) is None:
+            continue
+        for chunk in _follower_id_chunks(author_id):
+            for post in posts:
+                timeline.push(chunk, post.id, post.created_at)
+    return f"Fanned out {len(post_ids)} posts."
+
+
+@shared_task
+def remove_post_from_timelines(post_id, author_id):
+    """Trim a deleted post from the timelines it was fanned out to."""
+    # Posts of fanned-out-on-read authors were never pushed. Any from before
+    # the author was marked are skipped at read time until they are trimmed.
+    if timeline.is_fanout_on_read(author_id):
+        return "Author is fanned out on read."
+    for chunk in _follower_id_chunks(author_id):
+        timeline.remove(chunk, [post_id])
+
+
+@shared_task
+def restore_fan_out_on_write():
+    """Fan out on write again for marked authors whose audience fell back under the limit."""
+    restored = 0
+    for author_id in timeline.fanout_on_read_authors():
+        if Follow.objects.filter(following_id=author_id).count() > settings.TIMELINE_FANOUT_FOLLOWER_LIMIT:
+            continue
+        # Unmark first: posts created from here on are pushed by fan_out_post,
+        # earlier ones are picked up by the backfill below.
+        timeline.unmark_fanout_on_read(author_id)
+        recent = list(
+            Post.objects.filter(author_id=author_id)
+            .order_by("-created_at")
+            .values_list("id", "created_at")[:settings.TIMELINE_MAX_LENGTH]
         )
+        for chunk in _follower_id_chunks(author_id):
+            for follower_id in chunk:
+                timeline.merge(follower_id, recent)
+        restored += 1
+    return f"Restored fan-out-on-write for {restored} authors."
+
+
+@shared_task
+def remove_author_from_timeline(user_id, author_id):
+    """Trim an unfollowed author's posts from a user's timeline."""
+    cached = timeline.members(user_id)
+    post_ids = list(Post.objects.filter(id__in=cached, author_id=author_id).values_list("id", flat=True))
+    timeline.remove([user_id], post_ids)
+    return f"Removed {len(post_ids)} posts from timeline."
+
+
+@shared_task
+def add_author_to_timeline(user_id, author_id):
+    """Backfill a newly followed author's recent posts into a user's timeline."""
+    if timeline.is_fanout_on_read(author_id):
+        return "Author is fanned out on read."
+
+    recent = Post.objects.filter(author_id=author_id).order_by("-created_at")
+    timeline.merge(user_id, recent.values_list("id", "created_at")[:settings.TIMELINE_MAX_LENGTH])
+
+
+@shared_task
+def add_authors_to_timeline(user_id, author_ids):
+    """Backfill several newly followed authors' recent posts into a user's timeline at once."""
+    authors = [author_id for author_id in author_ids if not timeline.is_fanout_on_read(author_id)]
+    recent = Post.objects.filter(author_id__in=authors).order_by("-created_at")
+    timeline.merge(user_id, recent.values_list("id", "created_at")[:settings.TIMELINE_MAX_LENGTH])
+
+
+# ---------------------- Trending ----------------------
+@shared_task
+def decay_trending_posts():
+    """Decay trending scores by the time since the last run and prune cold posts."""
+    pruned = trending.decay()
+    return f"Pruned {pruned} posts from trending."
+
 
-    return f"Notified {followers.count()} followers."
+# ---------------------- Images ----------------------
+@shared_task
+def process_post_image(post_id, name):
+    """Build the resized variants of a post's uploaded image."""
+    status = images.process(Post, post_id, "image", name)
+    if status is None:
+        return "Image was replaced before processing finished."
+    bump_versions(*post_entities(post_id))
+    return f"Image {status}."
 
 
+# ---------------------- Maintenance Tasks ----------------------
 @shared_task
 def cleanup_old_posts(days=365):
-    """Delete posts older than X days (default: 1 year)."""
+    """Delete posts older than X days (default: 1 year), with their interactions and images."""
     from django.utils import timezone
     from datetime import timedelta
 
+    def before_delete(ids):
+        names = []
+        for image, variants in Post.objects.filter(pk__in=ids).exclude(image="").values_list("image", "image_variants"):
+            names += [image, *(v["name"] for v in variants)]
+        retention.delete_files_on_commit(names)
+        bump_versions("posts", *(f"post:{post_id}" for post_id in ids))
+
     cutoff = timezone.now() - timedelta(days=days)
-    old_posts = Post.objects.filter(created_at__lt=cutoff)
-    count = old_posts.count()
-    old_posts.delete()
-    return f"Deleted {count} old posts."
+    deleted, finished = retention.purge(
+        "posts",
+        Post.objects.filter(created_at__lt=cutoff),
+        cascade=[(Like, "post"), (Comment, "post"), (Share, "post")],
+        before_delete=before_delete,
+    )
+    if not finished:
+        return f"Deleted {deleted} old posts, resuming on the next run."
+
+    orphans = sum(
+        retention.delete_orphaned_files(directory, _referenced(model, field_name))
+        for directory, model, field_name in [
+            (Post._meta.get_field("image").upload_to, Post, "image"),
+            (User._meta.get_field("profile_picture").upload_to, User, "profile_picture"),
+            # Variants are only listed in JSON; the storage keeps a row for each one in use.
+            (images.VARIANTS_DIR, MediaFile, "name"),
+        ]
+    )
+    return f"Deleted {deleted} old posts and {orphans} orphaned images."
+
+
+def _referenced(model, field_name):
+    """``referenced`` callback for ``retention.delete_orphaned_files``: names some ``model`` row holds."""
+    return lambda names: set(
+        model.objects.filter(**{f"{field_name}__in": names}).values_list(field_name, flat=True)
+    )
+
+
+def _actual_count(model):
+    """Subquery counting ``model`` rows that belong to the outer post."""
+    counts = (
+        model.objects.filter(post=OuterRef("pk"))
+        .order_by()
+        .values("post")
+        .annotate(n=Count("*"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+@shared_task
+def reconcile_post_counters(batch_size=1000):
+    """Recompute the denormalized engagement counters and fix any drift."""
+    counters = {
+        "likes_count": Like,
+        "comments_count": Comment,
+        "shares_count": Share,
+    }
+    last_id = 0
+    fixed = 0
+    while True:
+        ids = list(
+            Post.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        drifted = (
+            Post.objects.filter(pk__in=ids)
+            .annotate(**{f"actual_{field}": _actual_count(model) for field, model in counters.items()})
+            .exclude(**{field: F(f"actual_{field}") for field in counters})
+            .values_list("pk", flat=True)
+        )
+        drifted = list(drifted)
+        fixed += Post.objects.filter(pk__in=drifted).update(
+            **{field: _actual_count(model) for field, model in counters.items()}
+        )
+        if drifted:
+            bump_versions("posts", *(f"post:{post_id}" for post_id in drifted))
+    return f"Reconciled counters on {fixed} posts."
 
 
 @shared_task
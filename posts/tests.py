@@ -1,3 +1,442 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from PIL import Image
+
+from interactions.models import Comment, Like, Share
+from social_media_feed.execution import execute_sync
+from social_media_feed.retention import CHECKPOINT_KEY
+from social_media_feed.schema import schema
+from social_media_feed.testing import PASSWORD, GraphQLTestMixin, clear_redis
+from users.models import Follow, User
+
+from . import timeline, trending
+from .models import MediaFile, Post
+from .tasks import (
+    cleanup_old_posts,
+    fan_out_post,
+    notify_followers_new_post,
+    process_post_image,
+    remove_post_from_timelines,
+    restore_fan_out_on_write,
+)
+from .trending import TRENDING_KEY
+
+
+class FollowerNotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.post = Post.objects.create(author=cls.author, content="news")
+        for i in range(5):
+            follower = User.objects.create_user(f"follower{i}", f"follower{i}@example.com", PASSWORD)
+            Follow.objects.create(follower=follower, following=cls.author)
+
+    def setUp(self):
+        conf = notify_followers_new_post.app.conf
+        self.addCleanup(setattr, conf, "task_always_eager", conf.task_always_eager)
+        conf.task_always_eager = True
+
+    @mock.patch("posts.tasks.NOTIFY_CHUNK_SIZE", 2)
+    def test_followers_are_notified_in_chunks(self):
+        with mock.patch("posts.tasks.get_connection", wraps=mail.get_connection) as get_connection:
+            with self.assertNumQueries(1 + 1 + 3):
+                notify_followers_new_post.delay(self.post.id)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [f"follower{i}@example.com" for i in range(5)],
+        )
+
+    @mock.patch("posts.tasks.NOTIFY_CHUNK_SIZE", 5)
+    def test_failed_chunks_retry_only_unsent_recipients(self):
+        send = mail.get_connection().__class__.send_messages
+        calls = []
+
+        def flaky(connection, messages):
+            calls.append(messages[0].to[0])
+            if len(calls) == 3:
+                raise OSError("connection reset")
+            return send(connection, messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", flaky):
+            notify_followers_new_post.delay(self.post.id)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(len(set(calls)), 5)
+        self.assertEqual(len(calls), 6)
+
+
+class CreatePostsTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+
+    def setUp(self):
+        self.mute_celery()
+
+    def test_create_posts_fans_out_once(self):
+        with mock.patch("posts.tasks.fan_out_posts.delay") as fan_out:
+            data = self.run_as(
+                self.author,
+                'mutation { createPosts(posts: [{content: "one"}, {content: "  "}, {content: "two"}]) '
+                "{ results { post { id content } error } } }",
+            )
+        results = data["createPosts"]["results"]
+        self.assertEqual([r["post"] and r["post"]["content"] for r in results], ["one", None, "two"])
+        self.assertEqual(results[1]["error"], "Content must not be empty")
+        fan_out.assert_called_once_with([int(results[0]["post"]["id"]), int(results[2]["post"]["id"])])
+
+
+class PostRetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.fan = User.objects.create_user("fan", "fan@example.com", PASSWORD)
+        cls.old = [Post.objects.create(author=cls.author, content=f"old {i}") for i in range(5)]
+        cls.recent = Post.objects.create(author=cls.author, content="recent")
+        for post in [*cls.old, cls.recent]:
+            Like.objects.create(user=cls.fan, post=post)
+            Comment.objects.create(user=cls.fan, post=post, content="hi")
+            Share.objects.create(user=cls.fan, post=post)
+        two_years_ago = timezone.now() - timedelta(days=730)
+        Post.objects.filter(pk__in=[p.pk for p in cls.old]).update(created_at=two_years_ago)
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media_root.name, RETENTION_BATCH_SIZE=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.delete(CHECKPOINT_KEY.format(name="posts"))
+
+    def test_old_posts_are_deleted_with_their_interactions_and_images(self):
+        image = default_storage.save("posts/old.png", ContentFile(b"png"))
+        Post.objects.filter(pk=self.old[0].pk).update(image=image)
+        orphan = default_storage.save("posts/orphan.png", ContentFile(b"orphan"))
+        stale = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(default_storage.path(orphan), (stale, stale))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(cleanup_old_posts(), "Deleted 5 old posts and 1 orphaned images.")
+
+        self.assertEqual(list(Post.objects.all()), [self.recent])
+        for model in (Like, Comment, Share):
+            self.assertEqual(model.objects.count(), 1)
+        self.assertFalse(default_storage.exists(image))
+        self.assertFalse(default_storage.exists(orphan))
+
+    def test_orphans_are_swept_from_every_upload_directory(self):
+        picture = default_storage.save("profiles/me.png", ContentFile(b"me"))
+        User.objects.filter(pk=self.author.pk).update(profile_picture=picture)
+        orphans = [default_storage.save("profiles/old.png", ContentFile(b"old"))]
+        with transaction.atomic():
+            # A rolled-back upload takes its reference with it and leaves the file.
+            orphans.append(default_storage.save("variants/320w/variant.webp", ContentFile(b"variant")))
+            transaction.set_rollback(True)
+        variant = default_storage.save("variants/320w/variant.webp", ContentFile(b"in use"))
+        stale = (timezone.now() - timedelta(days=2)).timestamp()
+        for name in [picture, variant, *orphans]:
+            os.utime(default_storage.path(name), (stale, stale))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(cleanup_old_posts(), "Deleted 5 old posts and 2 orphaned images.")
+
+        self.assertTrue(default_storage.exists(picture))
+        self.assertTrue(default_storage.exists(variant))
+        self.assertFalse(any(default_storage.exists(name) for name in orphans))
+
+    def test_cleanup_resumes_from_a_checkpoint(self):
+        with mock.patch("social_media_feed.retention.time.monotonic", side_effect=[0, 0, 0, 10**6]):
+            self.assertEqual(cleanup_old_posts(), "Deleted 4 old posts, resuming on the next run.")
+        self.assertEqual(cache.get(CHECKPOINT_KEY.format(name="posts")), self.old[3].pk)
+
+        self.assertTrue(cleanup_old_posts().startswith("Deleted 1 old posts"))
+        self.assertIsNone(cache.get(CHECKPOINT_KEY.format(name="posts")))
+
+
+class ImageVariantTests(GraphQLTestMixin, TestCase):
+    mutation = """
+        mutation($image: Upload) {
+            createPost(content: "photo", image: $image) { post { id imageStatus imageSrcset } }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media_root.name, IMAGE_VARIANT_WIDTHS=[320, 640, 1080])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.mute_celery()
+
+    def upload(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Nexus Camera"  # Make
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 400), "red").save(buffer, "JPEG", exif=exif)
+        return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def create_post(self):
+        data = self.run_as(self.author, self.mutation, variable_values={"image": self.upload()})
+        return data["createPost"]["post"]
+
+    def test_status_shows_processing_until_variants_are_built(self):
+        post = self.create_post()
+        self.assertEqual(post["imageStatus"], "PROCESSING")
+        self.assertIsNone(post["imageSrcset"])
+
+    def test_variants_are_resized_and_stripped_of_exif(self):
+        post = Post.objects.get(pk=self.create_post()["id"])
+        self.assertEqual(process_post_image(post.id, post.image.name), "Image ready.")
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_status, "ready")
+        self.assertEqual(
+            sorted((v["width"], v["format"]) for v in post.image_variants),
+            [(320, "jpeg"), (320, "webp"), (640, "jpeg"), (640, "webp")],
+        )
+        for variant in post.image_variants:
+            with default_storage.open(variant["name"]) as f, Image.open(f) as image:
+                self.assertEqual(image.size, (variant["width"], variant["height"]))
+                self.assertEqual(len(image.getexif()), 0)
+
+        response = self.client.post(
+            "/graphql/",
+            {"query": "{ post(id: %d) { imageSrcset(format: JPEG) } }" % post.id},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["data"]["post"]["imageSrcset"],
+            ", ".join(
+                f"{default_storage.url(v['name'])} {v['width']}w"
+                for v in post.image_variants if v["format"] == "jpeg"
+            ),
+        )
+
+    def test_unexpected_decoder_errors_mark_the_image_failed(self):
+        post = Post.objects.get(pk=self.create_post()["id"])
+        with mock.patch("social_media_feed.images.build_variants", side_effect=SyntaxError("broken PNG file")):
+            with self.assertLogs("social_media_feed.images", "ERROR"):
+                self.assertEqual(process_post_image(post.id, post.image.name), "Image failed.")
+        self.assertEqual(Post.objects.get(pk=post.pk).image_status, "failed")
+
+    def test_a_failed_run_keeps_no_references_to_its_variants(self):
+        post = Post.objects.get(pk=self.create_post()["id"])
+        names = ["variants/320w/variant.webp", OSError("No space left on device")]
+        with mock.patch("social_media_feed.images.variant_name", side_effect=names):
+            with self.assertLogs("social_media_feed.images", "ERROR"):
+                self.assertEqual(process_post_image(post.id, post.image.name), "Image failed.")
+        self.assertFalse(MediaFile.objects.filter(name__startswith="variants/").exists())
+
+    def test_stale_tasks_discard_their_variants(self):
+        post = Post.objects.get(pk=self.create_post()["id"])
+        Post.objects.filter(pk=post.pk).update(image="posts/replacement.jpg")
+        self.assertEqual(
+            process_post_image(post.id, post.image.name), "Image was replaced before processing finished."
+        )
+        self.assertEqual(Post.objects.get(pk=post.pk).image_status, "processing")
+        self.assertFalse(MediaFile.objects.filter(name__startswith="variants/").exists())
+
+
+class ContentAddressedStorageTests(GraphQLTestMixin, TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_identical_uploads_share_one_file(self):
+        first = default_storage.save("posts/meme.PNG", ContentFile(b"meme"))
+        second = default_storage.save("posts/copy-of-meme.png", ContentFile(b"meme"))
+        sha256 = hashlib.sha256(b"meme").hexdigest()
+        self.assertEqual(first, f"posts/{sha256[:2]}/{sha256[2:4]}/{sha256}.png")
+        self.assertEqual(second, first)
+        self.assertEqual(MediaFile.objects.get(name=first).refcount, 2)
+        self.assertEqual(os.listdir(default_storage.path(".tmp")), [])
+
+    def test_file_is_removed_with_its_last_reference(self):
+        name = default_storage.save("posts/meme.png", ContentFile(b"meme"))
+        default_storage.save("posts/meme.png", ContentFile(b"meme"))
+
+        default_storage.delete(name)
+        self.assertTrue(default_storage.exists(name))
+        default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+
+    def test_deleting_a_post_keeps_images_other_posts_use(self):
+        author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        name = default_storage.save("posts/meme.png", ContentFile(b"meme"))
+        kept = Post.objects.create(author=author, content="kept", image=name)
+        deleted = Post.objects.create(
+            author=author, content="deleted", image=default_storage.save("posts/meme.png", ContentFile(b"meme"))
+        )
+
+        self.mute_celery()
+        self.execute_as(author, "mutation { deletePost(id: %d) { success } }" % deleted.id)
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertEqual(MediaFile.objects.get(name=name).refcount, 1)
+
+
+class TrendingPostsTests(GraphQLTestMixin, TestCase):
+    query = """
+        query($after: String) {
+            trendingPosts(first: 2, after: $after) {
+                edges { node { id } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.fans = [User.objects.create_user(f"fan{i}", f"fan{i}@example.com", PASSWORD) for i in range(2)]
+        cls.posts = [Post.objects.create(author=cls.author, content=f"post {i}") for i in range(4)]
+
+    def setUp(self):
+        get_redis_connection("default").delete(TRENDING_KEY, trending.DECAYED_AT_KEY)
+        self.mute_celery()
+
+    def page(self, after=None):
+        result = execute_sync(schema, self.query, variable_values={"after": after})
+        self.assertIsNone(result.errors)
+        connection = result.data["trendingPosts"]
+        return [int(edge["node"]["id"]) for edge in connection["edges"]], connection["pageInfo"]
+
+    def test_engagement_is_ranked_by_weight(self):
+        a, b, c, _ = self.posts
+        self.run_as(self.fans[0], "mutation { likePost(postId: %d) { like { id } } }" % a.id)
+        self.run_as(self.fans[1], "mutation { likePost(postId: %d) { like { id } } }" % a.id)
+        self.run_as(self.fans[0], "mutation { sharePost(postId: %d) { share { id } } }" % b.id)
+        self.run_as(self.fans[0], 'mutation { addComment(postId: %d, content: "hi") { comment { id } } }' % c.id)
+
+        with self.assertNumQueries(1):
+            ids, page_info = self.page()
+        # Two likes tie with one comment; ties are ordered by id.
+        self.assertEqual(ids, [b.id, c.id])
+        self.assertTrue(page_info["hasNextPage"])
+        self.assertEqual(self.page(page_info["endCursor"])[0], [a.id])
+
+    def test_pages_through_tied_scores_without_gaps(self):
+        get_redis_connection("default").zadd(TRENDING_KEY, {post.id: 1.0 for post in self.posts})
+        seen, after = [], None
+        while True:
+            ids, page_info = self.page(after)
+            seen += ids
+            if not page_info["hasNextPage"]:
+                break
+            after = page_info["endCursor"]
+        self.assertEqual(seen, sorted((post.id for post in self.posts), reverse=True))
+
+    @override_settings(TRENDING_HALF_LIFE=60, TRENDING_MIN_SCORE=1)
+    def test_decay_halves_scores_and_prunes_cold_posts(self):
+        redis = get_redis_connection("default")
+        redis.zadd(TRENDING_KEY, {self.posts[0].id: 8, self.posts[1].id: 1.5})
+        with mock.patch("posts.trending.time.time", side_effect=[1000, 1060]):
+            trending.decay()
+            self.assertEqual(trending.decay(), 1)
+        self.assertEqual(redis.zrange(TRENDING_KEY, 0, -1, withscores=True), [(str(self.posts[0].id).encode(), 4.0)])
+
+
+class SearchPostsTests(TestCase):
+    query = """
+        query($q: String!, $after: String) {
+            searchPosts(query: $q, first: 2, after: $after) {
+                edges { node { content } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        for content in [
+            "Cats are great",
+            "Dogs and cats, cats everywhere",
+            "Nothing to see here",
+            "A cat nap",
+        ]:
+            Post.objects.create(author=cls.author, content=content)
+
+    def search(self, q, after=None):
+        result = execute_sync(schema, self.query, variable_values={"q": q, "after": after})
+        self.assertIsNone(result.errors)
+        connection = result.data["searchPosts"]
+        return [edge["node"]["content"] for edge in connection["edges"]], connection["pageInfo"]
+
+    def search_all(self, q):
+        contents, after = [], None
+        while True:
+            page, page_info = self.search(q, after)
+            contents += page
+            if not page_info["hasNextPage"]:
+                return contents
+            after = page_info["endCursor"]
+
+    def test_results_are_ranked_and_paginated(self):
+        contents = self.search_all("cats")
+        self.assertEqual(contents[0], "Dogs and cats, cats everywhere")
+        self.assertEqual(sorted(contents), ["A cat nap", "Cats are great", "Dogs and cats, cats everywhere"])
+
+    def test_vector_follows_content_updates(self):
+        post = Post.objects.get(content="Nothing to see here")
+        post.content = "Something about cats"
+        post.save()
+        self.assertIn("Something about cats", self.search_all("cats"))
+        self.assertEqual(self.search("nothing")[0], [])
+
+    def test_backfill_fills_missing_vectors(self):
+        Post.objects.update(search_vector=None)
+        self.assertEqual(self.search("nap")[0], [])
+        call_command("backfill_search_vectors", batch_size=3, stdout=io.StringIO())
+        self.assertEqual(self.search("nap")[0], ["A cat nap"])
+
+
+@override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=1)
+class FanOutOnReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.fans = [User.objects.create_user(f"fan{i}", f"fan{i}@example.com", PASSWORD) for i in range(2)]
+        for fan in cls.fans:
+            Follow.objects.create(follower=fan, following=cls.author)
+
+    def setUp(self):
+        clear_redis("timeline:")
+        timeline.rebuild(self.fans[0].id)
+        self.post = Post.objects.create(author=self.author, content="popular")
+        self.assertEqual(fan_out_post(self.post.id), "Author is fanned out on read.")
+
+    def test_deletes_skip_the_follower_scan(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(remove_post_from_timelines(self.post.id, self.author.id), "Author is fanned out on read.")
+
+    def test_authors_back_under_the_limit_fan_out_on_write_again(self):
+        self.assertEqual(timeline.members(self.fans[0].id), [])
+        self.assertEqual(restore_fan_out_on_write(), "Restored fan-out-on-write for 0 authors.")
+
+        Follow.objects.filter(follower=self.fans[1]).delete()
+        self.assertEqual(restore_fan_out_on_write(), "Restored fan-out-on-write for 1 authors.")
+        self.assertFalse(timeline.is_fanout_on_read(self.author.id))
+        self.assertEqual(timeline.members(self.fans[0].id), [self.post.id])
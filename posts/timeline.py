@@ -0,0 +1,226 @@
+"""
+Materialized home timelines.
+
+Every user's feed is kept as a Redis sorted set of post ids scored by the
+post's creation time (in microseconds). New posts are pushed onto followers'
+timelines by a Celery task (fan-out-on-write). Authors with a very large
+audience are skipped at write time and their posts are merged into the feed
+when it is read (fan-out-on-read), so a single post never has to touch
+millions of sorted sets. The hourly ``restore_fan_out_on_write`` task moves
+authors whose audience shrank back under the limit to fan-out-on-write.
+
+Only timelines that already exist are written to; a missing key means the
+timeline is cold and will be rebuilt from Postgres on the next read.
+"""
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from users.models import Follow
+from .models import Post
+
+TIMELINE_KEY = "timeline:{user_id}"
+FANOUT_ON_READ_KEY = "timeline:fanout-on-read"
+
+# Marks a timeline that has been built but holds no posts yet. Its score of 0
+# keeps it below every real post, so reads skip it with a "(0" lower bound.
+EMPTY_MARKER = "-"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# ZADD a post to every timeline in KEYS that already exists, then trim each
+# one to the newest ARGV[3] entries.
+_PUSH_SCRIPT = """
+local trim_to = -(tonumber(ARGV[3]) + 1)
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 0, trim_to)
+    end
+end
+return 0
+"""
+
+# ZADD the score/member pairs in ARGV[2..] to KEYS[1] if it already exists,
+# then trim it to the newest ARGV[1] entries.
+_MERGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[1]) + 1))
+return 1
+"""
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def timeline_key(user_id):
+    return TIMELINE_KEY.format(user_id=user_id)
+
+
+def to_score(created_at):
+    """Sorted-set score for a post timestamp (integer microseconds)."""
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def from_score(score):
+    return EPOCH + timedelta(microseconds=int(score))
+
+
+def push(user_ids, post_id, created_at):
+    """Add a post to the existing timelines of ``user_ids``."""
+    keys = [timeline_key(user_id) for user_id in user_ids]
+    if keys:
+        _redis().eval(
+            _PUSH_SCRIPT, len(keys), *keys,
+            to_score(created_at), post_id, settings.TIMELINE_MAX_LENGTH,
+        )
+
+
+def merge(user_id, posts):
+    """Add several (post_id, created_at) pairs to a user's existing timeline."""
+    args = []
+    for post_id, created_at in posts:
+        args += [to_score(created_at), post_id]
+    if args:
+        _redis().eval(_MERGE_SCRIPT, 1, timeline_key(user_id), settings.TIMELINE_MAX_LENGTH, *args)
+
+
+def remove(user_ids, post_ids):
+    """Drop posts from the timelines of ``user_ids``."""
+    if not post_ids:
+        return
+    pipe = _redis().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zrem(timeline_key(user_id), *post_ids)
+    pipe.execute()
+
+
+def members(user_id):
+    """Post ids currently cached on a user's timeline."""
+    ids = _redis().zrangebyscore(timeline_key(user_id), "(0", "+inf")
+    return [int(post_id) for post_id in ids]
+
+
+def mark_fanout_on_read(author_id):
+    """Stop fanning out ``author_id``'s posts; they are merged in at read time."""
+    _redis().sadd(FANOUT_ON_READ_KEY, author_id)
+
+
+def unmark_fanout_on_read(author_id):
+    """Fan ``author_id``'s posts out on write again."""
+    _redis().srem(FANOUT_ON_READ_KEY, author_id)
+
+
+def is_fanout_on_read(author_id):
+    return bool(_redis().sismember(FANOUT_ON_READ_KEY, author_id))
+
+
+def fanout_on_read_authors():
+    return [int(author_id) for author_id in _redis().smembers(FANOUT_ON_READ_KEY)]
+
+
+def _followed_posts(user_id, author_ids=None, after=None, limit=None):
+    """
+    (id, score) pairs for posts by authors ``user_id`` follows, newest first,
+    strictly older than the ``after`` (created_at, id) position.
+    """
+    if author_ids is None:
+        author_ids = Follow.objects.filter(follower_id=user_id).values("following_id")
+    posts = Post.objects.filter(author_id__in=author_ids)
+    if after is not None:
+        created_at, pk = after
+        posts = posts.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+    rows = posts.order_by("-created_at", "-id").values_list("id", "created_at")[:limit]
+    return [(post_id, to_score(created_at)) for post_id, created_at in rows]
+
+
+def rebuild(user_id):
+    """Populate a cold timeline from Postgres."""
+    entries = _followed_posts(user_id, limit=settings.TIMELINE_MAX_LENGTH)
+    mapping = {str(post_id): score for post_id, score in entries}
+    mapping[EMPTY_MARKER] = 0
+
+    key = timeline_key(user_id)
+    pipe = _redis().pipeline()
+    pipe.delete(key)
+    pipe.zadd(key, mapping)
+    pipe.expire(key, settings.TIMELINE_TTL)
+    pipe.execute()
+
+
+def _read(user_id, limit, after=None):
+    """
+    Read up to ``limit`` (id, score) pairs from the cached timeline that come
+    after the ``after`` (created_at, id) position.
+
+    Returns ``(entries, size)`` or ``(None, 0)`` if the timeline is cold.
+    """
+    key = timeline_key(user_id)
+    max_score = "+inf" if after is None else to_score(after[0])
+
+    pipe = _redis().pipeline()
+    pipe.exists(key)
+    pipe.zcard(key)
+    # Posts sharing the cursor's timestamp are read too and filtered by id below.
+    pipe.zcount(key, max_score, max_score)
+    exists, size, ties = pipe.execute()
+    if not exists:
+        return None, 0
+
+    pipe = _redis().pipeline()
+    pipe.zrevrangebyscore(key, max_score, "(0", start=0, num=limit + ties, withscores=True)
+    pipe.expire(key, settings.TIMELINE_TTL)
+    rows, _ = pipe.execute()
+
+    entries = [(int(post_id), int(score)) for post_id, score in rows]
+    if after is not None:
+        position = (max_score, after[1])
+        entries = [(post_id, score) for post_id, score in entries if (score, post_id) < position]
+    return entries[:limit], size
+
+
+def home_timeline(user_id, limit, after=None):
+    """
+    Return up to ``limit`` feed posts for ``user_id``, newest first, that come
+    after the ``after`` (created_at, id) position.
+    """
+    entries, size = _read(user_id, limit, after)
+    if entries is None:
+        rebuild(user_id)
+        entries, size = _read(user_id, limit, after)
+
+    # The cache only holds the newest TIMELINE_MAX_LENGTH posts; page past
+    # its tail straight from Postgres.
+    if len(entries) < limit and size >= settings.TIMELINE_MAX_LENGTH:
+        tail = (from_score(entries[-1][1]), entries[-1][0]) if entries else after
+        entries += _followed_posts(user_id, after=tail, limit=limit - len(entries))
+
+    # Merge in posts from followed high-fan-out authors.
+    fanout_on_read = _redis().smembers(FANOUT_ON_READ_KEY)
+    if fanout_on_read:
+        authors = list(
+            Follow.objects.filter(
+                follower_id=user_id, following_id__in=[int(a) for a in fanout_on_read]
+            ).values_list("following_id", flat=True)
+        )
+        if authors:
+            entries += _followed_posts(user_id, author_ids=authors, after=after, limit=limit)
+
+    seen = set()
+    ordered = []
+    for post_id, _ in sorted(entries, key=lambda e: (e[1], e[0]), reverse=True):
+        if post_id not in seen:
+            seen.add(post_id)
+            ordered.append(post_id)
+    ordered = ordered[:limit]
+
+    # Deleted posts may linger in the cache until trimmed; skip them here.
+    posts = Post.objects.select_related("author").in_bulk(ordered)
+    return [posts[post_id] for post_id in ordered if post_id in posts]
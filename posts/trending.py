@@ -0,0 +1,104 @@
+"""
+Trending posts.
+
+Every post's engagement is kept as a time-decayed score in one Redis sorted
+set. Likes, comments and shares add their weight with ZINCRBY when they
+commit. A Beat task (``posts.tasks.decay_trending_posts``) scales every score
+by ``0.5 ** (elapsed / TRENDING_HALF_LIFE)`` in a single ZUNIONSTORE. The same
+task drops posts that have cooled below ``TRENDING_MIN_SCORE`` and keeps only
+the top ``TRENDING_MAX_POSTS``. Reading the top N is a range read, and nothing
+is aggregated in Postgres.
+
+The cursor is a (score, id) position, so paging is exact while scores stand
+still: no post is returned twice and none is left out. A post whose score
+changes between pages moves: one that gains engagement past the cursor is not
+shown on later pages, and one that loses it may be shown again. A decay run
+lowers every score, so the page after one can repeat posts already seen.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from .models import Post
+
+TRENDING_KEY = "trending:posts"
+DECAYED_AT_KEY = "trending:decayed-at"
+
+WEIGHTS = {
+    "like": 1.0,
+    "comment": 2.0,
+    "share": 3.0,
+}
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def record(post_id, kind):
+    """Add the weight of a ``like``/``comment``/``share`` to a post once the transaction commits."""
+    record_many([post_id], kind)
+
+
+def record_many(post_ids, kind):
+    """``record`` for several posts, in one Redis round trip."""
+
+    def increment():
+        pipe = _redis().pipeline(transaction=False)
+        for post_id in post_ids:
+            pipe.zincrby(TRENDING_KEY, WEIGHTS[kind], post_id)
+        pipe.execute()
+
+    transaction.on_commit(increment)
+
+
+def remove(post_id):
+    transaction.on_commit(lambda: _redis().zrem(TRENDING_KEY, post_id))
+
+
+def decay():
+    """Decay every score by the time elapsed since the last run, then prune. Returns the number pruned."""
+    now = time.time()
+    redis = _redis()
+    last = redis.getset(DECAYED_AT_KEY, now)
+    factor = 1.0 if last is None else 0.5 ** ((now - float(last)) / settings.TRENDING_HALF_LIFE)
+
+    pipe = redis.pipeline()
+    pipe.zunionstore(TRENDING_KEY, {TRENDING_KEY: factor})
+    pipe.zremrangebyscore(TRENDING_KEY, "-inf", f"({settings.TRENDING_MIN_SCORE}")
+    pipe.zremrangebyrank(TRENDING_KEY, 0, -(settings.TRENDING_MAX_POSTS + 1))
+    _, cooled, overflow = pipe.execute()
+    return cooled + overflow
+
+
+def _read(limit, after=None):
+    """Up to ``limit`` (score, id) pairs, highest first, strictly after the ``after`` position."""
+    redis = _redis()
+    max_score = "+inf" if after is None else after[0]
+    # Redis orders equal scores by member string; read whole runs of ties at
+    # both ends of the page and order them by id here instead.
+    ties = 0 if after is None else redis.zcount(TRENDING_KEY, max_score, max_score)
+    rows = redis.zrevrangebyscore(TRENDING_KEY, max_score, "-inf", start=0, num=limit + ties, withscores=True)
+    if rows:
+        boundary = rows[-1][1]
+        rows += redis.zrangebyscore(TRENDING_KEY, boundary, boundary, withscores=True)
+
+    entries = sorted({(score, int(post_id)) for post_id, score in rows}, reverse=True)
+    if after is not None:
+        entries = [entry for entry in entries if entry < tuple(after)]
+    return entries[:limit]
+
+
+def top(limit, after=None):
+    """
+    Up to ``limit`` ``(score, post)`` pairs, highest score first, after the
+    ``after`` (score, id) position. Posts are fetched in one query.
+    """
+    entries = _read(limit, after)
+    posts = Post.objects.select_related("author").in_bulk([post_id for _, post_id in entries])
+    missing = [post_id for _, post_id in entries if post_id not in posts]
+    if missing:
+        _redis().zrem(TRENDING_KEY, *missing)
+    return [(score, posts[post_id]) for score, post_id in entries if post_id in posts]
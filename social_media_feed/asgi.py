@@ -2,6 +2,8 @@
 ASGI config for Social_media_feed project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSockets on ``/graphql/`` carry GraphQL subscriptions
+(see ``websocket.py``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -11,6 +13,18 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Social_media_feed.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_media_feed.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready.
+from .websocket import graphql_ws  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] != "websocket":
+        return await django_application(scope, receive, send)
+    if scope["path"] == "/graphql/":
+        return await graphql_ws(scope, receive, send)
+    await receive()
+    await send({"type": "websocket.close"})
@@ -0,0 +1,30 @@
+"""
+Helpers shared by the bulk mutations (followUsers, likePosts, createPosts).
+
+A bulk mutation accepts up to ``GRAPHQL_MAX_BULK_SIZE`` items, validates them
+together with one query, writes the valid ones with one statement and
+returns one result per input item, in input order.
+"""
+from django.conf import settings
+from graphql import GraphQLError
+
+DUPLICATE = "Duplicate item"
+
+
+def check_size(items):
+    if len(items) > settings.GRAPHQL_MAX_BULK_SIZE:
+        raise GraphQLError(f"At most {settings.GRAPHQL_MAX_BULK_SIZE} items per call")
+
+
+def item_errors(ids, errors):
+    """
+    ``(id, error)`` for every input id. Repeats of an id are reported as
+    duplicates; the first occurrence gets its error from ``errors`` (None
+    when it succeeded).
+    """
+    seen = set()
+    results = []
+    for id in ids:
+        results.append((id, DUPLICATE if id in seen else errors.get(id)))
+        seen.add(id)
+    return results
@@ -28,4 +28,24 @@ app.conf.beat_schedule = {
         "task": "posts.tasks.log_post_metrics",
         "schedule": crontab(minute=0, hour="*"),  # every hour
     },
+    "decay-trending-posts": {
+        "task": "posts.tasks.decay_trending_posts",
+        "schedule": crontab(minute="*/10"),  # every 10 minutes
+    },
+    "refresh-stale-suggestions": {
+        "task": "users.tasks.refresh_stale_suggestions",
+        "schedule": crontab(minute="*/5"),  # every 5 minutes
+    },
+    "rebuild-suggestions-nightly": {
+        "task": "users.tasks.rebuild_suggestions",
+        "schedule": crontab(hour=3, minute=0),  # catches anything the incremental path missed
+    },
+    "reconcile-post-counters-hourly": {
+        "task": "posts.tasks.reconcile_post_counters",
+        "schedule": crontab(minute=30, hour="*"),  # every hour, off the metrics slot
+    },
+    "restore-fan-out-on-write-hourly": {
+        "task": "posts.tasks.restore_fan_out_on_write",
+        "schedule": crontab(minute=45, hour="*"),  # every hour
+    },
 }
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Static query depth and cost analysis.
+
+Runs as a validation rule, so over-limit queries are rejected before any
+resolver executes. Depth counts nested fields. Cost counts every field a
+query could resolve: a connection multiplies its selection by the page size
+it asks for (``first``, clamped to ``GRAPHQL_MAX_PAGE_SIZE``; a variable
+counts as the maximum), and a plain list multiplies by the maximum page size.
+Introspection fields are free.
+"""
+from django.conf import settings
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    InlineFragmentNode,
+    IntValueNode,
+    OperationDefinitionNode,
+    ValidationRule,
+    get_named_type,
+    get_nullable_type,
+    is_list_type,
+)
+from graphql.language.visitor import SKIP
+
+
+def _is_connection(graphql_type):
+    fields = getattr(get_named_type(graphql_type), "fields", None) or {}
+    return "edges" in fields and "pageInfo" in fields
+
+
+def _page_size(field_node):
+    for argument in field_node.arguments:
+        if argument.name.value == "first":
+            if isinstance(argument.value, IntValueNode):
+                return max(1, min(int(argument.value.value), settings.GRAPHQL_MAX_PAGE_SIZE))
+            return settings.GRAPHQL_MAX_PAGE_SIZE
+    return settings.GRAPHQL_DEFAULT_PAGE_SIZE
+
+
+def _multiplier(parent_type, field_def, field_node):
+    if _is_connection(field_def.type):
+        return _page_size(field_node)
+    # A connection's edges are already counted by the connection's page size.
+    if is_list_type(get_nullable_type(field_def.type)) and not _is_connection(parent_type):
+        return settings.GRAPHQL_MAX_PAGE_SIZE
+    return 1
+
+
+def _measure(schema, fragments, selection_set, parent_type, depth, visiting):
+    """Return ``(cost, depth)`` of a selection set on ``parent_type``."""
+    cost = 0
+    max_depth = depth
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            fields = getattr(parent_type, "fields", None) or {}
+            if name.startswith("__") or name not in fields:
+                continue
+            field_def = fields[name]
+            child_cost, child_depth = 0, depth + 1
+            if selection.selection_set:
+                child_cost, child_depth = _measure(
+                    schema, fragments, selection.selection_set,
+                    get_named_type(field_def.type), depth + 1, visiting,
+                )
+            cost += 1 + _multiplier(parent_type, field_def, selection) * child_cost
+            max_depth = max(max_depth, child_depth)
+            continue
+
+        if isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is None or fragment.name.value in visiting:
+                continue
+            visiting = visiting | {fragment.name.value}
+            type_condition, child_selections = fragment.type_condition, fragment.selection_set
+        elif isinstance(selection, InlineFragmentNode):
+            type_condition, child_selections = selection.type_condition, selection.selection_set
+        else:
+            continue
+
+        fragment_type = schema.get_type(type_condition.name.value) if type_condition else parent_type
+        child_cost, child_depth = _measure(
+            schema, fragments, child_selections, fragment_type or parent_type, depth, visiting
+        )
+        cost += child_cost
+        max_depth = max(max_depth, child_depth)
+    return cost, max_depth
+
+
+def analyze(schema, document, operation):
+    """Return ``(cost, depth)`` for one operation of a parsed document."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    root_type = schema.get_root_type(operation.operation)
+    if root_type is None:
+        return 0, 0
+    return _measure(schema, fragments, operation.selection_set, root_type, 0, frozenset())
+
+
+class QueryComplexityRule(ValidationRule):
+    """Reject operations deeper than GRAPHQL_MAX_QUERY_DEPTH or costlier than GRAPHQL_MAX_QUERY_COST."""
+
+    def enter_document(self, node, *args):
+        for definition in node.definitions:
+            if not isinstance(definition, OperationDefinitionNode):
+                continue
+            cost, depth = analyze(self.context.schema, node, definition)
+            name = definition.name.value if definition.name else "anonymous operation"
+            if depth > settings.GRAPHQL_MAX_QUERY_DEPTH:
+                self.report_error(GraphQLError(
+                    f"{name} has depth {depth}, over the maximum of {settings.GRAPHQL_MAX_QUERY_DEPTH}",
+                    definition,
+                    extensions={"code": "QUERY_TOO_DEEP", "depth": depth},
+                ))
+            if cost > settings.GRAPHQL_MAX_QUERY_COST:
+                self.report_error(GraphQLError(
+                    f"{name} has cost {cost}, over the maximum of {settings.GRAPHQL_MAX_QUERY_COST}",
+                    definition,
+                    extensions={"code": "QUERY_TOO_COMPLEX", "cost": cost},
+                ))
+        return SKIP
@@ -0,0 +1,143 @@
+"""
+Parsed-document cache and automatic persisted queries (APQ).
+
+Clients following the Apollo APQ protocol send only the sha256 hash of a
+query in ``extensions.persistedQuery``. The first time a hash is seen the
+server answers ``PersistedQueryNotFound``, the client retries with the full
+text, and the text is stored in the Redis cache under its hash.
+
+Independently of APQ, every document is parsed and validated once per
+process and kept, keyed by hash, in a bounded LRU together with the cost
+analysis of its operations. Hot queries therefore skip the Redis round trip
+and the parse, validate and analyze CPU.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError, parse, validate
+
+PERSISTED_QUERY_KEY = "apq:{sha256}"
+
+
+class PersistedQueryError(Exception):
+    """Raised when an APQ request cannot be served; carries the error to return."""
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.error = GraphQLError(message, extensions={"code": code})
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def persisted_query_hash(extensions):
+    """The sha256 hash from a request's ``extensions``, if it uses APQ."""
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            return None
+    if not isinstance(extensions, dict):
+        return None
+    persisted = extensions.get("persistedQuery") or {}
+    if persisted.get("version") != 1:
+        return None
+    return persisted.get("sha256Hash")
+
+
+class DocumentCache:
+    """
+    Thread-safe LRU of ``hash -> (query, document, validation errors,
+    analyses)``; ``analyses`` maps ``id(operation)`` to its cost analysis.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+documents = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+def resolve_query(query, extensions):
+    """
+    Return ``(query, sha256)`` for a request, applying the APQ protocol.
+
+    Raises ``PersistedQueryError`` when the hash is unknown or does not match
+    the query text that came with it.
+    """
+    sha256 = persisted_query_hash(extensions)
+    if sha256 is None:
+        return query, (query_hash(query) if query else None)
+
+    if query:
+        if query_hash(query) != sha256:
+            raise PersistedQueryError("provided sha does not match query", "INVALID_SHA256_HASH")
+        cache.set(
+            PERSISTED_QUERY_KEY.format(sha256=sha256), query, settings.GRAPHQL_PERSISTED_QUERY_TTL
+        )
+        return query, sha256
+
+    entry = documents.get(sha256)
+    if entry is not None:
+        return entry[0], sha256
+
+    query = cache.get(PERSISTED_QUERY_KEY.format(sha256=sha256))
+    if query is None:
+        raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    return query, sha256
+
+
+def parse_and_validate(schema, query, sha256, rules=None):
+    """
+    Return ``(document, validation_errors)`` for ``query``, from the LRU when
+    possible. Syntax errors propagate as ``GraphQLError`` and are not cached.
+    """
+    entry = documents.get(sha256)
+    if entry is not None:
+        return entry[1], entry[2]
+
+    document = parse(query)
+    errors = validate(schema, document, rules, graphene_settings.MAX_VALIDATION_ERRORS)
+    documents.set(sha256, (query, document, errors, {}))
+    return document, errors
+
+
+def operation_analysis(sha256, document, operation, analyze):
+    """
+    ``analyze(document, operation)``, computed once per operation while
+    ``document`` is the one cached under ``sha256``.
+    """
+    entry = documents.get(sha256)
+    if entry is None or entry[1] is not document:
+        return analyze(document, operation)
+    analyses = entry[3]
+    result = analyses.get(id(operation))
+    if result is None:
+        result = analyses[id(operation)] = analyze(document, operation)
+    return result
@@ -0,0 +1,38 @@
+"""
+Redis pub/sub events behind the GraphQL subscriptions.
+
+Mutations publish small JSON messages once their transaction commits, each on
+a channel named after the thing that changed. A web node subscribes only to
+the channels its connected clients are watching (see ``subscriptions.py``),
+so Redis forwards each event only to the nodes that need it.
+"""
+import json
+
+from django.db import transaction
+from django_redis import get_redis_connection
+
+POSTS_CHANNEL = "events:posts:{author_id}"
+COMMENTS_CHANNEL = "events:comments:{post_id}"
+ENGAGEMENT_CHANNEL = "events:engagement:{post_id}"
+
+
+def publish(channel, payload):
+    """Publish ``payload`` on ``channel`` once the current transaction commits."""
+    message = json.dumps(payload)
+    transaction.on_commit(lambda: get_redis_connection("default").publish(channel, message))
+
+
+def post_created(post):
+    publish(POSTS_CHANNEL.format(author_id=post.author_id), {"post_id": post.pk})
+
+
+def comment_added(comment):
+    publish(COMMENTS_CHANNEL.format(post_id=comment.post_id), {"comment_id": comment.pk})
+
+
+def engagement_changed(post_id, likes=0, comments=0, shares=0):
+    """Publish the change (not the total) in a post's like, comment and share counts."""
+    publish(
+        ENGAGEMENT_CHANNEL.format(post_id=post_id),
+        {"post_id": post_id, "likes": likes, "comments": comments, "shares": shares},
+    )
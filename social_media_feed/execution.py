@@ -0,0 +1,49 @@
+"""
+Executing GraphQL operations whose query resolvers are coroutines.
+
+Query resolvers use Django's async ORM, so the same resolvers serve the
+WebSocket subscriptions on the ASGI event loop. Over HTTP the view runs on
+WSGI workers and executes each query on an event loop of its own via
+``async_to_sync``. The ORM runs every call in the request's one sync thread
+(``thread_sensitive``), so the root fields of a query take their turns at
+the database either way. Mutations stay synchronous: each runs in a single
+thread, where it can hold a transaction and queue ``on_commit`` callbacks.
+The views and the tests both go through here.
+"""
+from inspect import isawaitable
+
+from asgiref.sync import async_to_sync
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, parse, validate
+
+
+def is_mutation(operation):
+    return operation is not None and operation.operation == OperationType.MUTATION
+
+
+async def execute_query(schema, document, **options):
+    """Execute a query (or anything but a mutation) on the running event loop."""
+    result = execute(schema, document, **options)
+    if isawaitable(result):
+        result = await result
+    return result
+
+
+def execute_sync(schema, source, operation_name=None, **options):
+    """
+    Parse, validate and execute ``source`` from sync code: mutations in this
+    thread, everything else on an event loop. A stand-in for graphene's
+    ``Schema.execute`` (which cannot await resolvers).
+    """
+    schema = getattr(schema, "graphql_schema", schema)
+    try:
+        document = parse(source)
+    except GraphQLError as e:
+        return ExecutionResult(errors=[e])
+    errors = validate(schema, document)
+    if errors:
+        return ExecutionResult(errors=errors)
+
+    options["operation_name"] = operation_name
+    if is_mutation(get_operation_ast(document, operation_name)):
+        return execute(schema, document, **options)
+    return async_to_sync(execute_query)(schema, document, **options)
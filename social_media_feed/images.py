@@ -0,0 +1,159 @@
+"""
+Resized image variants for uploaded post and profile images.
+
+Uploads are stored as-is on the request path and their status is set to
+``processing``. A Celery task then re-encodes each upload as WebP and JPEG at
+every width in ``IMAGE_VARIANT_WIDTHS`` no larger than the original. EXIF
+metadata (camera, GPS) is dropped after it has been used to orient the
+pixels. The task records the variants on the row, and clients pick one via
+the ``srcset`` field.
+"""
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+import graphene
+from PIL import Image, ImageOps
+
+from .retention import delete_files_on_commit
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = "variants"
+
+# format -> (Pillow format, save options, file extension)
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}, "webp"),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}, "jpg"),
+}
+
+
+class ImageStatus(models.TextChoices):
+    NONE = "none", "No image"
+    PROCESSING = "processing", "Processing"
+    READY = "ready", "Ready"
+    FAILED = "failed", "Failed"
+
+
+ImageFormat = graphene.Enum("ImageFormat", [("WEBP", "webp"), ("JPEG", "jpeg")])
+
+
+def srcset_field():
+    """GraphQL field for a ``srcset`` of an image's variants; null until they are ready."""
+    return graphene.String(format=ImageFormat(default_value="webp"))
+
+
+def variant_name(width, fmt):
+    # The storage files it under its content hash inside this directory.
+    return f"{VARIANTS_DIR}/{width}w/variant.{FORMATS[fmt][2]}"
+
+
+def build_variants(name):
+    """
+    Write every variant of the stored image ``name`` and return their
+    descriptions as ``{"name", "width", "height", "format"}`` dicts.
+    """
+    with default_storage.open(name, "rb") as f:
+        with Image.open(f) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    widths = [w for w in settings.IMAGE_VARIANT_WIDTHS if w < image.width] or [image.width]
+    variants = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        for fmt, (pillow_format, options, _) in FORMATS.items():
+            frame = resized.convert("RGBA" if has_alpha and fmt == "webp" else "RGB")
+            buffer = io.BytesIO()
+            # No exif= argument, so none of the original metadata is written.
+            frame.save(buffer, pillow_format, **options)
+            stored = default_storage.save(variant_name(width, fmt), ContentFile(buffer.getvalue()))
+            variants.append({"name": stored, "width": width, "height": height, "format": fmt})
+    return variants
+
+
+def delete_variants(variants):
+    for variant in variants or ():
+        default_storage.delete(variant["name"])
+
+
+def srcset(instance, field_name, fmt):
+    """``srcset`` attribute value for one format of an image's variants, or None if not ready."""
+    if getattr(instance, f"{field_name}_status") != ImageStatus.READY:
+        return None
+    fmt = getattr(fmt, "value", fmt)
+    return ", ".join(
+        f"{default_storage.url(v['name'])} {v['width']}w"
+        for v in getattr(instance, f"{field_name}_variants")
+        if v["format"] == fmt
+    )
+
+
+def release(instance, field_name):
+    """Release ``instance``'s image and its variants once the transaction commits."""
+    image = getattr(instance, field_name)
+    variants = getattr(instance, f"{field_name}_variants")
+    delete_files_on_commit([image.name if image else None, *(v["name"] for v in variants)])
+
+
+def replace(instance, field_name, upload):
+    """
+    Put ``upload`` in ``instance.field_name`` and mark it as waiting for
+    variants. The previous image and its variants are released once the
+    change commits.
+    """
+    release(instance, field_name)
+    setattr(instance, field_name, upload)
+    setattr(instance, f"{field_name}_variants", [])
+    setattr(
+        instance,
+        f"{field_name}_status",
+        ImageStatus.PROCESSING if getattr(instance, field_name) else ImageStatus.NONE,
+    )
+
+
+def save(instance, field_name, upload=None):
+    """
+    Save ``instance``, first replacing its image with ``upload`` if one is
+    given. The storage takes its reference on the upload in the same
+    transaction as the row, so a failed save leaves no reference behind.
+    """
+    if not upload:
+        instance.save()
+        return
+    with transaction.atomic():
+        replace(instance, field_name, upload)
+        instance.save()
+
+
+def process(model, pk, field_name, name):
+    """
+    Build variants for ``model.field_name`` of row ``pk`` if it still holds
+    ``name``. Returns the new status, or None when the upload was replaced
+    before processing finished.
+    """
+    current = model.objects.filter(pk=pk, **{field_name: name})
+    try:
+        # The storage takes a reference on every variant it writes; keep them
+        # in one transaction with the row, so a run that fails half-way
+        # leaves no references behind, only files for the orphan sweep.
+        with transaction.atomic():
+            variants = build_variants(name)
+            updated = current.update(
+                **{f"{field_name}_variants": variants, f"{field_name}_status": ImageStatus.READY}
+            )
+            if not updated:
+                delete_variants(variants)
+                return None
+    except Exception:
+        # Pillow reports malformed or unsupported files with many exception
+        # types; any of them must end in FAILED, not a row stuck processing.
+        logger.exception("Could not build variants of %s", name)
+        failed = current.update(**{f"{field_name}_status": ImageStatus.FAILED})
+        return ImageStatus.FAILED if failed else None
+    return ImageStatus.READY
@@ -0,0 +1,98 @@
+"""
+Per-request DataLoaders for foreign-key fields on GraphQL types.
+
+Each request gets one loader per related model, stored on ``info.context``.
+Instead of every row lazily fetching its own related object, a loader
+collects the keys and fetches them with a single ``WHERE id IN (...)``.
+
+Under async execution the loaders are backed by graphene's ``DataLoader``,
+which batches every ``load()`` issued in the same event-loop tick. Sync
+execution has no ticks, so lists returned by the pagination layer tag their
+nodes with their siblings: the first related lookup on any node loads the
+keys for the whole page at once.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from graphene.utils.dataloader import DataLoader
+
+SIBLINGS_ATTR = "_loader_siblings"
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ModelLoader:
+    """Batches primary-key lookups for one model within a request."""
+
+    def __init__(self, model):
+        self.model = model
+        self._cache = {}
+        self._dataloader = None
+
+    def _fetch(self, keys):
+        found = self.model._default_manager.in_bulk(keys)
+        share_batch(list(found.values()))
+        for key in keys:
+            self._cache[key] = found.get(key)
+
+    async def _batch_load(self, keys):
+        missing = [key for key in keys if key not in self._cache]
+        if missing:
+            await sync_to_async(self._fetch)(missing)
+        return [self._cache[key] for key in keys]
+
+    def load(self, key, siblings=()):
+        """
+        Return the object with primary key ``key``.
+
+        Returns an awaitable when called from a running event loop. In sync
+        mode, ``siblings`` are the keys of the neighbouring rows and are
+        fetched in the same query.
+        """
+        if _in_event_loop():
+            if self._dataloader is None:
+                self._dataloader = DataLoader(self._batch_load)
+            return self._dataloader.load(key)
+
+        if key not in self._cache:
+            pending = {key}
+            pending.update(k for k in siblings if k is not None and k not in self._cache)
+            self._fetch(list(pending))
+        return self._cache[key]
+
+
+def get_loader(info, model):
+    """Return the request's loader for ``model``, creating it on first use."""
+    loaders = getattr(info.context, "loaders", None)
+    if loaders is None:
+        loaders = {}
+        info.context.loaders = loaders
+    if model not in loaders:
+        loaders[model] = ModelLoader(model)
+    return loaders[model]
+
+
+def share_batch(nodes):
+    """Mark ``nodes`` as one batch for sync-mode related lookups."""
+    for node in nodes:
+        setattr(node, SIBLINGS_ATTR, nodes)
+    return nodes
+
+
+def load_related(info, instance, field_name):
+    """Resolve the foreign key ``field_name`` of ``instance`` via a loader."""
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        return getattr(instance, field_name)
+
+    key = getattr(instance, field.attname)
+    if key is None:
+        return None
+    siblings = [getattr(node, field.attname) for node in getattr(instance, SIBLINGS_ATTR, ())]
+    return get_loader(info, field.related_model).load(key, siblings)
@@ -0,0 +1,50 @@
+"""
+A small closed-loop HTTP load driver for the GraphQL endpoint.
+
+Each client sends its next request as soon as the previous response arrives,
+so the measured throughput is what the server sustains at that concurrency.
+Used by ``manage.py benchmark_graphql`` and ``manage.py benchmark_api``.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def _client(session, url, requests, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        body, headers = next(requests)
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=body, headers=headers) as response:
+                payload = await response.read()
+                ok = response.status == 200 and b'"errors"' not in payload
+        except aiohttp.ClientError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(1)
+
+
+async def run_load(url, requests_for, concurrency, duration):
+    """
+    Drive ``url`` with ``concurrency`` clients for ``duration`` seconds.
+    ``requests_for(i)`` is client ``i``'s iterator of ``(body, headers)``.
+    Returns (sorted latencies, errors).
+    """
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            _client(session, url, requests_for(i), deadline, latencies, errors) for i in range(concurrency)
+        ))
+    return sorted(latencies), len(errors)
@@ -0,0 +1,116 @@
+"""
+Keyset (cursor) pagination for GraphQL list fields.
+
+Lists are returned as Relay-style connections ordered newest first. A cursor
+is an opaque encoding of the ``(created_at, id)`` pair of the last row seen,
+so page N is fetched with an index range scan instead of an OFFSET, and its
+cost does not grow with N.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+import graphene
+from django.conf import settings
+from graphql import GraphQLError
+
+from .loaders import share_batch
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the ``(created_at, id)`` pair encoded in ``cursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise GraphQLError("Invalid cursor")
+
+
+def encode_score_cursor(score, pk):
+    """Cursor for lists ordered by a numeric score instead of a timestamp."""
+    raw = f"{score!r}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_score_cursor(cursor):
+    """Return the ``(score, id)`` pair encoded in ``cursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        score, pk = raw.rsplit("|", 1)
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise GraphQLError("Invalid cursor")
+
+
+def page_size(first):
+    """Clamp the requested page size to the server-enforced maximum."""
+    if first is None:
+        return settings.GRAPHQL_DEFAULT_PAGE_SIZE
+    if first < 1:
+        raise GraphQLError("first must be a positive integer")
+    return min(first, settings.GRAPHQL_MAX_PAGE_SIZE)
+
+
+def connection_args(**extra):
+    """Arguments shared by every paginated field."""
+    return dict(first=graphene.Int(), after=graphene.String(), **extra)
+
+
+def keyset_filter(queryset, after, field="created_at"):
+    """Restrict ``queryset`` to rows strictly after the ``after`` cursor."""
+    if not after:
+        return queryset
+    created_at, pk = decode_cursor(after)
+    return queryset.filter(**{f"{field}__lte": created_at}).exclude(
+        **{field: created_at, "pk__gte": pk}
+    )
+
+
+def build_connection(connection_type, rows, first, after=None, key=None, node=None, encode=encode_cursor):
+    """
+    Build a connection from up to ``first + 1`` rows fetched newest first.
+
+    ``key`` returns the ``(created_at, id)`` pair a row is ordered by, and
+    ``node`` the object to expose on its edge; both default to the row itself.
+    ``encode`` turns that pair into a cursor.
+    """
+    key = key or (lambda row: (row.created_at, row.pk))
+    node = node or (lambda row: row)
+
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+    share_batch([node(row) for row in rows])
+    edges = [
+        connection_type.Edge(node=node(row), cursor=encode(*key(row)))
+        for row in rows
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=bool(after),
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+
+
+async def paginate(queryset, connection_type, first=None, after=None, field="created_at", node=None):
+    """Return one keyset page of ``queryset`` as a ``connection_type``, fetched with the async ORM."""
+    first = page_size(first)
+    queryset = keyset_filter(queryset, after, field).order_by(f"-{field}", "-pk")
+    rows = [row async for row in queryset[:first + 1]]
+    return build_connection(
+        connection_type,
+        rows,
+        first,
+        after,
+        key=lambda row: (getattr(row, field), row.pk),
+        node=node,
+    )
@@ -0,0 +1,113 @@
+"""
+Versioned response cache for public read queries.
+
+Anonymous queries that only select public root fields (``posts`` and
+``post(id)``) are cached in Redis. The cache key includes a version counter
+for every entity the response depends on. Every write that changes what a
+cached response shows bumps those counters after it commits: mutations,
+counter reconciliation, image processing, profile updates (on each of the
+author's posts) and retention deletes. A bump makes every older entry
+unreachable, so a cached response is never served stale. Orphaned entries
+expire on their TTL.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+from graphql import FieldNode, OperationType
+from graphql.utilities import value_from_ast_untyped
+from graphql_jwt.utils import get_credentials
+
+VERSION_KEY = "version:{entity}"
+RESPONSE_KEY = "response:{digest}"
+
+# Public root fields -> the entities their response depends on.
+CACHEABLE_FIELDS = {
+    "posts": lambda args: ["posts"],
+    "post": lambda args: [f"post:{args.get('id')}"],
+}
+
+
+def post_entities(post_id):
+    """Entities to bump when a post or anything shown on it changes."""
+    return ["posts", f"post:{post_id}"]
+
+
+def _incr(entities):
+    pipe = get_redis_connection("default").pipeline(transaction=False)
+    for entity in entities:
+        pipe.incr(cache.make_key(VERSION_KEY.format(entity=entity)))
+    pipe.execute()
+
+
+def bump_versions(*entities):
+    """Invalidate cached responses for ``entities`` once the transaction commits."""
+    transaction.on_commit(lambda: _incr(entities))
+
+
+def bump_author_versions(author_id):
+    """
+    Invalidate cached responses showing ``author_id``'s profile, i.e. the
+    post list and each of their posts, once the transaction commits.
+    """
+    from posts.models import Post
+
+    def bump():
+        post_ids = Post.objects.filter(author_id=author_id).values_list("pk", flat=True)
+        _incr(["posts", *(f"post:{post_id}" for post_id in post_ids.iterator())])
+
+    transaction.on_commit(bump)
+
+
+def _dependencies(operation, variables):
+    """Entities ``operation`` depends on, or None if it is not cacheable."""
+    if operation is None or operation.operation != OperationType.QUERY:
+        return None
+
+    entities = []
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, FieldNode) or selection.directives:
+            return None
+        name = selection.name.value
+        if name == "__typename":
+            continue
+        if name not in CACHEABLE_FIELDS:
+            return None
+        args = {
+            arg.name.value: value_from_ast_untyped(arg.value, variables)
+            for arg in selection.arguments
+        }
+        entities += CACHEABLE_FIELDS[name](args)
+    return entities
+
+
+def cache_key(request, operation, sha256, variables, operation_name):
+    """Return the response cache key for a request, or None if it is not cacheable."""
+    if request.user.is_authenticated or get_credentials(request):
+        return None
+
+    entities = _dependencies(operation, variables or {})
+    if not entities:
+        return None
+
+    version_keys = [VERSION_KEY.format(entity=entity) for entity in entities]
+    versions = cache.get_many(version_keys)
+    parts = [
+        sha256,
+        operation_name or "",
+        json.dumps(variables or {}, sort_keys=True),
+        ",".join(str(versions.get(key, 0)) for key in version_keys),
+    ]
+    digest = hashlib.sha256("|".join(parts).encode()).hexdigest()
+    return RESPONSE_KEY.format(digest=digest)
+
+
+def lookup(key):
+    return cache.get(key)
+
+
+def store(key, data):
+    cache.set(key, data, settings.GRAPHQL_RESPONSE_CACHE_TTL)
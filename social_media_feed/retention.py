@@ -0,0 +1,109 @@
+"""
+Batched retention deletes.
+
+Old rows are deleted in primary-key order, ``RETENTION_BATCH_SIZE`` at a
+time, each batch in its own short transaction. Dependent rows are removed
+with a plain ``DELETE ... WHERE fk = ANY(...)`` instead of Django's deletion
+collector, so nothing is loaded into memory and locks are held for one batch
+only. A run stops once its ``RETENTION_TIME_BUDGET`` is spent and stores the
+last primary key it reached in Redis; the next Beat run resumes from there.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+CHECKPOINT_KEY = "retention:{name}"
+
+
+def delete_rows(model, field_name, values):
+    """Delete ``model`` rows whose ``field_name`` is in ``values``, bypassing the collector."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.get_field(field_name).column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", [list(values)])
+        return cursor.rowcount
+
+
+def purge(name, queryset, cascade=(), before_delete=None, batch_size=None, time_budget=None):
+    """
+    Delete every row of ``queryset`` in primary-key-ordered batches.
+
+    ``cascade`` lists ``(model, field_name)`` pairs whose rows point at the
+    deleted ones and are removed first. ``before_delete(ids)`` runs inside
+    each batch's transaction. Returns ``(deleted, finished)``; ``finished``
+    is False when the time budget ran out and a checkpoint was stored.
+    """
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    deadline = time.monotonic() + (time_budget or settings.RETENTION_TIME_BUDGET)
+    checkpoint_key = CHECKPOINT_KEY.format(name=name)
+    last_pk = cache.get(checkpoint_key, 0)
+    model = queryset.model
+    deleted = 0
+
+    while time.monotonic() < deadline:
+        with transaction.atomic():
+            # Lock the batch so no like or comment can be added to it mid-delete.
+            ids = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .select_for_update()
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                cache.delete(checkpoint_key)
+                return deleted, True
+
+            if before_delete:
+                before_delete(ids)
+            for related_model, field_name in cascade:
+                delete_rows(related_model, field_name, ids)
+            deleted += delete_rows(model, model._meta.pk.name, ids)
+        last_pk = ids[-1]
+
+    cache.set(checkpoint_key, last_pk, None)
+    return deleted, False
+
+
+def delete_files_on_commit(names):
+    """Remove stored files once the rows that referenced them are gone."""
+    names = [name for name in names if name]
+
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+
+    if names:
+        transaction.on_commit(delete)
+
+
+def delete_orphaned_files(directory, referenced, grace=timedelta(days=1)):
+    """
+    Delete files under ``directory`` in MEDIA_ROOT whose names ``referenced``
+    does not contain. ``referenced(names)`` returns the subset still in use.
+    Files younger than ``grace`` are kept, since an upload is written before
+    the row that points at it is committed. Orphans are removed whatever
+    their reference count.
+    """
+    cutoff = timezone.now() - grace
+    root = os.path.join(settings.MEDIA_ROOT, directory)
+    deleted = 0
+    for dirpath, _, filenames in os.walk(root):
+        names = [
+            os.path.relpath(os.path.join(dirpath, filename), settings.MEDIA_ROOT).replace(os.sep, "/")
+            for filename in filenames
+        ]
+        candidates = [name for name in names if default_storage.get_modified_time(name) < cutoff]
+        if not candidates:
+            continue
+        in_use = referenced(candidates)
+        for name in candidates:
+            if name not in in_use:
+                default_storage.discard(name)
+                deleted += 1
+    return deleted
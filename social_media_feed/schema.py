@@ -29,4 +29,13 @@ class Mutation(
     refresh_token = graphql_jwt.Refresh.Field()
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(
+    posts.schema.Subscription,
+    interactions.schema.Subscription,
+    graphene.ObjectType,
+):
+    # Served over WebSocket only (see websocket.py)
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
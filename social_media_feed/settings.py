@@ -58,10 +58,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'posts',
     'users',
     'interactions',
     'graphene_django',
+    'graphql_jwt.refresh_token.apps.RefreshTokenConfig',
     'corsheaders',
     'rest_framework',
 ]
@@ -163,6 +165,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = env("MEDIA_URL", default="/media/")
 MEDIA_ROOT = env("MEDIA_ROOT", default=os.path.join(BASE_DIR, "media"))
 
+# Uploads are stored under their content hash, deduplicated and immutable
+STORAGES = {
+    "default": {"BACKEND": "social_media_feed.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -178,15 +186,71 @@ CACHES = {
     }
 }
 
+# Home timelines (fan-out-on-write, see posts/timeline.py)
+TIMELINE_MAX_LENGTH = env.int("TIMELINE_MAX_LENGTH", default=800)
+TIMELINE_TTL = env.int("TIMELINE_TTL", default=7 * 24 * 60 * 60)
+# Authors with more followers than this are merged into feeds at read time
+TIMELINE_FANOUT_FOLLOWER_LIMIT = env.int("TIMELINE_FANOUT_FOLLOWER_LIMIT", default=10000)
+
+# Trending posts (see posts/trending.py): scores halve every TRENDING_HALF_LIFE
+# seconds; posts below TRENDING_MIN_SCORE or outside the top TRENDING_MAX_POSTS are dropped
+TRENDING_HALF_LIFE = env.int("TRENDING_HALF_LIFE", default=6 * 60 * 60)
+TRENDING_MIN_SCORE = env.float("TRENDING_MIN_SCORE", default=0.05)
+TRENDING_MAX_POSTS = env.int("TRENDING_MAX_POSTS", default=10000)
+
+# Friends-of-friends follow suggestions (see users/suggestions.py)
+SUGGESTIONS_MAX = env.int("SUGGESTIONS_MAX", default=100)
+SUGGESTIONS_BATCH_SIZE = env.int("SUGGESTIONS_BATCH_SIZE", default=500)
+SUGGESTIONS_TTL = env.int("SUGGESTIONS_TTL", default=2 * 24 * 60 * 60)
+
+# Widths (px) of the WebP/JPEG variants built for uploaded images
+IMAGE_VARIANT_WIDTHS = env.list("IMAGE_VARIANT_WIDTHS", cast=int, default=[320, 640, 1080])
+
+# Retention cleanups delete this many rows per transaction and stop after
+# this many seconds, resuming from a checkpoint on the next Beat run
+RETENTION_BATCH_SIZE = env.int("RETENTION_BATCH_SIZE", default=1000)
+RETENTION_TIME_BUDGET = env.int("RETENTION_TIME_BUDGET", default=4 * 60)
+
+# Likes, comments and shares are emailed to post authors as one digest per window (seconds)
+NOTIFICATION_DIGEST_WINDOW = env.int("NOTIFICATION_DIGEST_WINDOW", default=5 * 60)
+# A digest lists at most this many events; older ones are only counted
+NOTIFICATION_DIGEST_MAX_EVENTS = env.int("NOTIFICATION_DIGEST_MAX_EVENTS", default=50)
+
 # GraphQL
 GRAPHENE = {
     'SCHEMA': 'social_media_feed.schema.schema',
     'MIDDLEWARE': ['graphql_jwt.middleware.JSONWebTokenMiddleware'],
 }
+GRAPHQL_DEFAULT_PAGE_SIZE = env.int("GRAPHQL_DEFAULT_PAGE_SIZE", default=20)
+GRAPHQL_MAX_PAGE_SIZE = env.int("GRAPHQL_MAX_PAGE_SIZE", default=100)
+# Parsed + validated documents kept per process, and how long APQ hashes live in Redis
+GRAPHQL_DOCUMENT_CACHE_SIZE = env.int("GRAPHQL_DOCUMENT_CACHE_SIZE", default=500)
+GRAPHQL_PERSISTED_QUERY_TTL = env.int("GRAPHQL_PERSISTED_QUERY_TTL", default=30 * 24 * 60 * 60)
+# Operations deeper or costlier than this are rejected before execution
+GRAPHQL_MAX_QUERY_DEPTH = env.int("GRAPHQL_MAX_QUERY_DEPTH", default=10)
+GRAPHQL_MAX_QUERY_COST = env.int("GRAPHQL_MAX_QUERY_COST", default=5000)
+# Cached anonymous responses are versioned, so the TTL only bounds memory use
+GRAPHQL_RESPONSE_CACHE_TTL = env.int("GRAPHQL_RESPONSE_CACHE_TTL", default=10 * 60)
+# Items accepted by one bulk mutation (followUsers, likePosts, createPosts)
+GRAPHQL_MAX_BULK_SIZE = env.int("GRAPHQL_MAX_BULK_SIZE", default=100)
+
+GRAPHQL_JWT = {
+    "JWT_PAYLOAD_HANDLER": "users.auth.jwt_payload",
+    "JWT_PAYLOAD_GET_USERNAME_HANDLER": "users.auth.payload_username",
+}
+# Users resolved from JWTs are cached per process for a few seconds and in Redis for longer
+JWT_USER_CACHE_SIZE = env.int("JWT_USER_CACHE_SIZE", default=10000)
+JWT_USER_CACHE_LOCAL_TTL = env.int("JWT_USER_CACHE_LOCAL_TTL", default=5)
+JWT_USER_CACHE_TTL = env.int("JWT_USER_CACHE_TTL", default=15 * 60)
+
+# Concurrent password hashes per process (0 hashes in the request's thread), and
+# how long a username that matched no account skips the database
+LOGIN_HASH_WORKERS = env.int("LOGIN_HASH_WORKERS", default=os.cpu_count() or 1)
+LOGIN_UNKNOWN_USERNAME_TTL = env.int("LOGIN_UNKNOWN_USERNAME_TTL", default=60)
 
 AUTHENTICATION_BACKENDS = [
-    "graphql_jwt.backends.JSONWebTokenBackend",
-    "django.contrib.auth.backends.ModelBackend",
+    "users.auth.CachedJSONWebTokenBackend",
+    "users.login.LoginBackend",
 ]
 
 #Celery
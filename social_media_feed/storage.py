@@ -0,0 +1,105 @@
+"""
+Content-addressed media storage.
+
+Uploads are hashed (sha256) while they are streamed to a temporary file and
+then stored as ``<dir>/<aa>/<bb>/<sha256><ext>``, where ``<dir>`` is the
+field's ``upload_to``. Identical bytes therefore map to one file, which is
+never modified once written and can be served with a far-future cache
+header. The rename into place is atomic, so a reader never sees a partial
+file.
+
+Every ``save()`` takes a reference on the file and every ``delete()`` drops
+one (see ``posts.models.MediaFile``). The file is only unlinked when the last
+reference goes, so deleting one post never breaks another post that uploaded
+the same image. The reference is taken in the caller's transaction, so save
+from inside the ``atomic()`` block that writes the row pointing at the file:
+if it rolls back, the reference goes with it and only the file is left, for
+``retention.delete_orphaned_files`` to remove.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.utils import timezone
+
+TMP_DIR = ".tmp"
+
+
+def _media_files():
+    from posts.models import MediaFile
+
+    return MediaFile.objects
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The stored name is derived from the content in _save().
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            sha256 = digest.hexdigest()
+            extension = os.path.splitext(name)[1].lower()
+            name = posixpath.join(posixpath.dirname(name), sha256[:2], sha256[2:4], sha256 + extension)
+            # Take the reference first: a concurrent delete() of the same file
+            # either sees it, or has already unlinked the file we re-create below.
+            self._acquire(name, size)
+
+            full_path = self.path(name)
+            if not os.path.exists(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    def _acquire(self, name, size):
+        table = connection.ops.quote_name(_media_files().model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, size, refcount, created_at) VALUES (%s, %s, 1, %s) "
+                f"ON CONFLICT (name) DO UPDATE SET refcount = {table}.refcount + 1",
+                [name, size, timezone.now()],
+            )
+
+    def delete(self, name):
+        """Drop one reference to ``name``; the file goes with the last one."""
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        with transaction.atomic():
+            entry = _media_files().select_for_update().filter(name=name).first()
+            if entry is not None and entry.refcount > 1:
+                entry.refcount -= 1
+                entry.save(update_fields=["refcount"])
+                return
+            if entry is not None:
+                entry.delete()
+            # Unlink while the row is locked, so a concurrent save() re-creates the file.
+            super().delete(name)
+
+    def discard(self, name):
+        """Remove ``name`` whatever its reference count, e.g. when no row points at it."""
+        with transaction.atomic():
+            _media_files().filter(name=name).delete()
+            super().delete(name)
@@ -0,0 +1,155 @@
+"""
+Per-process fan-out of Redis pub/sub events to GraphQL subscriptions.
+
+Each process keeps one ``redis.asyncio`` pub/sub connection, however many
+clients are connected. A channel is subscribed while at least one local
+subscription is listening to it, and a single reader task copies every
+message into the queues of the subscriptions that asked for it.
+
+If the connection drops, the reader opens a new one and subscribes it to the
+live channels, waiting longer before each try. Events published meanwhile are
+lost, as pub/sub keeps nothing for absent subscribers. After
+``RECONNECT_ATTEMPTS`` failed tries every subscription is ended, so clients
+get ``complete`` and can resubscribe rather than wait on a dead stream.
+"""
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+from contextlib import suppress
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from redis.exceptions import ConnectionError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscription before new ones are dropped for a slow client.
+QUEUE_SIZE = 1000
+# Reconnects tried in a row before the subscriptions are ended; the delay
+# before each one doubles from RECONNECT_DELAY seconds.
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 0.1
+
+# Put on a subscription's queue when the broker gives up on Redis.
+CLOSED = object()
+
+
+class Broker:
+    def __init__(self, url):
+        self._redis = aioredis.from_url(url)
+        self._pubsub = self._redis.pubsub()
+        self._queues = defaultdict(set)
+        self._lock = asyncio.Lock()
+        self._reader = None
+
+    async def listen(self, channels):
+        """Yield the decoded payload of every message published on ``channels``."""
+        channels = list(channels)
+        queue = asyncio.Queue(QUEUE_SIZE)
+        await self._add(channels, queue)
+        try:
+            while (payload := await queue.get()) is not CLOSED:
+                yield payload
+        finally:
+            await self._remove(channels, queue)
+
+    async def _add(self, channels, queue):
+        async with self._lock:
+            new = [channel for channel in channels if not self._queues[channel]]
+            for channel in channels:
+                self._queues[channel].add(queue)
+            if new:
+                await self._pubsub.subscribe(*new)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+
+    async def _remove(self, channels, queue):
+        async with self._lock:
+            idle = []
+            for channel in channels:
+                queues = self._queues.get(channel)
+                if queues is None:
+                    # Already dropped when the broker gave up on Redis.
+                    continue
+                queues.discard(queue)
+                if not queues:
+                    del self._queues[channel]
+                    idle.append(channel)
+            if idle:
+                await self._pubsub.unsubscribe(*idle)
+
+    async def aclose(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def _reconnect(self):
+        """Replace the pub/sub connection and subscribe it to every live channel."""
+        async with self._lock:
+            with suppress(ConnectionError, TimeoutError, OSError):
+                await self._pubsub.aclose()
+            self._pubsub = self._redis.pubsub()
+            if self._queues:
+                await self._pubsub.subscribe(*self._queues)
+
+    async def _recover(self):
+        """Reconnect, backing off between attempts; False once they all failed."""
+        for attempt in range(RECONNECT_ATTEMPTS):
+            await asyncio.sleep(RECONNECT_DELAY * 2 ** attempt)
+            try:
+                await self._reconnect()
+                return True
+            except (ConnectionError, TimeoutError, OSError):
+                logger.warning("Could not reconnect to Redis pub/sub (attempt %d)", attempt + 1, exc_info=True)
+        return False
+
+    async def _give_up(self):
+        async with self._lock:
+            queues = {queue for channel_queues in self._queues.values() for queue in channel_queues}
+            self._queues.clear()
+            for queue in queues:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(CLOSED)
+
+    async def _read(self):
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except (ConnectionError, TimeoutError, OSError):
+                logger.warning("Lost the Redis pub/sub connection", exc_info=True)
+                if not await self._recover():
+                    logger.error("Could not reconnect to Redis pub/sub; ending all subscriptions")
+                    await self._give_up()
+                    return
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"].decode()
+            payload = json.loads(message["data"])
+            for queue in list(self._queues.get(channel, ())):
+                try:
+                    queue.put_nowait(payload)
+                except asyncio.QueueFull:
+                    logger.warning("Dropping %s event for a slow subscriber", channel)
+
+
+_brokers = weakref.WeakKeyDictionary()
+
+
+def get_broker():
+    """The broker for the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    if loop not in _brokers:
+        _brokers[loop] = Broker(settings.CACHES["default"]["LOCATION"])
+    return _brokers[loop]
+
+
+async def close_broker():
+    """Close the running event loop's broker, e.g. before the loop shuts down."""
+    broker = _brokers.pop(asyncio.get_running_loop(), None)
+    if broker is not None:
+        await broker.aclose()
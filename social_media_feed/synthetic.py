@@ -0,0 +1,300 @@
+"""
+Synthetic social graphs for capacity testing.
+
+``generate`` writes users, a power-law follow graph, posts, likes, comments
+and shares straight into Postgres with ``COPY``, from worker processes.
+
+Shape of the data:
+- Follows go to users picked in proportion to ``1 / rank ** follow_exponent``
+  of a random popularity ranking. A few accounts end up with a large share of
+  all followers, and most have a handful.
+- How many users someone follows, and how many posts, likes, comments and
+  shares each user or post gets, are heavy-tailed (Pareto) around the
+  requested means.
+- Each post's engagement counters match the rows generated for it.
+
+The work is split into chunks of consecutive users, each drawn from its own
+``random.Random(f"{seed}:...:{chunk}")``. The same seed and sizes therefore
+give the same rows, however many workers run. The user and post ids are
+reserved from their sequences up front, so workers can point at rows other
+workers write. Run the generator against an otherwise idle database.
+
+All users are written first. Then each chunk writes its users' follows,
+posts, and the likes, comments and shares on those posts, in one
+transaction.
+"""
+import io
+import json
+import multiprocessing
+import random
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, make_password
+from django.db import connection, connections, transaction
+from faker import Faker
+
+from interactions.models import Comment, Like, Share
+from posts.models import Post
+from users.models import Follow, User
+
+# Set in the parent before the workers fork; they read it from there.
+_plan = None
+
+
+class Plan:
+    def __init__(self, seed, prefix, users, follows_per_user, posts_per_user, likes_per_post,
+                 comments_per_post, shares_per_post, follow_exponent, password, until, days, chunk_size):
+        self.seed = seed
+        self.prefix = prefix
+        self.users = users
+        self.follows_per_user = follows_per_user
+        self.likes_per_post = likes_per_post
+        self.comments_per_post = comments_per_post
+        self.shares_per_post = shares_per_post
+        self.chunk_size = chunk_size
+        self.chunks = -(-users // chunk_size)
+        self.end = until.timestamp()
+        self.start = (until - timedelta(days=days)).timestamp()
+        if password is None:
+            # Unusable, like make_password(None), but the same on every run.
+            self.password = f"{UNUSABLE_PASSWORD_PREFIX}synthetic{seed}"
+        else:
+            # A fixed salt keeps the rows identical from run to run.
+            self.password = make_password(password, salt=f"synthetic{seed}")
+
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.vocabulary = fake.words(nb=500, unique=True)
+
+        rng = random.Random(f"{seed}:posts")
+        self.post_counts = [_heavy(rng, posts_per_user) for _ in range(users)]
+        self.posts = sum(self.post_counts)
+        self.post_offsets = [0, *accumulate(self.post_counts)]
+
+        rng = random.Random(f"{seed}:popularity")
+        self.by_rank = list(range(users))
+        rng.shuffle(self.by_rank)
+        self.rank_weights = list(accumulate(1 / (rank + 1) ** follow_exponent for rank in range(users)))
+
+        self.first_user_id = None
+        self.first_post_id = None
+
+    def chunk_users(self, chunk):
+        return range(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, self.users))
+
+
+def _heavy(rng, mean, cap=None):
+    """A Pareto-distributed count with the given mean (stochastically rounded)."""
+    if mean <= 0:
+        return 0
+    value = int(mean / 2 * rng.paretovariate(2) + rng.random())
+    return value if cap is None else min(value, cap)
+
+
+def _distinct(rng, count, draw):
+    """Up to ``count`` distinct values of ``draw()``, giving up after a few misses."""
+    picked = set()
+    for _ in range(count * 3):
+        if len(picked) == count:
+            break
+        picked.add(draw())
+    return picked
+
+
+def _timestamp(rng, start, end):
+    return datetime.fromtimestamp(rng.uniform(start, end), timezone.utc)
+
+
+def _text(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cursor, model, columns, rows):
+    """
+    ``COPY`` ``rows`` (tuples of ``columns``, by attname) into ``model``'s
+    table. Other columns get their field's default, except the primary key,
+    which is left to the database.
+    """
+    qn = connection.ops.quote_name
+    meta = model._meta
+    defaults = [field for field in meta.concrete_fields if field.attname not in columns and not field.primary_key]
+    names = [meta.get_field(column).column for column in columns] + [field.column for field in defaults]
+    tail = "".join("\t" + _text(field.get_default()) for field in defaults)
+
+    buffer = io.StringIO()
+    count = 0
+    for row in rows:
+        buffer.write("\t".join(_text(value) for value in row) + tail + "\n")
+        count += 1
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {qn(meta.db_table)} ({', '.join(map(qn, names))}) FROM STDIN", buffer)
+    return count
+
+
+def reserve_ids(model, count):
+    """Claim ``count`` consecutive ids from ``model``'s sequence; returns the first."""
+    if not count:
+        return None
+    table = model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Blocks inserts (which would draw from the sequence) until the range is claimed.
+        cursor.execute(f"LOCK TABLE {connection.ops.quote_name(table)} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, model._meta.pk.column])
+        sequence = cursor.fetchone()[0]
+        cursor.execute("SELECT nextval(%s)", [sequence])
+        first = cursor.fetchone()[0]
+        cursor.execute("SELECT setval(%s, %s)", [sequence, first + count - 1])
+    return first
+
+
+def _fast_commit(cursor):
+    # Losing the last chunks in a crash is fine for generated data.
+    cursor.execute("SET LOCAL synchronous_commit = off")
+
+
+def _user_rows(plan, chunk):
+    rng = random.Random(f"{plan.seed}:users:{chunk}")
+    for index in plan.chunk_users(chunk):
+        name = f"{plan.prefix}{index}"
+        joined = _timestamp(rng, plan.start, plan.end)
+        yield plan.first_user_id + index, name, f"{name}@example.com", plan.password, joined
+
+
+def write_users(chunk):
+    plan = _plan
+    with transaction.atomic(), connection.cursor() as cursor:
+        _fast_commit(cursor)
+        count = copy_rows(
+            cursor, User, ["id", "username", "email", "password", "date_joined"], _user_rows(plan, chunk)
+        )
+    return {"users": count}
+
+
+def _follow_rows(plan, rng, chunk):
+    total = plan.rank_weights[-1]
+    for index in plan.chunk_users(chunk):
+        wanted = _heavy(rng, plan.follows_per_user, cap=plan.users - 1)
+        followed = _distinct(
+            rng, wanted, lambda: plan.by_rank[min(bisect(plan.rank_weights, rng.random() * total), plan.users - 1)]
+        )
+        followed.discard(index)
+        for other in sorted(followed):
+            yield plan.first_user_id + index, plan.first_user_id + other, _timestamp(rng, plan.start, plan.end)
+
+
+def write_chunk(chunk):
+    """Follows, posts and engagement of one chunk of users, in one transaction."""
+    plan = _plan
+    rng = random.Random(f"{plan.seed}:activity:{chunk}")
+    posts, likes, comments, shares = [], [], [], []
+    for index in plan.chunk_users(chunk):
+        for n in range(plan.post_counts[index]):
+            post_id = plan.first_post_id + plan.post_offsets[index] + n
+            created = rng.uniform(plan.start, plan.end)
+            likers = _distinct(rng, _heavy(rng, plan.likes_per_post, cap=plan.users), lambda: rng.randrange(plan.users))
+            for user in sorted(likers):
+                likes.append((plan.first_user_id + user, post_id, _timestamp(rng, created, plan.end)))
+            post_comments = _heavy(rng, plan.comments_per_post)
+            for _ in range(post_comments):
+                content = " ".join(rng.choices(plan.vocabulary, k=rng.randint(3, 15)))
+                comments.append((
+                    plan.first_user_id + rng.randrange(plan.users), post_id, content,
+                    _timestamp(rng, created, plan.end),
+                ))
+            post_shares = _heavy(rng, plan.shares_per_post)
+            for _ in range(post_shares):
+                message = " ".join(rng.choices(plan.vocabulary, k=rng.randint(2, 8))) if rng.random() < 0.3 else None
+                shares.append((
+                    plan.first_user_id + rng.randrange(plan.users), post_id, message,
+                    _timestamp(rng, created, plan.end),
+                ))
+            content = " ".join(rng.choices(plan.vocabulary, k=rng.randint(8, 40)))
+            created_at = datetime.fromtimestamp(created, timezone.utc)
+            posts.append((
+                post_id, plan.first_user_id + index, content, created_at, created_at,
+                len(likers), post_comments, post_shares,
+            ))
+
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        _fast_commit(cursor)
+        counts["follows"] = copy_rows(
+            cursor, Follow, ["follower_id", "following_id", "created_at"], _follow_rows(plan, rng, chunk)
+        )
+        counts["posts"] = copy_rows(
+            cursor, Post,
+            ["id", "author_id", "content", "created_at", "updated_at", "likes_count", "comments_count", "shares_count"],
+            posts,
+        )
+        counts["likes"] = copy_rows(cursor, Like, ["user_id", "post_id", "created_at"], likes)
+        counts["comments"] = copy_rows(cursor, Comment, ["user_id", "post_id", "content", "created_at"], comments)
+        counts["shares"] = copy_rows(cursor, Share, ["user_id", "post_id", "message", "created_at"], shares)
+    return counts
+
+
+def _run(phase, plan, workers, progress):
+    totals = {}
+    if workers == 1:
+        results = map(phase, range(plan.chunks))
+        pool = None
+    else:
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        pool = multiprocessing.get_context("fork").Pool(workers)
+        results = pool.imap_unordered(phase, range(plan.chunks))
+    try:
+        for counts in results:
+            for table, count in counts.items():
+                totals[table] = totals.get(table, 0) + count
+            if progress:
+                progress(totals)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return totals
+
+
+def generate(seed=0, prefix="synthetic-", users=100_000, follows_per_user=40, posts_per_user=10,
+             likes_per_post=4, comments_per_post=1, shares_per_post=0.2, follow_exponent=1.0,
+             password=None, until=None, days=365, chunk_size=2000, workers=1, progress=None):
+    """
+    Generate a social graph; returns the number of rows written per table.
+    The users cannot log in unless a ``password`` is given. ``progress(totals)``
+    is called after every chunk.
+    """
+    global _plan
+    if until is None:
+        until = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    plan = Plan(
+        seed, prefix, users, follows_per_user, posts_per_user, likes_per_post, comments_per_post,
+        shares_per_post, follow_exponent, password, until, days, chunk_size,
+    )
+    plan.first_user_id = reserve_ids(User, plan.users)
+    plan.first_post_id = reserve_ids(Post, plan.posts)
+    _plan = plan
+    try:
+        users_written = _run(write_users, plan, workers, progress)
+
+        def report(totals):
+            if progress:
+                progress({**users_written, **totals})
+
+        totals = {**users_written, **_run(write_chunk, plan, workers, report)}
+    finally:
+        _plan = None
+
+    with connection.cursor() as cursor:
+        for model in (User, Follow, Post, Like, Comment, Share):
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+    return totals
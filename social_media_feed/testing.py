@@ -0,0 +1,44 @@
+"""
+Helpers shared by the test modules of every app.
+"""
+from unittest import mock
+
+from django.test import RequestFactory
+from django_redis import get_redis_connection
+
+from .execution import execute_sync
+from .schema import schema
+
+PASSWORD = "correct-horse-battery"
+
+
+def clear_redis(*prefixes):
+    """Delete every Redis key that starts with one of ``prefixes``."""
+    redis = get_redis_connection("default")
+    for prefix in prefixes:
+        keys = redis.keys(f"{prefix}*")
+        if keys:
+            redis.delete(*keys)
+
+
+class GraphQLTestMixin:
+    """Runs schema operations as a given user, for ``TestCase`` subclasses."""
+
+    def mute_celery(self):
+        """Keep tasks off the broker for the rest of the test; returns the ``apply_async`` mock."""
+        patcher = mock.patch("celery.app.task.Task.apply_async")
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def execute_as(self, user, document, **kwargs):
+        """Execute ``document`` as ``user`` and run its on-commit callbacks; returns the result."""
+        request = RequestFactory().post("/graphql/")
+        request.user = user
+        with self.captureOnCommitCallbacks(execute=True):
+            return execute_sync(schema, document, context_value=request, **kwargs)
+
+    def run_as(self, user, document, **kwargs):
+        """Like ``execute_as``, but the operation must succeed; returns its data."""
+        result = self.execute_as(user, document, **kwargs)
+        self.assertIsNone(result.errors)
+        return result.data
@@ -0,0 +1,668 @@
+"""
+Query budget and EXPLAIN regression harness for the GraphQL schema.
+
+Every root query and mutation in ``social_media_feed.schema`` runs against a
+seeded dataset and must stay within its SQL query budget. Each SELECT it
+issues is also EXPLAINed with sequential scans disabled: if Postgres still
+has to seq-scan one of the large tables, the query is missing an index.
+
+New root fields must be added to ``OPERATIONS`` (the coverage test fails
+otherwise), which forces every new resolver to declare its query budget.
+"""
+import asyncio
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from graphql_jwt.shortcuts import get_token
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from graphql import parse
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from interactions.models import Comment, Like, Share
+from posts.models import Post
+from posts.tasks import cleanup_old_posts, reconcile_post_counters
+from posts.trending import TRENDING_KEY
+from users.models import Follow, User
+
+from . import synthetic
+from .asgi import application
+from .complexity import analyze
+from .documents import PERSISTED_QUERY_KEY, documents, query_hash
+from .execution import execute_sync
+from .response_cache import VERSION_KEY, post_entities
+from .schema import schema
+from .subscriptions import Broker, close_broker, get_broker
+from .testing import PASSWORD, GraphQLTestMixin, clear_redis
+
+
+# Tables large enough in production that a sequential scan is a regression.
+WATCHED_TABLES = {
+    Post._meta.db_table,
+    Comment._meta.db_table,
+    Like._meta.db_table,
+    Follow._meta.db_table,
+}
+
+# Redis key prefixes written by the code under test; cleared between tests.
+REDIS_PREFIXES = ("timeline:", "notifications:", "trending:", "suggestions:", "jwt-user")
+
+# name -> (document, viewer, max queries). Documents are formatted with the
+# ids of the seeded fixtures; viewer is "viewer", "author" or None.
+OPERATIONS = {
+    # ---------------------- Queries ----------------------
+    "posts": (
+        "{ posts(first: 20) { edges { node { id content likesCount author { username } } } } }",
+        None, 2,
+    ),
+    "post": ("{ post(id: %(post)d) { id content author { username } } }", None, 2),
+    "feed": (
+        "{ feed(first: 20) { edges { node { id author { username } } } pageInfo { endCursor } } }",
+        "viewer", 2,
+    ),
+    "trendingPosts": (
+        "{ trendingPosts(first: 20) { edges { node { id author { username } } } pageInfo { endCursor } } }",
+        None, 1,
+    ),
+    "searchPosts": (
+        '{ searchPosts(query: "post", first: 20) { edges { node { id author { username } } } } }',
+        None, 2,
+    ),
+    "likes": (
+        "{ likes(postId: %(post)d, first: 20) { edges { node { id user { username } post { id } } } } }",
+        None, 3,
+    ),
+    "comments": (
+        "{ comments(postId: %(post)d, first: 20) { edges { node { id content user { username } } } } }",
+        None, 2,
+    ),
+    "shares": (
+        "{ shares(first: 20) { edges { node { id user { username } post { id } } } } }",
+        None, 3,
+    ),
+    "users": ("{ users(first: 20) { edges { node { id username } } } }", None, 1),
+    "me": ("{ me { id username } }", "viewer", 0),
+    "followers": (
+        "{ followers(userId: %(author)d, first: 20) { edges { viewerFollows followsViewer node { id username } } } }",
+        "viewer", 2,
+    ),
+    "following": (
+        "{ following(userId: %(viewer)d, first: 20) { edges { viewerFollows followsViewer node { id username } } } }",
+        "viewer", 2,
+    ),
+    "suggestedUsers": ("{ suggestedUsers(first: 10) { id username } }", "viewer", 3),
+    # ---------------------- Mutations ----------------------
+    "likePost": ("mutation { likePost(postId: %(unliked_post)d) { like { id } } }", "viewer", 1),
+    "likePosts": (
+        "mutation { likePosts(postIds: [%(unliked_post)d, %(liked_post)d]) { results { postId success error } } }",
+        "viewer", 3,
+    ),
+    "unlikePost": ("mutation { unlikePost(postId: %(liked_post)d) { success } }", "viewer", 3),
+    "addComment": (
+        'mutation { addComment(postId: %(post)d, content: "nice") { comment { id } } }',
+        "viewer", 1,
+    ),
+    "deleteComment": ("mutation { deleteComment(commentId: %(comment)d) { success } }", "viewer", 3),
+    "sharePost": ("mutation { sharePost(postId: %(post)d) { share { id } } }", "viewer", 1),
+    "createPost": ('mutation { createPost(content: "hello") { post { id } } }', "author", 1),
+    "createPosts": (
+        'mutation { createPosts(posts: [{content: "a"}, {content: "b"}]) { results { post { id } error } } }',
+        "author", 1,
+    ),
+    "updatePost": (
+        'mutation { updatePost(id: %(post)d, content: "edited") { post { id } } }',
+        "author", 2,
+    ),
+    "deletePost": ("mutation { deletePost(id: %(post)d) { success } }", "author", 5),
+    "createUser": (
+        'mutation { createUser(username: "new", email: "new@example.com", password: "pw") { user { id } } }',
+        None, 1,
+    ),
+    "updateProfile": ('mutation { updateProfile(bio: "hi") { user { id bio } } }', "viewer", 1),
+    "followUser": ("mutation { followUser(userId: %(stranger)d) { follow { id } } }", "viewer", 1),
+    "followUsers": (
+        "mutation { followUsers(userIds: [%(stranger)d, %(author)d]) { results { userId success error } } }",
+        "viewer", 2,
+    ),
+    "unfollowUser": ("mutation { unfollowUser(userId: %(author)d) { success } }", "viewer", 2),
+    "login": (
+        'mutation { login(username: "viewer", password: "%(password)s") { token } }',
+        None, 2,
+    ),
+    "tokenAuth": (
+        'mutation { tokenAuth(username: "viewer", password: "%(password)s") { token } }',
+        None, 1,
+    ),
+    "verifyToken": ('mutation { verifyToken(token: "%(token)s") { payload } }', None, 0),
+    "refreshToken": ('mutation { refreshToken(token: "%(token)s") { token } }', None, 2),
+}
+
+
+def seq_scans(plan, tables=WATCHED_TABLES):
+    """Names of watched tables read by a Seq Scan anywhere in ``plan``."""
+    found = set()
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in tables:
+        found.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found |= seq_scans(child, tables)
+    return found
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class SchemaQueryBudgetTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.stranger = User.objects.create_user("stranger", "stranger@example.com", PASSWORD)
+        others = User.objects.bulk_create(
+            User(username=f"user{i}", email=f"user{i}@example.com") for i in range(40)
+        )
+
+        Follow.objects.create(follower=cls.viewer, following=cls.author)
+        Follow.objects.bulk_create(
+            Follow(follower=user, following=cls.author) for user in others
+        )
+        Follow.objects.bulk_create(
+            Follow(follower=cls.viewer, following=user) for user in others[:20]
+        )
+
+        posts = Post.objects.bulk_create(
+            Post(author=(cls.author if i % 2 else others[i % 40]), content=f"post {i}")
+            for i in range(200)
+        )
+        cls.post = posts[1]
+        cls.liked_post, cls.unliked_post = posts[3], posts[5]
+        cls.trending = {post.id: i % 7 for i, post in enumerate(posts[:50])}
+
+        Like.objects.bulk_create(
+            Like(user=user, post=post) for user in others[:10] for post in posts[:50]
+        )
+        Like.objects.create(user=cls.viewer, post=cls.liked_post)
+        Comment.objects.bulk_create(
+            Comment(user=user, post=post, content="hi") for user in others[:10] for post in posts[:50]
+        )
+        cls.comment = Comment.objects.create(user=cls.viewer, post=cls.post, content="mine")
+        Share.objects.bulk_create(
+            Share(user=user, post=post) for user in others[:10] for post in posts[:50]
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        clear_redis(*REDIS_PREFIXES)
+        get_redis_connection("default").zadd(TRENDING_KEY, self.trending)
+
+        # Keep Celery off the broker; task bodies are not part of a resolver's budget.
+        self.mute_celery()
+
+    def ids(self):
+        return {
+            "viewer": self.viewer.id,
+            "author": self.author.id,
+            "stranger": self.stranger.id,
+            "post": self.post.id,
+            "liked_post": self.liked_post.id,
+            "unliked_post": self.unliked_post.id,
+            "comment": self.comment.id,
+            "password": PASSWORD,
+            "token": get_token(self.viewer),
+        }
+
+    def execute(self, name):
+        document, viewer, _ = OPERATIONS[name]
+        request = RequestFactory().post("/graphql/")
+        request.user = getattr(self, viewer) if viewer else AnonymousUser()
+
+        document = document % self.ids()
+        # Roll every operation back so each one sees the seeded dataset.
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                result = execute_sync(schema, document, context_value=request)
+            transaction.set_rollback(True)
+        self.assertIsNone(result.errors, f"{name}: {result.errors}")
+        return queries.captured_queries
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def test_every_root_field_has_a_budget(self):
+        graphql_schema = schema.graphql_schema
+        root_fields = set(graphql_schema.query_type.fields) | set(graphql_schema.mutation_type.fields)
+        self.assertEqual(root_fields - set(OPERATIONS), set())
+
+    def test_query_budgets(self):
+        for name, (_, _, budget) in OPERATIONS.items():
+            with self.subTest(name):
+                with self.captureOnCommitCallbacks():
+                    queries = self.execute(name)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    f"{name} ran {len(queries)} queries:\n" + "\n".join(q["sql"] for q in queries),
+                )
+
+    def test_no_seq_scans_on_large_tables(self):
+        for name in OPERATIONS:
+            with self.subTest(name):
+                for query in self.execute(name):
+                    sql = query["sql"]
+                    if not sql.lstrip().upper().startswith("SELECT"):
+                        continue
+                    self.assertEqual(seq_scans(self.explain(sql)), set(), f"{name}: {sql}")
+
+
+class PersistedQueryTests(TestCase):
+    query = "{ users(first: 1) { edges { node { username } } } }"
+
+    def setUp(self):
+        documents.clear()
+        cache.delete(PERSISTED_QUERY_KEY.format(sha256=query_hash(self.query)))
+
+    def post(self, body):
+        return self.client.post("/graphql/", body, content_type="application/json")
+
+    def extensions(self, sha256=None):
+        return {"persistedQuery": {"version": 1, "sha256Hash": sha256 or query_hash(self.query)}}
+
+    def test_unknown_hash_asks_for_the_query(self):
+        response = self.post({"extensions": self.extensions()})
+        self.assertEqual(
+            response.json()["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND"
+        )
+
+    def test_registered_hash_is_served_without_query_text(self):
+        self.assertIn("data", self.post({"query": self.query, "extensions": self.extensions()}).json())
+
+        documents.clear()
+        response = self.post({"extensions": self.extensions()})
+        self.assertEqual(response.json()["data"], {"users": {"edges": []}})
+
+    def test_mismatched_hash_is_rejected(self):
+        response = self.post({"query": self.query, "extensions": self.extensions("0" * 64)})
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "INVALID_SHA256_HASH")
+        self.assertIsNone(cache.get(PERSISTED_QUERY_KEY.format(sha256="0" * 64)))
+
+    def test_documents_are_parsed_once(self):
+        with mock.patch("social_media_feed.documents.parse", wraps=parse) as parse_mock:
+            self.post({"query": self.query})
+            self.post({"query": self.query})
+        self.assertEqual(parse_mock.call_count, 1)
+
+
+class ResponseCacheTests(GraphQLTestMixin, TestCase):
+    query = "{ post(id: %d) { content likesCount } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.post = Post.objects.create(author=cls.author, content="cached")
+
+    def setUp(self):
+        cache.delete_many([VERSION_KEY.format(entity=e) for e in post_entities(self.post.id)])
+        self.mute_celery()
+
+    def fetch(self, query=None):
+        response = self.client.post(
+            "/graphql/", {"query": (query or self.query) % self.post.id}, content_type="application/json"
+        )
+        return response.json()["data"]["post"]
+
+    def test_anonymous_reads_are_served_from_cache(self):
+        self.fetch()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.fetch(), {"content": "cached", "likesCount": 0})
+
+    def test_mutations_invalidate_cached_responses(self):
+        self.fetch()
+        self.run_as(self.author, "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+        self.assertEqual(self.fetch()["likesCount"], 1)
+
+    def test_profile_changes_invalidate_the_authors_posts(self):
+        query = "{ post(id: %d) { author { bio } } }"
+        self.fetch(query)
+        self.run_as(self.author, 'mutation { updateProfile(bio: "new bio") { user { id } } }')
+        self.assertEqual(self.fetch(query)["author"]["bio"], "new bio")
+
+    def test_background_writes_invalidate_cached_responses(self):
+        self.fetch()
+        Like.objects.create(user=self.author, post=self.post)
+        self.assertEqual(self.fetch()["likesCount"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            reconcile_post_counters()
+        self.assertEqual(self.fetch()["likesCount"], 1)
+
+        Post.objects.filter(pk=self.post.pk).update(created_at=datetime.now(timezone.utc) - timedelta(days=730))
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with self.captureOnCommitCallbacks(execute=True):
+                cleanup_old_posts()
+        self.assertIsNone(self.fetch())
+
+    def test_authenticated_reads_bypass_the_cache(self):
+        self.fetch()
+        self.client.force_login(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            self.fetch()
+        self.assertTrue(any("posts_post" in q["sql"] for q in queries.captured_queries))
+
+
+class QueryComplexityTests(TestCase):
+    def post(self, query):
+        return self.client.post("/graphql/", {"query": query}, content_type="application/json")
+
+    def test_cost_is_reported_in_extensions(self):
+        # users + 10 * (edges + node + username)
+        response = self.post("{ users(first: 10) { edges { node { username } } } }")
+        self.assertEqual(
+            response.json()["extensions"]["cost"],
+            {"requested": 31, "maximum": settings.GRAPHQL_MAX_QUERY_COST, "depth": 4},
+        )
+
+    def test_analysis_is_cached_with_the_document(self):
+        documents.clear()
+        query = "{ users(first: 5) { edges { node { username } } } }"
+        with mock.patch("social_media_feed.views.analyze", wraps=analyze) as analyze_mock:
+            first = self.post(query).json()["extensions"]
+            self.assertEqual(self.post(query).json()["extensions"], first)
+        self.assertEqual(analyze_mock.call_count, 1)
+
+    @override_settings(GRAPHQL_MAX_QUERY_COST=100)
+    def test_costly_queries_are_rejected(self):
+        documents.clear()
+        with self.assertNumQueries(0):
+            response = self.post(
+                "{ posts(first: 100) { edges { node { content author { username } } } } }"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "QUERY_TOO_COMPLEX")
+
+    @override_settings(GRAPHQL_MAX_QUERY_DEPTH=3)
+    def test_deep_queries_are_rejected(self):
+        documents.clear()
+        response = self.post("{ users { edges { node { username } } } }")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "QUERY_TOO_DEEP")
+
+
+class WebSocketClient:
+    """Drives the ASGI application as a ``graphql-transport-ws`` client."""
+
+    def __init__(self, path="/graphql/"):
+        self.scope = {"type": "websocket", "path": path, "subprotocols": ["graphql-transport-ws"]}
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+
+    async def connect(self, authorization=None):
+        self.task = asyncio.create_task(application(self.scope, self.incoming.get, self.outgoing.put))
+        await self.incoming.put({"type": "websocket.connect"})
+        accept = await self.event()
+        assert accept["type"] == "websocket.accept", accept
+        await self.send({"type": "connection_init", "payload": {"authorization": authorization}})
+        return await self.receive()
+
+    async def event(self):
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def send(self, message):
+        await self.incoming.put({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def receive(self):
+        event = await self.event()
+        return json.loads(event["text"]) if event["type"] == "websocket.send" else event
+
+    async def subscribe(self, id, query, **variables):
+        await self.send({"id": id, "type": "subscribe", "payload": {"query": query, "variables": variables}})
+
+    async def disconnect(self):
+        await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+class SubscriptionTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        cls.stranger = User.objects.create_user("stranger", "stranger@example.com", PASSWORD)
+        Follow.objects.create(follower=cls.viewer, following=cls.author)
+        cls.post = Post.objects.create(author=cls.author, content="watched")
+        cls.other_post = Post.objects.create(author=cls.author, content="unwatched")
+
+    def setUp(self):
+        self.mute_celery()
+
+    def run_async(self, scenario):
+        async def run():
+            try:
+                await scenario()
+            finally:
+                await close_broker()
+
+        async_to_sync(run)()
+
+    async def arun_as(self, user, document):
+        await sync_to_async(self.run_as)(user, document)
+
+    async def subscribed(self, *channels):
+        """Wait until this process is subscribed to ``channels`` in Redis."""
+        redis = get_redis_connection("default")
+        for _ in range(500):
+            if all(count for _, count in redis.pubsub_numsub(*channels)):
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"never subscribed to {channels}")
+
+    def test_comments_and_engagement_are_pushed_for_the_watched_post(self):
+        async def scenario():
+            client = WebSocketClient()
+            self.assertEqual(await client.connect(), {"type": "connection_ack"})
+            await client.subscribe("comments", "subscription($postId: Int!) { newComment(postId: $postId) { content user { username } } }", postId=self.post.id)
+            await client.subscribe("engagement", "subscription($postId: Int!) { postEngagementChanged(postId: $postId) { postId likes comments shares } }", postId=self.post.id)
+            await self.subscribed(f"events:comments:{self.post.id}", f"events:engagement:{self.post.id}")
+
+            await self.arun_as(self.stranger, 'mutation { addComment(postId: %d, content: "elsewhere") { comment { id } } }' % self.other_post.id)
+            await self.arun_as(self.stranger, 'mutation { addComment(postId: %d, content: "first!") { comment { id } } }' % self.post.id)
+
+            messages = {}
+            for _ in range(2):
+                message = await client.receive()
+                messages[message["id"]] = message
+            self.assertEqual(messages["comments"]["type"], "next")
+            self.assertEqual(
+                messages["comments"]["payload"]["data"],
+                {"newComment": {"content": "first!", "user": {"username": "stranger"}}},
+            )
+            self.assertEqual(
+                messages["engagement"]["payload"]["data"]["postEngagementChanged"],
+                {"postId": self.post.id, "likes": 0, "comments": 1, "shares": 0},
+            )
+
+            await client.send({"id": "comments", "type": "complete"})
+            await self.arun_as(self.stranger, "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+            message = await client.receive()
+            self.assertEqual(message["id"], "engagement")
+            self.assertEqual(message["payload"]["data"]["postEngagementChanged"]["likes"], 1)
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_new_feed_post_only_pushes_followed_authors(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.connect(f"JWT {get_token(self.viewer)}")
+            await client.subscribe("feed", "subscription { newFeedPost { content author { username } } }")
+            await self.subscribed(f"events:posts:{self.author.id}")
+
+            await self.arun_as(self.stranger, 'mutation { createPost(content: "not followed") { post { id } } }')
+            await self.arun_as(self.author, 'mutation { createPost(content: "followed") { post { id } } }')
+            message = await client.receive()
+            self.assertEqual(
+                message["payload"]["data"]["newFeedPost"],
+                {"content": "followed", "author": {"username": "author"}},
+            )
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_delivery_resumes_after_the_pubsub_connection_drops(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.connect()
+            await client.subscribe("engagement", "subscription($postId: Int!) { postEngagementChanged(postId: $postId) { likes } }", postId=self.post.id)
+            channel = f"events:engagement:{self.post.id}"
+            await self.subscribed(channel)
+
+            broker = get_broker()
+            pubsub = broker._pubsub
+            with self.assertLogs("social_media_feed.subscriptions", "WARNING"):
+                get_redis_connection("default").client_kill_filter(_type="pubsub")
+                # Wait for the reader to swap in a new connection, not just
+                # for redis-py's own reconnect of the one being replaced.
+                for _ in range(500):
+                    if broker._pubsub is not pubsub:
+                        break
+                    await asyncio.sleep(0.01)
+                await self.subscribed(channel)
+            await self.arun_as(self.stranger, "mutation { likePost(postId: %d) { like { id } } }" % self.post.id)
+            message = await client.receive()
+            self.assertEqual(message["type"], "next")
+            self.assertEqual(message["payload"]["data"]["postEngagementChanged"], {"likes": 1})
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_subscriptions_complete_when_redis_stays_down(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.connect()
+            await client.subscribe("engagement", "subscription($postId: Int!) { postEngagementChanged(postId: $postId) { likes } }", postId=self.post.id)
+            await self.subscribed(f"events:engagement:{self.post.id}")
+
+            with (
+                mock.patch.object(Broker, "_reconnect", side_effect=RedisConnectionError),
+                mock.patch("social_media_feed.subscriptions.RECONNECT_DELAY", 0),
+                self.assertLogs("social_media_feed.subscriptions", "WARNING") as logs,
+            ):
+                get_redis_connection("default").client_kill_filter(_type="pubsub")
+                self.assertEqual(await client.receive(), {"id": "engagement", "type": "complete"})
+            self.assertIn("ending all subscriptions", logs.output[-1])
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_new_feed_post_requires_login(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.connect()
+            await client.subscribe("feed", "subscription { newFeedPost { id } }")
+            message = await client.receive()
+            self.assertEqual(message["type"], "error")
+            self.assertEqual(message["payload"][0]["message"], "You must be logged in")
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_protocol_violations_close_the_socket(self):
+        async def scenario():
+            client = WebSocketClient()
+            client.task = asyncio.create_task(application(client.scope, client.incoming.get, client.outgoing.put))
+            await client.incoming.put({"type": "websocket.connect"})
+            await client.event()
+            await client.subscribe("early", "subscription { newFeedPost { id } }")
+            self.assertEqual((await client.event())["code"], 4401)
+            await client.disconnect()
+
+            client = WebSocketClient()
+            await client.connect()
+            await client.send({"type": "connection_init"})
+            self.assertEqual((await client.event())["code"], 4429)
+            await client.disconnect()
+
+            client = WebSocketClient()
+            self.assertEqual((await client.connect("JWT not-a-token"))["code"], 4403)
+            await client.disconnect()
+
+            client = WebSocketClient()
+            await client.connect()
+            await client.subscribe("query", "{ me { id } }")
+            message = await client.receive()
+            self.assertEqual(message["type"], "error")
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_subscriptions_are_rejected_over_http(self):
+        response = self.client.post(
+            "/graphql/", {"query": "subscription { newFeedPost { id } }"}, content_type="application/json"
+        )
+        self.assertIn("WebSocket", response.json()["errors"][0]["message"])
+
+
+class SyntheticGraphTests(TestCase):
+    SIZES = dict(
+        seed=7, users=60, follows_per_user=5, posts_per_user=3, likes_per_post=3, comments_per_post=1,
+        shares_per_post=1, until=datetime(2025, 1, 1, tzinfo=timezone.utc), chunk_size=25,
+    )
+
+    def snapshot(self, prefix):
+        users = User.objects.filter(username__startswith=prefix)
+        first_user = users.order_by("pk").values_list("pk", flat=True)[0]
+        posts = Post.objects.filter(author__in=users)
+        first_post = posts.order_by("pk").values_list("pk", flat=True)[0]
+        return {
+            "users": sorted((u - first_user, name[len(prefix):], joined) for u, name, joined in
+                            users.values_list("pk", "username", "date_joined")),
+            "follows": sorted((a - first_user, b - first_user) for a, b in
+                              Follow.objects.filter(follower__in=users).values_list("follower", "following")),
+            "posts": sorted((p - first_post, a - first_user, *rest) for p, a, *rest in posts.values_list(
+                "pk", "author", "content", "created_at", "likes_count", "comments_count", "shares_count")),
+            "likes": sorted((u - first_user, p - first_post) for u, p in
+                            Like.objects.filter(post__in=posts).values_list("user", "post")),
+        }
+
+    def test_counters_match_rows_and_seeds_reproduce(self):
+        totals = synthetic.generate(prefix="syn-a-", **self.SIZES)
+        users = User.objects.filter(username__startswith="syn-a-")
+        posts = Post.objects.filter(author__in=users)
+        self.assertEqual(totals["users"], users.count())
+        self.assertEqual(totals["posts"], posts.count())
+        self.assertEqual(totals["follows"], Follow.objects.filter(follower__in=users).count())
+        self.assertGreater(totals["likes"], 0)
+        counted = posts.annotate(
+            like_rows=Count("likes", distinct=True),
+            comment_rows=Count("comments", distinct=True),
+            share_rows=Count("shares", distinct=True),
+        )
+        for post in counted:
+            self.assertEqual(
+                (post.likes_count, post.comments_count, post.shares_count),
+                (post.like_rows, post.comment_rows, post.share_rows),
+            )
+        self.assertFalse(users[0].has_usable_password())
+
+        synthetic.generate(prefix="syn-b-", password=PASSWORD, **self.SIZES)
+        self.assertEqual(self.snapshot("syn-a-"), self.snapshot("syn-b-"))
+        self.assertTrue(User.objects.get(username="syn-b-0").check_password(PASSWORD))
+
+    def test_command_refuses_an_existing_prefix(self):
+        User.objects.create_user("syn-c-0", "syn@example.com", PASSWORD)
+        with self.assertRaisesMessage(CommandError, "already exist"):
+            call_command("generate_social_graph", prefix="syn-c-", users=10, stdout=io.StringIO())
@@ -1,12 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from .schema import schema
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from users.views import LoginView, CustomLoginView
 from django.http import JsonResponse
-from graphene_file_upload.django import FileUploadGraphQLView
+from .views import GraphQLView
+
 
 def health_check(request):
     return JsonResponse({"status": "ok"})
@@ -21,8 +21,8 @@ urlpatterns = [
     path("", home, name="home"),    # root endpoint
     path("admin/", admin.site.urls),
     
-    #  # --- GraphQL (with file upload support) ---
-    path("graphql/", csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True, schema=schema))),
+    #  # --- GraphQL (with file upload support and persisted queries) ---
+    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
     
     # --- Auth routes (REST/JWT) ---
     path("api/login/", LoginView.as_view(), name="login"),
@@ -0,0 +1,249 @@
+from collections import namedtuple
+from functools import partial
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import connection, transaction
+from django.http import HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    OperationType,
+    execute,
+    get_operation_ast,
+    specified_rules,
+    validate_schema,
+)
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+
+from . import response_cache
+from .complexity import QueryComplexityRule, analyze
+from .documents import PersistedQueryError, operation_analysis, parse_and_validate, resolve_query
+from .execution import execute_query, is_mutation
+
+
+# A validated operation that still has to be executed.
+PreparedOperation = namedtuple(
+    "PreparedOperation", ["document", "operation", "extensions", "cache_key", "options"]
+)
+
+
+def authenticate_request(request):
+    """
+    Resolve ``request.user`` (session, then JWT) before execution.
+
+    graphql_jwt's middleware would otherwise load the user inside the first
+    root resolver, which for queries runs on the event loop, where the ORM
+    may not be called synchronously.
+    """
+    user = request.user
+    if user.is_anonymous and get_http_authorization(request) is not None:
+        try:
+            user = authenticate(request=request) or user
+        except JSONWebTokenError as error:
+            # The middleware reports it on each field; the backend re-raises
+            # it from here instead of looking the token up again.
+            request._jwt_auth_error = error
+            return
+        request.user = user
+        # Tells JSONWebTokenBackend not to look the token up again.
+        request._jwt_token_auth = True
+
+
+class GraphQLView(FileUploadGraphQLView):
+    """
+    GraphQL endpoint with automatic persisted queries, a per-process cache of
+    parsed and validated documents (see ``documents.py``) and a versioned
+    response cache for public reads (see ``response_cache.py``).
+
+    Operations are rejected before execution if they are too deep or too
+    costly (see ``complexity.py``); the computed cost of every executed
+    operation is reported under ``extensions.cost``.
+    """
+
+    validation_rules = (*specified_rules, QueryComplexityRule)
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.build_response(request, execution_result, id, show_graphiql)
+
+    def build_response(self, request, execution_result, id, show_graphiql=False):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def get_extensions(self, document, operation_ast, sha256):
+        if operation_ast is None:
+            return None
+        cost, depth = operation_analysis(
+            sha256, document, operation_ast, partial(analyze, self.schema.graphql_schema)
+        )
+        return {
+            "cost": {
+                "requested": cost,
+                "maximum": settings.GRAPHQL_MAX_QUERY_COST,
+                "depth": depth,
+            }
+        }
+
+    def prepare_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        """
+        Everything up to execution: APQ, parse and validate, the complexity
+        check and the response cache. Returns a ``PreparedOperation``, or the
+        final result (possibly None) when there is nothing left to execute.
+        """
+        request_extensions = request.GET.get("extensions") or data.get("extensions")
+        try:
+            query, sha256 = resolve_query(query, request_extensions)
+        except PersistedQueryError as e:
+            return ExecutionResult(errors=[e.error])
+
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            document, validation_errors = parse_and_validate(
+                schema, query, sha256, self.validation_rules
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        if operation_ast is not None and operation_ast.operation == OperationType.SUBSCRIPTION:
+            return ExecutionResult(
+                errors=[GraphQLError("Subscriptions are only served over WebSocket.")]
+            )
+
+        extensions = self.get_extensions(document, operation_ast, sha256)
+
+        authenticate_request(request)
+        cache_key = response_cache.cache_key(request, operation_ast, sha256, variables, operation_name)
+        if cache_key:
+            cached = response_cache.lookup(cache_key)
+            if cached is not None:
+                return ExecutionResult(data=cached, extensions=extensions)
+
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return PreparedOperation(document, operation_ast, extensions, cache_key, execute_options)
+
+    def execute_mutation(self, request, prepared):
+        schema = self.schema.graphql_schema
+        try:
+            if (
+                graphene_settings.ATOMIC_MUTATIONS is True
+                or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+            ):
+                with transaction.atomic():
+                    result = execute(schema, prepared.document, **prepared.options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+            else:
+                result = execute(schema, prepared.document, **prepared.options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        result.extensions = prepared.extensions
+        return result
+
+    async def execute_query(self, prepared):
+        try:
+            result = await execute_query(
+                self.schema.graphql_schema, prepared.document, **prepared.options
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        if prepared.cache_key and not result.errors:
+            await sync_to_async(response_cache.store)(prepared.cache_key, result.data)
+        result.extensions = prepared.extensions
+        return result
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        prepared = self.prepare_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if not isinstance(prepared, PreparedOperation):
+            return prepared
+        if is_mutation(prepared.operation):
+            return self.execute_mutation(request, prepared)
+        return async_to_sync(self.execute_query)(prepared)
@@ -0,0 +1,185 @@
+"""
+GraphQL subscriptions over WebSocket.
+
+Speaks the ``graphql-transport-ws`` protocol (as used by the ``graphql-ws``
+client and Apollo Client). A socket authenticates once, with the JWT sent
+as ``authorization`` in the ``connection_init`` payload. After that, each
+``subscribe`` message runs as its own task until the client sends
+``complete`` or disconnects. Queries and mutations stay on the HTTP
+endpoint.
+
+Events reach the subscriptions through the per-process broker in
+``subscriptions.py``, so one node holds a single Redis connection for all
+of its sockets.
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast, subscribe
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+
+from users.auth import get_user_by_token
+
+from .documents import parse_and_validate, query_hash
+from .schema import schema
+from .views import GraphQLView
+
+PROTOCOL = "graphql-transport-ws"
+
+# Seconds a client has to send connection_init before the socket is closed.
+CONNECTION_INIT_TIMEOUT = 10
+
+
+async def authenticate(authorization):
+    """The user for an ``authorization`` value (``"JWT <token>"`` or a bare token)."""
+    if not authorization:
+        return AnonymousUser()
+    prefix, _, token = authorization.partition(" ")
+    if not token:
+        token = prefix
+    elif prefix.lower() != jwt_settings.JWT_AUTH_HEADER_PREFIX.lower():
+        raise JSONWebTokenError("Invalid authorization prefix")
+    user = await sync_to_async(get_user_by_token)(token)
+    if user is None:
+        raise JSONWebTokenError("User not found")
+    return user
+
+
+class Connection:
+    """One WebSocket and the subscriptions running on it."""
+
+    def __init__(self, send):
+        self._send = send
+        self.user = None
+        self.initialised = False
+        self.operations = {}
+
+    async def send(self, message):
+        await self._send({"type": "websocket.send", "text": json.dumps(message)})
+
+    async def close(self, code, reason):
+        await self._send({"type": "websocket.close", "code": code, "reason": reason})
+        return False
+
+    async def serve(self, scope, receive):
+        event = await receive()
+        if event["type"] != "websocket.connect":
+            return
+        if PROTOCOL not in scope.get("subprotocols", ()):
+            await self._send({"type": "websocket.close", "code": 1002})
+            return
+        await self._send({"type": "websocket.accept", "subprotocol": PROTOCOL})
+
+        init_timeout = asyncio.create_task(self._init_timeout())
+        try:
+            while True:
+                event = await receive()
+                if event["type"] == "websocket.disconnect":
+                    break
+                if event["type"] == "websocket.receive":
+                    if not await self.handle(event.get("text") or event.get("bytes")):
+                        break
+        finally:
+            init_timeout.cancel()
+            for task in self.operations.values():
+                task.cancel()
+
+    async def _init_timeout(self):
+        await asyncio.sleep(CONNECTION_INIT_TIMEOUT)
+        if self.user is None:
+            await self.close(4408, "Connection initialisation timeout")
+
+    async def handle(self, text):
+        """Handle one client message; returns False once the socket is closed."""
+        try:
+            message = json.loads(text)
+            kind = message["type"]
+        except (ValueError, TypeError, KeyError):
+            return await self.close(4400, "Invalid message")
+
+        if kind == "connection_init":
+            if self.initialised:
+                return await self.close(4429, "Too many initialisation requests")
+            self.initialised = True
+            payload = message.get("payload") or {}
+            try:
+                self.user = await authenticate(payload.get("authorization"))
+            except JSONWebTokenError:
+                return await self.close(4403, "Forbidden")
+            await self.send({"type": "connection_ack"})
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "subscribe":
+            if self.user is None:
+                return await self.close(4401, "Unauthorized")
+            id, payload = message.get("id"), message.get("payload")
+            if not isinstance(id, str) or not isinstance(payload, dict):
+                return await self.close(4400, "Invalid message")
+            if id in self.operations:
+                return await self.close(4409, f"Subscriber for {id} already exists")
+            self.operations[id] = asyncio.create_task(self._run(id, payload))
+        elif kind == "complete":
+            task = self.operations.pop(message.get("id"), None)
+            if task is not None:
+                task.cancel()
+        else:
+            return await self.close(4400, f"Unexpected message type {kind}")
+        return True
+
+    async def _run(self, id, payload):
+        context = SimpleNamespace(user=self.user, loaders={})
+        try:
+            stream = await self._subscribe(payload, context)
+            if isinstance(stream, ExecutionResult):
+                await self.send({"id": id, "type": "error", "payload": [e.formatted for e in stream.errors]})
+                return
+            try:
+                async for result in stream:
+                    await self.send({"id": id, "type": "next", "payload": result.formatted})
+                    # Loaders cache per event, not for the life of the socket.
+                    context.loaders.clear()
+            finally:
+                await stream.aclose()
+            await self.send({"id": id, "type": "complete"})
+        finally:
+            if self.operations.get(id) is asyncio.current_task():
+                del self.operations[id]
+
+    async def _subscribe(self, payload, context):
+        """The event stream for a ``subscribe`` payload, or an ``ExecutionResult`` with errors."""
+        query = payload.get("query")
+        if not isinstance(query, str) or not query:
+            return ExecutionResult(errors=[GraphQLError("Must provide query string.")])
+
+        graphql_schema = schema.graphql_schema
+        try:
+            document, validation_errors = parse_and_validate(
+                graphql_schema, query, query_hash(query), GraphQLView.validation_rules
+            )
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+        if validation_errors:
+            return ExecutionResult(errors=validation_errors)
+
+        operation_name = payload.get("operationName")
+        operation = get_operation_ast(document, operation_name)
+        if operation is None or operation.operation != OperationType.SUBSCRIPTION:
+            return ExecutionResult(errors=[GraphQLError("Only subscriptions are served over WebSocket.")])
+
+        return await subscribe(
+            graphql_schema,
+            document,
+            context_value=context,
+            variable_values=payload.get("variables"),
+            operation_name=operation_name,
+        )
+
+
+async def graphql_ws(scope, receive, send):
+    await Connection(send).serve(scope, receive)
@@ -0,0 +1,103 @@
+"""
+Single-statement writes for the engagement and follow mutations.
+
+``create_linked`` does in one round trip what used to take a lookup, a
+``get_or_create`` (SELECT, savepoint, INSERT) and a counter UPDATE:
+
+    WITH target AS (<the target row, plus whatever the caller reads off it>),
+         inserted AS (INSERT ... SELECT ... FROM target
+                      ON CONFLICT DO NOTHING RETURNING ...),
+         counted AS (UPDATE <target> SET <counter> = <counter> + 1
+                     WHERE pk IN (SELECT <fk> FROM inserted))
+    SELECT inserted.pk, target.* FROM target LEFT JOIN inserted ON <fk> = target.pk
+
+A duplicate loses on the unique constraint instead of racing a SELECT, and
+the counter only moves when a row actually went in. ``create_linked_many``
+runs the same statement over several targets, e.g. for ``likePosts``.
+"""
+import copy
+
+from django.db import connections
+
+
+def create_linked(model, link, target, values, counter=None):
+    """
+    Insert ``model(**values)`` pointing at the one row of ``target`` through
+    the foreign key ``link``.
+
+    ``target`` is a ``values_list()`` queryset whose first column is the
+    target's primary key; its columns are returned, so related fields such
+    as ``"author__email"`` come back in the same statement. ``counter``
+    names a column of the target incremented when the row is inserted.
+
+    Returns ``(instance, target_values)``: ``(None, None)`` if the target does
+    not exist, ``(None, target_values)`` if a unique constraint already
+    covered the row.
+    """
+    rows = create_linked_many(model, link, target, values, counter)
+    if not rows:
+        return None, None
+    return rows[0]
+
+
+def create_linked_many(model, link, target, values, counter=None):
+    """
+    ``create_linked`` for every row of ``target``, in the same one statement.
+
+    Returns an ``(instance, target_values)`` pair per target row, with
+    ``instance`` None where a unique constraint already covered the row.
+    Targets that do not exist are simply absent.
+    """
+    connection = connections[target.db]
+    qn = connection.ops.quote_name
+    compiler = target.query.get_compiler(using=target.db)
+    target_sql, target_params = compiler.as_sql()
+    target_columns = [f"c{i}" for i in range(len(compiler.select))]
+
+    template = model(**values)
+    link_field = model._meta.get_field(link)
+    columns, selected, params = [], [], []
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(qn(field.column))
+        if field is link_field:
+            selected.append("target.c0")
+        else:
+            selected.append("%s")
+            params.append(field.get_db_prep_save(field.pre_save(template, True), connection))
+
+    pk = qn(model._meta.pk.column)
+    link_column = qn(link_field.column)
+    sql = (
+        f"WITH target ({', '.join(target_columns)}) AS ({target_sql}), "
+        f"inserted AS (INSERT INTO {qn(model._meta.db_table)} ({', '.join(columns)}) "
+        f"SELECT {', '.join(selected)} FROM target ON CONFLICT DO NOTHING RETURNING {pk}, {link_column})"
+    )
+    if counter:
+        target_model = target.model
+        column = qn(target_model._meta.get_field(counter).column)
+        sql += (
+            f", counted AS (UPDATE {qn(target_model._meta.db_table)} SET {column} = {column} + 1 "
+            f"WHERE {qn(target_model._meta.pk.column)} IN (SELECT {link_column} FROM inserted))"
+        )
+    sql += (
+        f" SELECT inserted.{pk}, {', '.join(f'target.{c}' for c in target_columns)} "
+        f"FROM target LEFT JOIN inserted ON inserted.{link_column} = target.c0"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*target_params, *params])
+        rows = cursor.fetchall()
+
+    results = []
+    for created_pk, *target_values in rows:
+        instance = None
+        if created_pk is not None:
+            instance = copy.copy(template)
+            instance.pk = created_pk
+            setattr(instance, link_field.attname, target_values[0])
+            instance._state.adding = False
+            instance._state.db = target.db
+        results.append((instance, tuple(target_values)))
+    return results
@@ -1,3 +1,22 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db import transaction
 
-# Register your models here.
+from .auth import deactivate_users, forget
+from .models import User
+
+
+@admin.register(User)
+class UserAdmin(BaseUserAdmin):
+    actions = ["deactivate"]
+
+    @admin.action(description="Deactivate selected users", permissions=["change"])
+    def deactivate(self, request, queryset):
+        count = deactivate_users(queryset)
+        self.message_user(request, f"Deactivated {count} user(s).")
+
+    def delete_queryset(self, request, queryset):
+        # A bulk delete skips User.delete(), which drops the cached copies.
+        with transaction.atomic():
+            forget(*queryset.values_list("pk", flat=True))
+            super().delete_queryset(request, queryset)
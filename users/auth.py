@@ -0,0 +1,210 @@
+"""
+Cached user resolution for JWT-authenticated requests.
+
+Tokens carry the user's id and ``token_version`` next to the username. A
+token is resolved from a small per-process LRU first, then from Redis
+(``jwt-user-fields:{user_id}``), and only then from Postgres, so requests from an
+active user run no auth query at all. Only ``CACHED_FIELDS`` are cached; the
+password hash and the other columns are deferred and loaded on first access.
+
+Saving or deleting a user, and ``deactivate_users`` (the admin's bulk
+action), increment ``jwt-user-version:{user_id}`` and drop the Redis entry
+once the transaction commits. Entries record the version read before their
+SELECT and are ignored once it has moved, so a reload that raced a save
+cannot put the old row back. Local entries expire after
+``JWT_USER_CACHE_LOCAL_TTL`` seconds, so other processes see the change
+within that window. Changing the password also bumps ``token_version``,
+which revokes every token issued before it; a deactivated user is rejected
+as disabled once reloaded. Any other ``QuerySet.update()`` of users is not
+seen until the Redis entry expires, up to ``JWT_USER_CACHE_TTL`` seconds.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import DEFERRED
+from graphql_jwt import utils
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.exceptions import JSONWebTokenError
+
+USER_KEY = "jwt-user-fields:{user_id}"
+VERSION_KEY = "jwt-user-version:{user_id}"
+
+CACHED_FIELDS = (
+    "id", "username", "email", "first_name", "last_name", "is_active", "is_staff", "is_superuser",
+    "bio", "profile_picture", "profile_picture_variants", "profile_picture_status", "token_version",
+)
+
+
+class UserCache:
+    """Thread-safe LRU of ``user id -> pickled CACHED_FIELDS values`` whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+        # Every request gets its own copy, which it is free to modify and save.
+        return pickle.loads(data)
+
+    def set(self, user_id, values):
+        data = pickle.dumps(values)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+users = UserCache(settings.JWT_USER_CACHE_SIZE, settings.JWT_USER_CACHE_LOCAL_TTL)
+
+
+def jwt_payload(user, context=None):
+    """``JWT_PAYLOAD_HANDLER``: graphql_jwt's payload plus the user's id and token version."""
+    payload = utils.jwt_payload(user, context)
+    payload["userId"] = user.pk
+    payload["tokenVersion"] = user.token_version
+    return payload
+
+
+def _build(values):
+    """A user from ``CACHED_FIELDS`` values, with every other field deferred."""
+    model = get_user_model()
+    cached = dict(zip(CACHED_FIELDS, values))
+    fields = model._meta.concrete_fields
+    return model.from_db(
+        DEFAULT_DB_ALIAS, [f.attname for f in fields], [cached.get(f.attname, DEFERRED) for f in fields]
+    )
+
+
+def _select(user_id):
+    return get_user_model()._default_manager.filter(pk=user_id).values_list(*CACHED_FIELDS).first()
+
+
+def _load(user_id):
+    # Read before the SELECT: a save committed after it moves the version on.
+    version = cache.get(VERSION_KEY.format(user_id=user_id), 0)
+    values = _select(user_id)
+    if values is None:
+        return None
+    user = _build(values)
+    if user.is_active:
+        cache.set(USER_KEY.format(user_id=user_id), (version, values), settings.JWT_USER_CACHE_TTL)
+        users.set(user_id, values)
+    return user
+
+
+def _cached(user_id):
+    """The cached ``CACHED_FIELDS`` values of a user, or None."""
+    values = users.get(user_id)
+    if values is None:
+        user_key, version_key = USER_KEY.format(user_id=user_id), VERSION_KEY.format(user_id=user_id)
+        entries = cache.get_many([user_key, version_key])
+        entry = entries.get(user_key)
+        if entry is not None and entry[0] == entries.get(version_key, 0):
+            values = entry[1]
+            users.set(user_id, values)
+    return values
+
+
+def get_user_by_payload(payload):
+    """
+    The user a decoded token belongs to, or None if it no longer exists.
+    Raises ``JSONWebTokenError`` if the token was revoked or the user is disabled.
+    """
+    user_id, version = payload.get("userId"), payload.get("tokenVersion")
+    if user_id is None or version is None:
+        # Issued before tokens carried a version: resolve it the uncached way.
+        return utils.get_user_by_payload(payload)
+
+    values = _cached(user_id)
+    user = None if values is None else _build(values)
+    if user is None or user.token_version < version:
+        # Versions only grow: a newer token means the cached copy is stale.
+        user = _load(user_id)
+
+    if user is None:
+        return None
+    if not user.is_active:
+        raise JSONWebTokenError("User is disabled")
+    if user.token_version != version:
+        raise JSONWebTokenError("Token has been revoked")
+    return user
+
+
+def get_user_by_token(token, context=None):
+    return get_user_by_payload(utils.get_payload(token, context))
+
+
+def payload_username(payload):
+    """
+    ``JWT_PAYLOAD_GET_USERNAME_HANDLER``: the token's username, unless it was
+    revoked. graphql_jwt's own lookups (e.g. refreshToken) go through this.
+    """
+    if payload.get("tokenVersion") is not None:
+        get_user_by_payload(payload)
+    return payload.get(get_user_model().USERNAME_FIELD)
+
+
+def forget(*user_ids):
+    """Drop the cached copies of users once the current transaction commits."""
+    def drop():
+        for user_id in user_ids:
+            cache.incr(VERSION_KEY.format(user_id=user_id), ignore_key_check=True)
+            cache.delete(USER_KEY.format(user_id=user_id))
+            users.discard(user_id)
+
+    transaction.on_commit(drop)
+
+
+def deactivate_users(queryset):
+    """
+    Deactivate the users in ``queryset`` with one UPDATE and forget them, so
+    their tokens stop working on the next request. Returns how many changed.
+    """
+    with transaction.atomic():
+        user_ids = list(queryset.filter(is_active=True).values_list("pk", flat=True))
+        get_user_model()._default_manager.filter(pk__in=user_ids).update(is_active=False)
+        forget(*user_ids)
+    return len(user_ids)
+
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    """``JSONWebTokenBackend`` that resolves tokens through the user cache."""
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, "_jwt_token_auth", False):
+            return None
+        error = getattr(request, "_jwt_auth_error", None)
+        if error is not None:
+            # Set by social_media_feed.views.authenticate_request.
+            raise error
+
+        token = utils.get_credentials(request, **kwargs)
+        if token is not None:
+            return get_user_by_token(token, request)
+        return None
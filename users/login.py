@@ -0,0 +1,86 @@
+"""
+Password logins, one hash per attempt.
+
+``LoginBackend`` replaces Django's ``ModelBackend``, and every login entry
+point (``/api/login/``, ``/api/token/``, the ``login`` and ``tokenAuth``
+mutations) calls ``authenticate()`` exactly once. Each attempt then costs
+one PBKDF2 run, whether or not the username exists. Unknown usernames still
+pay for a hash, so response times do not reveal which accounts exist.
+
+Hashes run in a bounded pool of ``LOGIN_HASH_WORKERS`` threads. Under ASGI
+every request runs in its own thread, so without the pool a burst of logins
+would run that many hashes at once. With it, attempts queue for a core and
+the event loop is never blocked. Usernames that matched no account are
+remembered in Redis for ``LOGIN_UNKNOWN_USERNAME_TTL`` seconds, so repeated
+attempts against them skip the database.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.db import transaction
+
+UNKNOWN_USERNAME_KEY = "login:unknown:{digest}"
+
+_hashers = ThreadPoolExecutor(settings.LOGIN_HASH_WORKERS or 1, thread_name_prefix="password-hash")
+
+
+def run_hasher(fn, *args):
+    """Run ``fn(*args)`` in the hashing pool, or inline if it is disabled."""
+    if not settings.LOGIN_HASH_WORKERS:
+        return fn(*args)
+    return _hashers.submit(fn, *args).result()
+
+
+def _verify(password, encoded):
+    """``(correct, must_update)`` for ``password`` against a stored hash."""
+    outdated = []
+    correct = check_password(password, encoded, setter=lambda raw: outdated.append(raw))
+    return correct, bool(outdated)
+
+
+def _unknown_key(username):
+    return UNKNOWN_USERNAME_KEY.format(digest=hashlib.sha256(username.encode()).hexdigest())
+
+
+def forget_unknown_username(username):
+    """Let ``username`` log in immediately once the current transaction commits."""
+    key = _unknown_key(username)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class LoginBackend(ModelBackend):
+    """``ModelBackend`` with pooled hashing and a negative username cache."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        user = None
+        key = _unknown_key(str(username))
+        if not cache.get(key):
+            try:
+                user = UserModel._default_manager.get_by_natural_key(username)
+            except UserModel.DoesNotExist:
+                cache.set(key, True, settings.LOGIN_UNKNOWN_USERNAME_TTL)
+        if user is None:
+            # Same cost as a real check (see ModelBackend.authenticate).
+            run_hasher(make_password, password)
+            return None
+
+        correct, must_update = run_hasher(_verify, password, user.password)
+        if not correct or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            # Stored with older hasher settings; this is the only second hash.
+            user.set_password(password)
+            user._password = None
+            user.save(update_fields=["password"])
+        return user
@@ -0,0 +1,70 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+PASSWORD = "benchmark-password"
+
+
+def _client(username, password, deadline, logins, failures):
+    try:
+        while time.perf_counter() < deadline:
+            if authenticate(username=username, password=password) is not None:
+                logins.append(1)
+            else:
+                failures.append(1)
+    finally:
+        connections.close_all()
+
+
+def run_logins(username, password, concurrency, duration):
+    """Attempt logins from ``concurrency`` threads for ``duration`` seconds; returns (ok, failed)."""
+    logins, failures = [], []
+    deadline = time.perf_counter() + duration
+    with ThreadPoolExecutor(concurrency) as clients:
+        futures = [
+            clients.submit(_client, username, password, deadline, logins, failures) for _ in range(concurrency)
+        ]
+        for future in futures:
+            future.result()
+    return len(logins), len(failures)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password logins per second per core through the login backend, "
+        "for a real account and for unknown usernames."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=16, help="Threads attempting logins")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds measured per scenario")
+
+    def handle(self, *args, concurrency, duration, **kwargs):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        # Hashing never uses more threads than the pool (or the clients, when inline).
+        busy = min(cores, settings.LOGIN_HASH_WORKERS or concurrency, concurrency)
+
+        username = f"login-benchmark-{uuid.uuid4().hex[:8]}"
+        user = get_user_model().objects.create_user(username, password=PASSWORD)
+        try:
+            scenarios = [
+                ("valid", username, PASSWORD),
+                ("wrong password", username, "not-the-password"),
+                ("unknown user", f"{username}-missing", PASSWORD),
+            ]
+            self.stdout.write(
+                f"{cores} cores, {concurrency} clients, hash pool {settings.LOGIN_HASH_WORKERS or 'off'}"
+            )
+            self.stdout.write(f"{'scenario':<16}{'logins/s':>10}{'per core':>10}{'ok':>8}{'failed':>8}")
+            for label, name, password in scenarios:
+                ok, failed = run_logins(name, password, concurrency, duration)
+                throughput = (ok + failed) / duration
+                self.stdout.write(f"{label:<16}{throughput:>10.1f}{throughput / busy:>10.1f}{ok:>8}{failed:>8}")
+        finally:
+            user.delete()
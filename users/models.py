@@ -1,13 +1,38 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from social_media_feed.images import ImageStatus
 
 class User(AbstractUser):
     bio = models.TextField(blank=True, null=True)
     profile_picture = models.ImageField(upload_to="profiles/", blank=True, null=True)
+    # Resized copies of ``profile_picture``, written by users.tasks.process_profile_picture
+    profile_picture_variants = models.JSONField(default=list, blank=True)
+    profile_picture_status = models.CharField(max_length=16, choices=ImageStatus.choices, default=ImageStatus.NONE)
+    # Part of every JWT (see users/auth.py); bumping it revokes the tokens issued before
+    token_version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            from .login import forget_unknown_username
+            forget_unknown_username(self.username)
+        else:
+            # set_password() leaves the raw password here until the save.
+            if self._password is not None:
+                self.token_version += 1
+                if kwargs.get("update_fields") is not None:
+                    kwargs["update_fields"] = {*kwargs["update_fields"], "token_version"}
+            from .auth import forget
+            forget(self.pk)
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from .auth import forget
+        forget(self.pk)
+        return super().delete(*args, **kwargs)
+
 class Follow(models.Model):
     follower = models.ForeignKey("User", related_name="following", on_delete=models.CASCADE)
     following = models.ForeignKey("User", related_name="followers", on_delete=models.CASCADE)
@@ -17,6 +42,10 @@ class Follow(models.Model):
          constraints = [
         models.UniqueConstraint(fields=["follower", "following"], name="unique_follow")
     ]
+         indexes = [
+        models.Index(fields=["following", "-created_at"], name="follow_following_created_idx"),
+        models.Index(fields=["follower", "-created_at"], name="follow_follower_created_idx"),
+    ]
          
     def __str__(self):
         return f"{self.follower} → {self.following}"
\ No newline at end of file
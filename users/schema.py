@@ -1,8 +1,18 @@
 import graphene
+from asgiref.sync import sync_to_async
 from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 from django.contrib.auth import get_user_model, authenticate
+from django.db import transaction
+from django.db.models import Q
 import graphql_jwt
+from graphene_file_upload.scalars import Upload
+from social_media_feed import bulk, images
+from social_media_feed.loaders import load_related
+from social_media_feed.pagination import connection_args, page_size, paginate
+from social_media_feed.response_cache import bump_author_versions
+from social_media_feed.writes import create_linked, create_linked_many
+from . import suggestions
 from .models import Follow
 from .tasks import send_login_notification  # Celery task
 
@@ -13,7 +23,12 @@ UserModel = get_user_model()
 class UserType(DjangoObjectType):
     class Meta:
         model = UserModel
-        fields = ("id", "username", "email", "bio", "profile_picture")
+        fields = ("id", "username", "email", "bio", "profile_picture", "profile_picture_status")
+
+    profile_picture_srcset = images.srcset_field()
+
+    def resolve_profile_picture_srcset(root, info, format):
+        return images.srcset(root, "profile_picture", format)
 
 
 class FollowType(DjangoObjectType):
@@ -21,16 +36,64 @@ class FollowType(DjangoObjectType):
         model = Follow
         fields = ("id", "follower", "following", "created_at")
 
+    def resolve_follower(root, info):
+        return load_related(info, root, "follower")
+
+    def resolve_following(root, info):
+        return load_related(info, root, "following")
+
+
+class UserConnection(graphene.relay.Connection):
+    class Meta:
+        node = UserType
+
+
+class FollowConnection(graphene.relay.Connection):
+    """Followers or followed users, newest follow first."""
+
+    class Meta:
+        node = UserType
+
+    class Edge:
+        viewer_follows = graphene.Boolean(description="Whether the viewer follows this user; null when anonymous")
+        follows_viewer = graphene.Boolean(description="Whether this user follows the viewer; null when anonymous")
+
+
+async def follow_page(info, follows, first, after, other):
+    """
+    One page of ``follows`` as a FollowConnection of the ``other`` side's
+    users, with the viewer's relationship to each fetched in one query.
+    """
+    connection = await paginate(
+        follows.select_related(other), FollowConnection, first, after, node=lambda f: getattr(f, other)
+    )
+    viewer = info.context.user
+    user_ids = [edge.node.pk for edge in connection.edges]
+    if viewer.is_anonymous or not user_ids:
+        return connection
+
+    pairs = {
+        pair
+        async for pair in Follow.objects.filter(
+            Q(follower=viewer, following_id__in=user_ids) | Q(following=viewer, follower_id__in=user_ids)
+        ).values_list("follower_id", "following_id")
+    }
+    for edge in connection.edges:
+        edge.viewer_follows = (viewer.pk, edge.node.pk) in pairs
+        edge.follows_viewer = (edge.node.pk, viewer.pk) in pairs
+    return connection
+
 
 # ---------------------- Queries ----------------------
 class Query(graphene.ObjectType):
-    users = graphene.List(UserType)
+    users = graphene.Field(UserConnection, **connection_args())
     me = graphene.Field(UserType)
-    followers = graphene.List(UserType, user_id=graphene.Int(required=True))
-    following = graphene.List(UserType, user_id=graphene.Int(required=True))
+    followers = graphene.Field(FollowConnection, **connection_args(user_id=graphene.Int(required=True)))
+    following = graphene.Field(FollowConnection, **connection_args(user_id=graphene.Int(required=True)))
+    suggested_users = graphene.List(graphene.NonNull(UserType), first=graphene.Int())
 
-    def resolve_users(root, info):
-        return UserModel.objects.all()
+    async def resolve_users(root, info, first=None, after=None):
+        return await paginate(UserModel.objects.all(), UserConnection, first, after, field="date_joined")
 
     def resolve_me(root, info):
         user = info.context.user
@@ -38,11 +101,19 @@ class Query(graphene.ObjectType):
             raise GraphQLError("You must be logged in to view this information")
         return user
 
-    def resolve_followers(root, info, user_id):
-        return [f.follower for f in Follow.objects.filter(following_id=user_id)]
+    async def resolve_followers(root, info, user_id, first=None, after=None):
+        return await follow_page(info, Follow.objects.filter(following_id=user_id), first, after, "follower")
 
-    def resolve_following(root, info, user_id):
-        return [f.following for f in Follow.objects.filter(follower_id=user_id)]
+    async def resolve_following(root, info, user_id, first=None, after=None):
+        return await follow_page(info, Follow.objects.filter(follower_id=user_id), first, after, "following")
+
+    async def resolve_suggested_users(root, info, first=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+        ids = await sync_to_async(suggestions.suggested_ids)(user.id, page_size(first))
+        users = await UserModel.objects.ain_bulk(ids)
+        return [users[user_id] for user_id in ids if user_id in users]
 
 
 # ---------------------- Mutations ----------------------
@@ -61,6 +132,29 @@ class CreateUser(graphene.Mutation):
         return CreateUser(user=user)
 
 
+class UpdateProfile(graphene.Mutation):
+    user = graphene.Field(UserType)
+
+    class Arguments:
+        bio = graphene.String(required=False)
+        profile_picture = Upload(required=False)
+
+    def mutate(self, info, bio=None, profile_picture=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+
+        if bio is not None:
+            user.bio = bio
+        images.save(user, "profile_picture", profile_picture)
+        bump_author_versions(user.id)
+
+        if profile_picture:
+            from .tasks import process_profile_picture
+            transaction.on_commit(lambda: process_profile_picture.delay(user.id, user.profile_picture.name))
+        return UpdateProfile(user=user)
+
+
 class FollowUser(graphene.Mutation):
     follow = graphene.Field(FollowType)
 
@@ -74,10 +168,18 @@ class FollowUser(graphene.Mutation):
         if user.id == user_id:
             raise GraphQLError("You cannot follow yourself")
 
-        target = UserModel.objects.get(pk=user_id)
-        follow, created = Follow.objects.get_or_create(follower=user, following=target)
-        if not created:
+        follow, target = create_linked(
+            Follow, "following", UserModel.objects.filter(pk=user_id).values_list("pk"), {"follower": user}
+        )
+        if target is None:
+            raise GraphQLError("User not found")
+        if follow is None:
             raise GraphQLError("Already following this user")
+
+        from posts.tasks import add_author_to_timeline
+        from .tasks import refresh_suggestion_neighbourhood
+        transaction.on_commit(lambda: add_author_to_timeline.delay(user.id, user_id))
+        transaction.on_commit(lambda: refresh_suggestion_neighbourhood.delay(user.id))
         return FollowUser(follow=follow)
 
 
@@ -94,11 +196,63 @@ class UnfollowUser(graphene.Mutation):
         try:
             follow = Follow.objects.get(follower=user, following_id=user_id)
             follow.delete()
+
+            from posts.tasks import remove_author_from_timeline
+            from .tasks import refresh_suggestion_neighbourhood
+            transaction.on_commit(lambda: remove_author_from_timeline.delay(user.id, user_id))
+            transaction.on_commit(lambda: refresh_suggestion_neighbourhood.delay(user.id))
             return UnfollowUser(success=True)
         except Follow.DoesNotExist:
             raise GraphQLError("Not following this user")
 
 
+class FollowResult(graphene.ObjectType):
+    user_id = graphene.Int(required=True)
+    success = graphene.Boolean(required=True)
+    error = graphene.String()
+
+
+class FollowUsers(graphene.Mutation):
+    """Follow several users at once, e.g. from onboarding suggestions."""
+
+    results = graphene.List(graphene.NonNull(FollowResult), required=True)
+
+    class Arguments:
+        user_ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+
+    def mutate(self, info, user_ids):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("You must be logged in")
+        bulk.check_size(user_ids)
+
+        rows = create_linked_many(
+            Follow, "following",
+            UserModel.objects.filter(pk__in=[user_id for user_id in user_ids if user_id != user.id]).values_list("pk"),
+            {"follower": user},
+        )
+        found = {target[0] for _, target in rows}
+        new = [target[0] for follow, target in rows if follow is not None]
+        errors = {}
+        for user_id in user_ids:
+            if user_id == user.id:
+                errors[user_id] = "You cannot follow yourself"
+            elif user_id not in found:
+                errors[user_id] = "User not found"
+            elif user_id not in new:
+                errors[user_id] = "Already following this user"
+
+        if new:
+            from posts.tasks import add_authors_to_timeline
+            from .tasks import refresh_suggestion_neighbourhood
+            transaction.on_commit(lambda: add_authors_to_timeline.delay(user.id, new))
+            transaction.on_commit(lambda: refresh_suggestion_neighbourhood.delay(user.id))
+        return FollowUsers(results=[
+            FollowResult(user_id=user_id, success=error is None, error=error)
+            for user_id, error in bulk.item_errors(user_ids, errors)
+        ])
+
+
 # ---------------------- Custom Login Mutation (Async Notification) ----------------------
 class CustomLogin(graphene.Mutation):
     user = graphene.Field(UserType)
@@ -111,7 +265,7 @@ class CustomLogin(graphene.Mutation):
         password = graphene.String(required=True)
 
     def mutate(self, info, username, password):
-        user = authenticate(username=username, password=password)
+        user = authenticate(info.context, username=username, password=password)
         if not user:
             raise GraphQLError("Invalid credentials")
 
@@ -121,10 +275,7 @@ class CustomLogin(graphene.Mutation):
 
         # Trigger async task (Celery) for login notification
         if user.email:
-            send_login_notification.delay(
-                username=user.username,
-                email=user.email,
-            )
+            send_login_notification.delay(user.email)
 
         return CustomLogin(
             user=user,
@@ -137,7 +288,9 @@ class CustomLogin(graphene.Mutation):
 # ---------------------- Root Mutation ----------------------
 class Mutation(graphene.ObjectType):
     create_user = CreateUser.Field()
+    update_profile = UpdateProfile.Field()
     follow_user = FollowUser.Field()
+    follow_users = FollowUsers.Field()
     unfollow_user = UnfollowUser.Field()
     login = CustomLogin.Field()  # Use the async login mutation
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
@@ -22,7 +22,7 @@ class LoginSerializer(serializers.Serializer):
         username = attrs.get("username")
         password = attrs.get("password")
 
-        user = authenticate(username=username, password=password)
+        user = authenticate(self.context.get("request"), username=username, password=password)
         if not user:
             raise serializers.ValidationError({"error": "Invalid username or password"})
         attrs["user"] = user
@@ -0,0 +1,124 @@
+"""
+Friends-of-friends follow suggestions.
+
+A candidate's score is how many of the people a user follows also follow
+the candidate. Scores are computed offline by Celery, a batch of users at a
+time, and stored per user as a Redis sorted set. The query only reads that
+set.
+
+For each batch, the follow lists of the users and of everyone they follow
+are loaded ``SUGGESTIONS_BATCH_SIZE`` users per query. Each list is kept as a
+compact ``array('q')`` of ids, and the per-candidate counts are taken with
+``Counter.update``, which counts an array in C. There is no self-join in
+Postgres.
+
+A user's suggestions change when they, or anyone they follow, follow or
+unfollow someone. ``refresh_neighbourhood`` recomputes the user's own set at
+once and marks their followers stale. The followers are refreshed in bulk by
+a Beat task. A user with no set yet gets no suggestions on that read, and a
+task computes theirs in the background.
+"""
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .models import Follow
+
+SUGGESTIONS_KEY = "suggestions:{user_id}"
+STALE_KEY = "suggestions:stale"
+PENDING_KEY = "suggestions:pending:{user_id}"
+
+# Member kept in every computed set, so a user with no suggestions is not
+# recomputed on each read. Its score of 0 keeps it below every real candidate.
+EMPTY_MARKER = "-"
+
+# How long a missing set waits for its task before a read enqueues another.
+PENDING_TTL = 60
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def suggestions_key(user_id):
+    return SUGGESTIONS_KEY.format(user_id=user_id)
+
+
+def _adjacency(user_ids):
+    """``{user_id: array of followed ids}`` for ``user_ids``, one query per ``SUGGESTIONS_BATCH_SIZE`` of them."""
+    following = defaultdict(lambda: array("q"))
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), settings.SUGGESTIONS_BATCH_SIZE):
+        page = user_ids[start:start + settings.SUGGESTIONS_BATCH_SIZE]
+        rows = Follow.objects.filter(follower_id__in=page).values_list("follower_id", "following_id")
+        for follower_id, following_id in rows.iterator(chunk_size=10000):
+            following[follower_id].append(following_id)
+    return following
+
+
+def compute(user_ids):
+    """``{user_id: [(candidate_id, score), ...]}``, best first, for a batch of users."""
+    first_hop = _adjacency(user_ids)
+    second_hop = _adjacency({v for followed in first_hop.values() for v in followed})
+
+    results = {}
+    for user_id in user_ids:
+        followed = first_hop.get(user_id, ())
+        counts = Counter()
+        for v in followed:
+            counts.update(second_hop.get(v, ()))
+        for known in (user_id, *followed):
+            counts.pop(known, None)
+        results[user_id] = counts.most_common(settings.SUGGESTIONS_MAX)
+    return results
+
+
+def store(results):
+    pipe = _redis().pipeline()
+    for user_id, ranked in results.items():
+        key = suggestions_key(user_id)
+        pipe.delete(key)
+        pipe.zadd(key, {EMPTY_MARKER: 0, **dict(ranked)})
+        pipe.expire(key, settings.SUGGESTIONS_TTL)
+    pipe.execute()
+
+
+def refresh(user_ids):
+    """Recompute and store suggestions for ``user_ids``."""
+    for start in range(0, len(user_ids), settings.SUGGESTIONS_BATCH_SIZE):
+        store(compute(user_ids[start:start + settings.SUGGESTIONS_BATCH_SIZE]))
+
+
+def refresh_neighbourhood(user_id):
+    """Recompute ``user_id``'s suggestions now and mark their followers stale."""
+    refresh([user_id])
+    followers = Follow.objects.filter(following_id=user_id).values_list("follower_id", flat=True)
+    batch = []
+    for follower_id in followers.iterator(chunk_size=settings.SUGGESTIONS_BATCH_SIZE):
+        batch.append(follower_id)
+        if len(batch) == settings.SUGGESTIONS_BATCH_SIZE:
+            _redis().sadd(STALE_KEY, *batch)
+            batch = []
+    if batch:
+        _redis().sadd(STALE_KEY, *batch)
+
+
+def pop_stale(count):
+    """Take up to ``count`` stale user ids off the queue."""
+    return [int(user_id) for user_id in _redis().spop(STALE_KEY, count) or ()]
+
+
+def suggested_ids(user_id, limit):
+    """Up to ``limit`` suggested user ids for ``user_id``; none while a missing set is computed."""
+    key = suggestions_key(user_id)
+    redis = _redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.zrevrangebyscore(key, "+inf", "(0", start=0, num=limit)
+    exists, candidates = pipe.execute()
+    if not exists and redis.set(PENDING_KEY.format(user_id=user_id), 1, nx=True, ex=PENDING_TTL):
+        from .tasks import refresh_suggestions
+        refresh_suggestions.delay(user_id)
+    return [int(candidate) for candidate in candidates]
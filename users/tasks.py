@@ -1,8 +1,66 @@
 # users/tasks.py
 from celery import shared_task
+from django.conf import settings
+from social_media_feed import images
+from social_media_feed.response_cache import bump_author_versions
+from . import suggestions
+from .auth import forget
+from .models import Follow, User
 
 @shared_task
 def send_login_notification(user_email):
 
     print(f"Sending login notification to {user_email}")
     return f"Notification sent to {user_email}"
+
+
+@shared_task
+def process_profile_picture(user_id, name):
+    """Build the resized variants of a user's uploaded profile picture."""
+    status = images.process(User, user_id, "profile_picture", name)
+    forget(user_id)
+    if status is None:
+        return "Profile picture was replaced before processing finished."
+    bump_author_versions(user_id)
+    return f"Profile picture {status}."
+
+
+# ---------------------- Follow suggestions ----------------------
+@shared_task
+def refresh_suggestions(user_id):
+    """Compute suggestions for a user who had none stored."""
+    suggestions.refresh([user_id])
+
+
+@shared_task
+def refresh_suggestion_neighbourhood(user_id):
+    """Recompute a user's follow suggestions after they follow or unfollow someone."""
+    suggestions.refresh_neighbourhood(user_id)
+
+
+@shared_task
+def refresh_stale_suggestions():
+    """Recompute suggestions for users whose followed accounts changed who they follow."""
+    refreshed = 0
+    while True:
+        user_ids = suggestions.pop_stale(settings.SUGGESTIONS_BATCH_SIZE)
+        if not user_ids:
+            break
+        suggestions.refresh(user_ids)
+        refreshed += len(user_ids)
+    return f"Refreshed suggestions for {refreshed} users."
+
+
+@shared_task
+def rebuild_suggestions():
+    """Recompute suggestions for every user who follows anyone."""
+    followers = Follow.objects.order_by("follower_id").values_list("follower_id", flat=True).distinct()
+    batch, rebuilt = [], 0
+    for user_id in followers.iterator(chunk_size=settings.SUGGESTIONS_BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) == settings.SUGGESTIONS_BATCH_SIZE:
+            suggestions.refresh(batch)
+            rebuilt += len(batch)
+            batch = []
+    suggestions.refresh(batch)
+    return f"Rebuilt suggestions for {rebuilt + len(batch)} users."
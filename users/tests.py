@@ -1,3 +1,22 @@
+from unittest import mock
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django_redis import get_redis_connection
+from graphql_jwt.shortcuts import get_token
+
+from social_media_feed.execution import execute_sync
+from social_media_feed.schema import schema
+from social_media_feed.testing import PASSWORD, GraphQLTestMixin, clear_redis
+from social_media_feed.writes import create_linked_many
+
+from . import auth, login
+from .models import Follow, User
+from .suggestions import suggestions_key
+from .tasks import refresh_stale_suggestions, refresh_suggestion_neighbourhood, refresh_suggestions
+
 # ----- Custom LoginView -----
 def test_custom_login_success(self):
     response = self.client.post(
@@ -35,3 +54,278 @@ def test_jwt_login_fail(self):
         content_type="application/json",
     )
     self.assertEqual(response.status_code, 401)
+
+
+class FollowConnectionTests(GraphQLTestMixin, TestCase):
+    query = """
+        query($userId: Int!) {
+            followers(userId: $userId, first: 10) {
+                edges { viewerFollows followsViewer node { username } }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.author = User.objects.create_user("author", "author@example.com", PASSWORD)
+        mutual, fan, stranger = (
+            User.objects.create_user(name, f"{name}@example.com", PASSWORD) for name in ("mutual", "fan", "stranger")
+        )
+        for user in (mutual, fan, stranger):
+            Follow.objects.create(follower=user, following=cls.author)
+        Follow.objects.create(follower=cls.viewer, following=mutual)
+        Follow.objects.create(follower=mutual, following=cls.viewer)
+        Follow.objects.create(follower=fan, following=cls.viewer)
+
+    def edges(self, viewer):
+        with self.assertNumQueries(2 if viewer.is_authenticated else 1):
+            data = self.run_as(viewer, self.query, variable_values={"userId": self.author.id})
+        return {
+            edge["node"]["username"]: (edge["viewerFollows"], edge["followsViewer"])
+            for edge in data["followers"]["edges"]
+        }
+
+    def test_edges_carry_the_viewers_relationship(self):
+        self.assertEqual(
+            self.edges(self.viewer),
+            {"mutual": (True, True), "fan": (False, True), "stranger": (False, False)},
+        )
+
+    def test_flags_are_null_for_anonymous_viewers(self):
+        self.assertEqual(set(self.edges(AnonymousUser()).values()), {(None, None)})
+
+
+class SuggestedUsersTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = ["viewer", "alice", "bob", "carol", "dave", "erin"]
+        cls.users = {name: User.objects.create_user(name, f"{name}@example.com", PASSWORD) for name in names}
+        for follower, following in [
+            ("viewer", "alice"), ("viewer", "bob"),
+            ("alice", "carol"), ("bob", "carol"), ("alice", "dave"),
+            ("alice", "bob"),  # already followed by the viewer
+            ("bob", "viewer"),  # the viewer themselves
+        ]:
+            Follow.objects.create(follower=cls.users[follower], following=cls.users[following])
+
+    def setUp(self):
+        clear_redis("suggestions:")
+        self.mute_celery()
+
+    def suggested(self, name):
+        data = self.run_as(self.users[name], "{ suggestedUsers { username } }")
+        return [user["username"] for user in data["suggestedUsers"]]
+
+    def test_missing_suggestions_are_computed_in_the_background(self):
+        with mock.patch("users.tasks.refresh_suggestions.delay") as delay:
+            self.assertEqual(self.suggested("viewer"), [])
+            self.assertEqual(self.suggested("viewer"), [])
+        delay.assert_called_once_with(self.users["viewer"].id)
+
+    def test_candidates_are_ranked_by_mutual_follows(self):
+        # One query for the viewer's follows, then one per page of followed users.
+        with self.settings(SUGGESTIONS_BATCH_SIZE=1), self.assertNumQueries(3):
+            refresh_suggestions(self.users["viewer"].id)
+        self.assertEqual(self.suggested("viewer"), ["carol", "dave"])
+        with self.assertNumQueries(1):
+            self.suggested("viewer")
+
+    def test_follow_changes_refresh_the_neighbourhood(self):
+        refresh_suggestions(self.users["viewer"].id)
+        self.assertEqual(self.suggested("viewer"), ["carol", "dave"])
+        with mock.patch("users.tasks.refresh_suggestion_neighbourhood.delay") as delay:
+            self.run_as(self.users["bob"], "mutation { followUser(userId: %d) { follow { id } } }" % self.users["erin"].id)
+        delay.assert_called_once_with(self.users["bob"].id)
+
+        refresh_suggestion_neighbourhood(self.users["bob"].id)
+        # bob's followers (alice, the viewer) were marked stale, not recomputed yet.
+        self.assertEqual(self.suggested("viewer"), ["carol", "dave"])
+        refresh_stale_suggestions()
+        carol, *tied = self.suggested("viewer")
+        self.assertEqual((carol, sorted(tied)), ("carol", ["dave", "erin"]))
+        self.assertIsNotNone(get_redis_connection("default").zscore(suggestions_key(self.users["bob"].id), "-"))
+
+
+class FollowUsersTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+        cls.alice = User.objects.create_user("alice", "alice@example.com", PASSWORD)
+        cls.bob = User.objects.create_user("bob", "bob@example.com", PASSWORD)
+        Follow.objects.create(follower=cls.viewer, following=cls.alice)
+
+    def setUp(self):
+        self.mute_celery()
+
+    def test_follow_users_reports_each_item(self):
+        missing = self.bob.id + 100
+        ids = [self.alice.id, self.bob.id, self.viewer.id, missing, self.bob.id]
+        with mock.patch("posts.tasks.add_authors_to_timeline.delay") as backfill:
+            data = self.run_as(self.viewer, "mutation { followUsers(userIds: %s) { results { userId success error } } }" % ids)
+        self.assertEqual(
+            [(r["userId"], r["success"], r["error"]) for r in data["followUsers"]["results"]],
+            [
+                (self.alice.id, False, "Already following this user"),
+                (self.bob.id, True, None),
+                (self.viewer.id, False, "You cannot follow yourself"),
+                (missing, False, "User not found"),
+                (self.bob.id, False, "Duplicate item"),
+            ],
+        )
+        self.assertTrue(Follow.objects.filter(follower=self.viewer, following=self.bob).exists())
+        backfill.assert_called_once_with(self.viewer.id, [self.bob.id])
+
+    def test_a_follow_committed_meanwhile_is_not_reported_as_ours(self):
+        def follow_first(*args, **kwargs):
+            # Another request follows bob between the checks and the insert.
+            Follow.objects.create(follower=self.viewer, following=self.bob)
+            return create_linked_many(*args, **kwargs)
+
+        with mock.patch("users.schema.create_linked_many", follow_first), \
+                mock.patch("posts.tasks.add_authors_to_timeline.delay") as backfill, \
+                mock.patch("users.tasks.refresh_suggestion_neighbourhood.delay") as refresh:
+            data = self.run_as(self.viewer, "mutation { followUsers(userIds: [%d]) { results { success error } } }" % self.bob.id)
+        self.assertEqual(data["followUsers"]["results"], [{"success": False, "error": "Already following this user"}])
+        self.assertEqual(Follow.objects.filter(follower=self.viewer, following=self.bob).count(), 1)
+        backfill.assert_not_called()
+        refresh.assert_not_called()
+
+
+class JWTUserCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+
+    def setUp(self):
+        auth.users.clear()
+        cache.delete_many([key.format(user_id=self.viewer.id) for key in (auth.USER_KEY, auth.VERSION_KEY)])
+
+    def me(self, token):
+        response = self.client.post(
+            "/graphql/", {"query": "{ me { username bio } }"},
+            content_type="application/json", headers={"Authorization": f"JWT {token}"},
+        )
+        return response.json()
+
+    def test_authenticated_reads_run_no_auth_query(self):
+        token = get_token(self.viewer)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.me(token)["data"]["me"]["username"], "viewer")
+        with self.assertNumQueries(0):
+            self.me(token)
+        # Another process (empty local cache) is served from Redis.
+        auth.users.clear()
+        with self.assertNumQueries(0):
+            self.me(token)
+        self.assertNotIn(self.viewer.password, repr(cache.get(auth.USER_KEY.format(user_id=self.viewer.id))))
+
+    def test_profile_changes_are_seen_by_the_next_request(self):
+        token = get_token(self.viewer)
+        self.me(token)
+        user = User.objects.get(pk=self.viewer.pk)
+        user.bio = "new bio"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.me(token)["data"]["me"]["bio"], "new bio")
+
+    def test_a_save_during_a_reload_is_not_cached(self):
+        token = get_token(self.viewer)
+
+        def select_then_save(user_id):
+            values = real_select(user_id)
+            user = User.objects.get(pk=user_id)
+            user.bio = "saved meanwhile"
+            with self.captureOnCommitCallbacks(execute=True):
+                user.save()
+            return values
+
+        real_select = auth._select
+        with mock.patch("users.auth._select", select_then_save):
+            self.assertIsNone(self.me(token)["data"]["me"]["bio"])
+        # The entry written by that reload is older than the save, so Redis does not serve it.
+        auth.users.clear()
+        self.assertEqual(self.me(token)["data"]["me"]["bio"], "saved meanwhile")
+
+    def test_password_change_revokes_earlier_tokens(self):
+        old = get_token(self.viewer)
+        self.me(old)
+        user = User.objects.get(pk=self.viewer.pk)
+        user.set_password("another-password")
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.me(old)["errors"][0]["message"], "Token has been revoked")
+        self.assertEqual(self.me(get_token(user))["data"]["me"]["username"], "viewer")
+
+        result = execute_sync(schema, 'mutation { refreshToken(token: "%s") { token } }' % old)
+        self.assertEqual(result.errors[0].message, "Token has been revoked")
+
+    def test_deactivated_users_are_rejected(self):
+        token = get_token(self.viewer)
+        self.me(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.get(pk=self.viewer.pk)
+            user.is_active = False
+            user.save(update_fields=["is_active"])
+        self.assertEqual(self.me(token)["errors"][0]["message"], "User is disabled")
+
+    def test_the_admin_action_deactivates_cached_users(self):
+        token = get_token(self.viewer)
+        self.me(token)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", PASSWORD))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/admin/users/user/", {"action": "deactivate", "_selected_action": [self.viewer.pk]}
+            )
+        self.client.logout()
+        self.assertFalse(User.objects.get(pk=self.viewer.pk).is_active)
+        self.assertEqual(self.me(token)["errors"][0]["message"], "User is disabled")
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class LoginPipelineTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user("viewer", "viewer@example.com", PASSWORD)
+
+    def setUp(self):
+        cache.delete(login._unknown_key("ghost"))
+        self.mute_celery()
+
+    def test_every_entry_point_hashes_once(self):
+        attempts = {
+            "/api/login/": lambda: self.client.post(
+                "/api/login/", {"username": "viewer", "password": PASSWORD}, content_type="application/json"
+            ).status_code,
+            "/api/token/": lambda: self.client.post(
+                "/api/token/", {"username": "viewer", "password": PASSWORD}, content_type="application/json"
+            ).status_code,
+            "login mutation": lambda: execute_sync(
+                schema,
+                'mutation { login(username: "viewer", password: "%s") { token } }' % PASSWORD,
+                context_value=RequestFactory().post("/graphql/"),
+            ).errors,
+        }
+        expected = {"/api/login/": 200, "/api/token/": 200, "login mutation": None}
+        for name, attempt in attempts.items():
+            with self.subTest(name), mock.patch("users.login._verify", wraps=login._verify) as verify:
+                self.assertEqual(attempt(), expected[name])
+                self.assertEqual(verify.call_count, 1)
+
+    def test_unknown_usernames_skip_the_database_but_not_the_hash(self):
+        with mock.patch("users.login.make_password", wraps=login.make_password) as dummy:
+            self.assertIsNone(authenticate(username="ghost", password=PASSWORD))
+            with self.assertNumQueries(0):
+                self.assertIsNone(authenticate(username="ghost", password=PASSWORD))
+        self.assertEqual(dummy.call_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user("ghost", "ghost@example.com", PASSWORD)
+        self.assertIsNotNone(authenticate(username="ghost", password=PASSWORD))
+
+    def test_wrong_password_is_rejected(self):
+        response = self.client.post(
+            "/api/login/", {"username": "viewer", "password": "wrong"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
@@ -1,4 +1,4 @@
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import login
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -13,18 +13,11 @@ class CustomLoginView(TokenObtainPairView):
 
 class LoginView(APIView):
     def post(self, request):
-        serializer = LoginSerializer(data=request.data)
+        # The serializer checks the password; authenticating again here would hash it twice.
+        serializer = LoginSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            username = serializer.validated_data.get("username")
-            password = serializer.validated_data.get("password")
-            user = authenticate(username=username, password=password)
+            login(request, serializer.validated_data["user"])  # Django session login
+            return Response({"message": "Login successful"}, status=status.HTTP_200_OK)
 
-            if user is not None:
-                login(request, user)  # Django session login
-                return Response({"message": "Login successful"}, status=status.HTTP_200_OK)
-            else:
-                # credentials wrong
-                return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
-
-        # serializer validation failed (bad request)
+        # serializer validation failed (bad request or wrong credentials)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)